@@ -1,9 +1,12 @@
 # MindfulBuddy - AI CONVERSATION VERSION v5.0
 import streamlit as st
-import json
-import hashlib
 from datetime import datetime
 import plotly.graph_objects as go
+import chat_render
+import chat_router
+import conversation_state
+import data_store
+import sso_service
 
 # Page config
 st.set_page_config(
@@ -77,42 +80,9 @@ st.markdown("""
 def generate_ai_response(user_message, conversation_history, user_mood=None):
     """Generate contextual AI responses based on conversation and mood"""
     
-    user_message_lower = user_message.lower()
-    
-    # Mood-based responses
-    if user_mood:
-        if user_mood <= 3:
-            return generate_supportive_response(user_message, conversation_history)
-        elif user_mood >= 8:
-            return generate_encouraging_response(user_message, conversation_history)
-    
-    # Context-aware responses based on keywords
-    if any(word in user_message_lower for word in ['sad', 'depressed', 'down', 'awful', 'terrible']):
-        return generate_empathetic_response(user_message, conversation_history)
-    
-    elif any(word in user_message_lower for word in ['anxious', 'worried', 'nervous', 'stressed', 'panic']):
-        return generate_calming_response(user_message, conversation_history)
-    
-    elif any(word in user_message_lower for word in ['angry', 'mad', 'frustrated', 'annoyed']):
-        return generate_understanding_response(user_message, conversation_history)
-    
-    elif any(word in user_message_lower for word in ['happy', 'good', 'great', 'amazing', 'wonderful']):
-        return generate_positive_response(user_message, conversation_history)
-    
-    elif any(word in user_message_lower for word in ['school', 'work', 'job', 'study', 'exam', 'test']):
-        return generate_academic_support_response(user_message, conversation_history)
-    
-    elif any(word in user_message_lower for word in ['family', 'parents', 'mom', 'dad', 'brother', 'sister']):
-        return generate_family_support_response(user_message, conversation_history)
-    
-    elif any(word in user_message_lower for word in ['friend', 'friends', 'social', 'lonely', 'alone']):
-        return generate_social_support_response(user_message, conversation_history)
-    
-    elif any(word in user_message_lower for word in ['help', 'advice', 'what should', 'how can']):
-        return generate_advice_response(user_message, conversation_history)
-    
-    else:
-        return generate_general_response(user_message, conversation_history)
+    # Mood-based responses first, then the topic of the message (see chat_router)
+    responder = RESPONDERS.get(chat_router.intent(user_message, user_mood), generate_general_response)
+    return responder(user_message, conversation_history)
 
 def generate_supportive_response(message, history):
     """Responses for low mood situations"""
@@ -124,10 +94,11 @@ def generate_supportive_response(message, history):
         "I want you to know that reaching out when you feel this way shows real strength. You don't have to go through this alone. Is there anything specific that's been weighing on your mind?"
     ]
     
-    # Consider conversation history for more context
+    # Consider conversation history for more context (history is a ConversationState)
     if len(history) > 2:
-        if any('school' in msg['message'].lower() for msg in history[-3:]):
-            return "I remember you mentioned school earlier. Academic pressure can really weigh us down. It's okay to feel overwhelmed - you're dealing with a lot. What's the biggest source of stress for you right now?"
+        # Any academic keyword (school, work, job, study, exam, test), so the reply names more than school
+        if history.mentioned('academic', within=3):
+            return "I remember you mentioned school or work earlier. That kind of pressure can really weigh us down. It's okay to feel overwhelmed - you're dealing with a lot. What's the biggest source of stress for you right now?"
     
     import random
     return random.choice(responses)
@@ -188,6 +159,19 @@ def generate_positive_response(message, history):
     import random
     return random.choice(responses)
 
+def generate_encouraging_response(message, history):
+    """Responses for high moods"""
+    responses = [
+        "It's so good to see you in such a great place today! What's been helping you feel this way?",
+        "You're clearly having a strong day, and that's worth noticing. What's one thing you want to remember about how today feels?",
+        "I love this energy! Good days like this are a great time to build on what's working. Is there something you've been wanting to start?",
+        "It sounds like things are really going well for you. You deserve to enjoy it. Who would you like to share this good feeling with?",
+        "Your mood is shining through! Moments like this can be something to look back on when things feel harder. What made today so good?"
+    ]
+    
+    import random
+    return random.choice(responses)
+
 def generate_academic_support_response(message, history):
     """Responses for school/work stress"""
     responses = [
@@ -253,23 +237,35 @@ def generate_general_response(message, history):
     import random
     return random.choice(responses)
 
-# Data functions
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# chat_router intent -> responder
+RESPONDERS = {
+    'low_mood': generate_supportive_response,
+    'high_mood': generate_encouraging_response,
+    'sadness': generate_empathetic_response,
+    'anxiety': generate_calming_response,
+    'anger': generate_understanding_response,
+    'positive': generate_positive_response,
+    'academic': generate_academic_support_response,
+    'family': generate_family_support_response,
+    'social': generate_social_support_response,
+    'advice': generate_advice_response,
+}
 
+# Data functions
 def load_conversation_data():
-    try:
-        with open('conversation_data.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {
-            'users': {},
-            'conversations': {}
-        }
+    return data_store.open_store('conversation', {
+        'users': {},
+        'conversations': {}
+    })
+
+def new_conversation_user():
+    """This app's record for a user signed in through another app"""
+    return {'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
 
-def save_conversation_data(data):
-    with open('conversation_data.json', 'w') as file:
-        json.dump(data, file, indent=2)
+def load_conversation(store, username):
+    """The session's state of a user's conversation: its latest messages only"""
+    return conversation_state.ConversationState(store.messages(username, limit=conversation_state.HOT_MESSAGES),
+                                                store.message_count(username))
 
 # Main app
 st.markdown("""
@@ -281,15 +277,25 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load data
-app_data = load_conversation_data()
+store = load_conversation_data()
 
 # Initialize session state
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 if 'conversation' not in st.session_state:
-    st.session_state.conversation = []
+    st.session_state.conversation = conversation_state.ConversationState()
 if 'current_mood' not in st.session_state:
     st.session_state.current_mood = None
+if 'chat_shown' not in st.session_state:
+    st.session_state.chat_shown = chat_render.WINDOW
+
+# Signed in through the shared identity service; a one-time ?sso=<code> carries the login between apps
+if 'sso' in st.query_params or st.session_state.get('sso_token'):
+    signed_in = sso_service.resume(store, st.session_state, st.query_params, new_conversation_user)
+    if signed_in != st.session_state.current_user:
+        st.session_state.current_user = signed_in
+        st.session_state.conversation = load_conversation(store, signed_in) if signed_in else conversation_state.ConversationState()
+        st.session_state.chat_shown = chat_render.WINDOW
 
 # Authentication
 if st.session_state.current_user is None:
@@ -303,10 +309,12 @@ if st.session_state.current_user is None:
         
         if st.button("💬 Start Conversation", type="primary"):
             if login_name and login_password:
-                if login_name in app_data['users'] and app_data['users'][login_name]['password_hash'] == hash_password(login_password):
+                signed_in = sso_service.sign_in(store, login_name, login_password, new_conversation_user)
+                if signed_in:
+                    sso_service.keep(st.session_state, st.query_params, signed_in['token'])
                     st.session_state.current_user = login_name
-                    if login_name in app_data['conversations']:
-                        st.session_state.conversation = app_data['conversations'][login_name]
+                    st.session_state.conversation = load_conversation(store, login_name)
+                    st.session_state.chat_shown = chat_render.WINDOW
                     st.rerun()
                 else:
                     st.error("Invalid credentials")
@@ -316,17 +324,15 @@ if st.session_state.current_user is None:
         signup_password = st.text_input("Create Password:", type="password", key="signup_pass")
         
         if st.button("🤖 Create AI Account", type="primary"):
-            if signup_name and signup_password and signup_name not in app_data['users']:
-                app_data['users'][signup_name] = {
-                    'password_hash': hash_password(signup_password),
-                    'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-                app_data['conversations'][signup_name] = []
-                save_conversation_data(app_data)
-                st.session_state.current_user = signup_name
-                st.session_state.conversation = []
-                st.success(f"Welcome, {signup_name}! Let's start talking.")
-                st.rerun()
+            if signup_name and signup_password:
+                token = sso_service.sign_up(store, signup_name, signup_password, new_conversation_user())
+                if token:
+                    sso_service.keep(st.session_state, st.query_params, token)
+                    st.session_state.current_user = signup_name
+                    st.session_state.conversation.clear()
+                    st.session_state.chat_shown = chat_render.WINDOW
+                    st.success(f"Welcome, {signup_name}! Let's start talking.")
+                    st.rerun()
 
 else:
     # Main conversation interface
@@ -337,17 +343,13 @@ else:
     with col1:
         st.markdown(f"### 💬 Conversation with AI - {user_name}")
         
-        # Display conversation
-        chat_html = '<div class="chat-container">'
-        
-        for msg in st.session_state.conversation:
-            if msg['sender'] == 'user':
-                chat_html += f'<div class="user-message">{msg["message"]}</div>'
-            else:
-                chat_html += f'<div class="ai-message">🤖 {msg["message"]}</div>'
-        
-        chat_html += '</div>'
-        st.markdown(chat_html, unsafe_allow_html=True)
+        # Display the latest messages; earlier ones a page at a time (see chat_render)
+        hidden = chat_render.earlier(st.session_state.conversation, st.session_state.chat_shown)
+        if hidden and st.button(f"⬆️ Load earlier messages ({hidden} more)"):
+            st.session_state.chat_shown += chat_render.WINDOW
+            st.rerun()
+        st.markdown(chat_render.transcript(st.session_state.conversation, st.session_state.chat_shown,
+                                           load=lambda shown: store.messages(user_name, limit=shown)), unsafe_allow_html=True)
         
         # Message input
         user_message = st.text_area("💬 Talk to your AI therapist:", height=100, placeholder="Share what's on your mind... I'm here to listen and support you.")
@@ -358,33 +360,34 @@ else:
             if st.button("📤 Send Message", type="primary", use_container_width=True):
                 if user_message:
                     # Add user message
-                    st.session_state.conversation.append({
+                    user_entry = {
                         'sender': 'user',
                         'message': user_message,
                         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    })
+                    }
+                    st.session_state.conversation.append(user_entry)
                     
                     # Generate AI response
                     ai_response = generate_ai_response(user_message, st.session_state.conversation, st.session_state.current_mood)
                     
                     # Add AI response
-                    st.session_state.conversation.append({
+                    ai_entry = {
                         'sender': 'ai',
                         'message': ai_response,
                         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    })
+                    }
+                    st.session_state.conversation.append(ai_entry)
                     
-                    # Save conversation
-                    app_data['conversations'][user_name] = st.session_state.conversation
-                    save_conversation_data(app_data)
+                    # Save only the new messages
+                    store.add_messages(user_name, [user_entry, ai_entry])
                     
                     st.rerun()
         
         with col1_2:
             if st.button("🗑️ Clear Chat", use_container_width=True):
-                st.session_state.conversation = []
-                app_data['conversations'][user_name] = []
-                save_conversation_data(app_data)
+                st.session_state.conversation.clear()
+                st.session_state.chat_shown = chat_render.WINDOW
+                store.clear_messages(user_name)
                 st.rerun()
     
     with col2:
@@ -414,15 +417,21 @@ else:
         
         st.markdown("### 📋 Conversation Stats")
         if st.session_state.conversation:
-            user_messages = len([m for m in st.session_state.conversation if m['sender'] == 'user'])
-            ai_messages = len([m for m in st.session_state.conversation if m['sender'] == 'ai'])
-            st.metric("Messages Exchanged", user_messages + ai_messages)
-            st.metric("Your Messages", user_messages)
-            st.metric("AI Responses", ai_messages)
+            user_messages = st.session_state.conversation.messages_from('user')
+            ai_messages = st.session_state.conversation.messages_from('ai')
+            st.metric("Messages Exchanged", st.session_state.conversation.total)
+            # Counted over the recent messages the session holds, not the whole history
+            recent = f"Of the latest {len(st.session_state.conversation)} messages"
+            st.metric("Your Recent Messages", user_messages, help=recent)
+            st.metric("Recent AI Responses", ai_messages, help=recent)
+            st.metric("Conversation Tone", {'positive': "😊 Positive", 'low': "💙 Low", 'neutral': "😐 Neutral"}[st.session_state.conversation.tone()])
         
         if st.button("🚪 Logout", use_container_width=True):
+            sso_service.sign_out(st.session_state, st.query_params)
+            st.query_params.clear()
             st.session_state.current_user = None
-            st.session_state.conversation = []
+            st.session_state.conversation.clear()
+            st.session_state.chat_shown = chat_render.WINDOW
             st.session_state.current_mood = None
             st.rerun()
 
@@ -1,12 +1,13 @@
 # Mental Health Bot - AI PREDICTION VERSION!
 import streamlit as st
-import json
 import os
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
 import numpy as np
 from sklearn.linear_model import LinearRegression
 import pandas as pd
+import data_store
+import mood_columns
 
 # Set page config
 st.set_page_config(
@@ -51,36 +52,24 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 def load_user_data():
-    try:
-        with open('ai_user_data.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
+    return data_store.open_store('ai', {})
 
-def save_user_data(data):
-    with open('ai_user_data.json', 'w') as file:
-        json.dump(data, file, indent=2)
-
-def predict_future_mood(mood_history):
+def predict_future_mood(columns):
     """AI mood prediction using machine learning"""
-    if len(mood_history) < 5:
+    if len(columns) < 5:
         return None, "Need more data for predictions"
     
-    # Prepare data
-    dates = [datetime.strptime(entry['date'].split()[0], '%Y-%m-%d') for entry in mood_history]
-    moods = [entry['mood'] for entry in mood_history]
-    
-    # Convert dates to numbers for ML
-    start_date = dates[0]
-    X = np.array([(date - start_date).days for date in dates]).reshape(-1, 1)
-    y = np.array(moods)
+    # Day numbers straight from the columnar history
+    days = columns.days()
+    X = (days - days[0]).reshape(-1, 1)
+    y = columns.mood
     
     # Train simple AI model
     model = LinearRegression()
     model.fit(X, y)
     
     # Predict next 7 days
-    last_day = (dates[-1] - start_date).days
+    last_day = int(days[-1] - days[0])
     future_days = np.array([last_day + i for i in range(1, 8)]).reshape(-1, 1)
     predictions = model.predict(future_days)
     
@@ -199,28 +188,29 @@ st.markdown('<h1 class="main-header">🤖 AI Mental Health Buddy</h1>', unsafe_a
 st.markdown('<p style="text-align: center; font-size: 1.2rem; color: #666;">Powered by Artificial Intelligence for smarter mental health insights</p>', unsafe_allow_html=True)
 
 # Load data
-user_data = load_user_data()
+store = load_user_data()
+user_names = store.list_users()
+user_name = user_names[0] if user_names else None
+mood_history = store.mood_history(user_name) if user_name else []
 
 # Sidebar
 with st.sidebar:
     st.header("🤖 AI Dashboard")
     
-    if 'name' not in user_data:
+    if user_name is None:
         name = st.text_input("What's your name?", key="name_input")
         if name:
-            user_data['name'] = name
-            user_data['mood_history'] = []
-            save_user_data(user_data)
+            store.create_user(name, {})
             st.success(f"Nice to meet you, {name}! 🤖")
             st.rerun()
     else:
-        st.success(f"Welcome back, {user_data['name']}! 🤖")
+        st.success(f"Welcome back, {user_name}! 🤖")
         
-        if user_data.get('mood_history'):
-            st.write(f"📊 Total check-ins: {len(user_data['mood_history'])}")
+        if mood_history:
+            st.write(f"📊 Total check-ins: {len(mood_history)}")
             
             # AI readiness indicator
-            data_count = len(user_data['mood_history'])
+            data_count = len(mood_history)
             if data_count >= 10:
                 st.success("🤖 AI: Fully operational!")
             elif data_count >= 5:
@@ -229,17 +219,17 @@ with st.sidebar:
                 st.info("🤖 AI: Gathering data...")
 
 # Main content
-if 'name' in user_data:
+if user_name is not None:
     
     # AI Predictions Section
-    if len(user_data.get('mood_history', [])) >= 5:
+    if len(mood_history) >= 5:
         st.header("🔮 AI Mood Predictions")
         
-        predictions, status = predict_future_mood(user_data['mood_history'])
+        predictions, status = predict_future_mood(mood_columns.load(store, user_name))
         
         if predictions is not None:
             # Show prediction chart
-            fig = create_prediction_chart(user_data['mood_history'], predictions)
+            fig = create_prediction_chart(mood_history, predictions)
             if fig:
                 st.plotly_chart(fig, use_container_width=True)
             
@@ -289,31 +279,27 @@ if 'name' in user_data:
             today = datetime.now().strftime("%Y-%m-%d %H:%M")
             
             # Add to history
-            if 'mood_history' not in user_data:
-                user_data['mood_history'] = []
-            
             entry = {'date': today, 'mood': mood_score}
             if note:
                 entry['note'] = note
             
-            user_data['mood_history'].append(entry)
-            save_user_data(user_data)
+            store.add_mood_entry(user_name, entry)
             
             st.success("✅ Data submitted to AI for analysis!")
             st.rerun()
     
     with col2:
         # AI Insights
-        if user_data.get('mood_history'):
+        if mood_history:
             st.header("🧠 AI Insights")
             
-            insights = analyze_patterns_ai(user_data['mood_history'])
+            insights = analyze_patterns_ai(mood_history)
             
             for insight in insights:
                 st.write(f"• {insight}")
             
             # Quick stats
-            moods = [entry['mood'] for entry in user_data['mood_history']]
+            moods = [entry['mood'] for entry in mood_history]
             st.metric("AI Confidence", f"{min(len(moods) * 10, 100)}%")
             st.metric("Pattern Strength", f"{min(len(moods) * 15, 100)}%")
 
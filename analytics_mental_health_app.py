@@ -1,7 +1,6 @@
 # MindfulBuddy - ADVANCED ANALYTICS VERSION 3.0
 import streamlit as st
 import json
-import hashlib
 import secrets
 import pandas as pd
 import numpy as np
@@ -10,6 +9,9 @@ import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
 import calendar
+import data_store
+import mood_columns
+import sso_service
 
 # Advanced page config
 st.set_page_config(
@@ -129,23 +131,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Security functions (from previous version)
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(password, hashed):
-    return hash_password(password) == hashed
-
 def generate_session_token():
     return secrets.token_urlsafe(32)
 
 # Advanced Analytics Functions
-def calculate_mood_trends(mood_history):
+def calculate_mood_trends(columns):
     """Calculate advanced mood trends and patterns"""
-    if len(mood_history) < 2:
+    if len(columns) < 2:
         return {}
     
-    df = pd.DataFrame(mood_history)
-    df['date'] = pd.to_datetime(df['date'])
+    df = pd.DataFrame({'date': columns.dates(), 'mood': columns.mood})
     df['day_of_week'] = df['date'].dt.day_name()
     df['week'] = df['date'].dt.isocalendar().week
     df['month'] = df['date'].dt.month
@@ -353,30 +348,32 @@ def create_insights_report(trends, mood_history):
     
     return insights
 
+def default_analytics_data():
+    """Initial layout of the analytics store"""
+    return {
+        'users': {},
+        'sessions': {},
+        'analytics': {
+            'total_reports_generated': 0,
+            'advanced_insights_enabled': True
+        },
+        'app_metadata': {
+            'version': '3.0.0',
+            'analytics_level': 'professional',
+            'ai_insights': True
+        }
+    }
+
 def load_analytics_data():
     """Load app data with analytics capabilities"""
-    try:
-        with open('analytics_app_data.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {
-            'users': {},
-            'sessions': {},
-            'analytics': {
-                'total_reports_generated': 0,
-                'advanced_insights_enabled': True
-            },
-            'app_metadata': {
-                'version': '3.0.0',
-                'analytics_level': 'professional',
-                'ai_insights': True
-            }
-        }
+    return data_store.open_store('analytics', default_analytics_data)
 
-def save_analytics_data(data):
-    """Save analytics data"""
-    with open('analytics_app_data.json', 'w') as file:
-        json.dump(data, file, indent=2)
+def new_analytics_user():
+    """This app's record for a user signed in through another app"""
+    return {
+        'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'account_type': 'analytics_professional'
+    }
 
 # Analytics header
 st.markdown("""
@@ -395,12 +392,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load data
-app_data = load_analytics_data()
+store = load_analytics_data()
 
 # Session management (simplified for analytics focus)
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 
+# Signed in through the shared identity service; a one-time ?sso=<code> carries the login between apps
+if 'sso' in st.query_params or st.session_state.get('sso_token'):
+    st.session_state.current_user = sso_service.resume(store, st.session_state, st.query_params, new_analytics_user)
+
 # Main interface
 if st.session_state.current_user is None:
     # Login section (simplified)
@@ -449,7 +450,9 @@ if st.session_state.current_user is None:
         
         if st.button("📊 Access Analytics", type="primary", use_container_width=True):
             if login_name and login_password:
-                if login_name in app_data['users'] and verify_password(login_password, app_data['users'][login_name]['password_hash']):
+                signed_in = sso_service.sign_in(store, login_name, login_password, new_analytics_user)
+                if signed_in:
+                    sso_service.keep(st.session_state, st.query_params, signed_in['token'])
                     st.session_state.current_user = login_name
                     st.success(f"📊 Welcome to Analytics, {login_name}!")
                     st.rerun()
@@ -463,14 +466,10 @@ if st.session_state.current_user is None:
         signup_password = st.text_input("Password:", key="signup_password", type="password")
         
         if st.button("📊 Create Analytics Account", type="primary", use_container_width=True):
-            if signup_name and signup_password and signup_name not in app_data['users']:
-                app_data['users'][signup_name] = {
-                    'password_hash': hash_password(signup_password),
-                    'mood_history': [],
-                    'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'account_type': 'analytics_professional'
-                }
-                save_analytics_data(app_data)
+            token = sso_service.sign_up(store, signup_name, signup_password, new_analytics_user()) \
+                if signup_name and signup_password else None
+            if token:
+                sso_service.keep(st.session_state, st.query_params, token)
                 st.session_state.current_user = signup_name
                 st.success(f"📊 Analytics account created! Welcome, {signup_name}!")
                 st.rerun()
@@ -479,7 +478,8 @@ if st.session_state.current_user is None:
 
 else:
     # Analytics dashboard for logged-in users
-    user_data = app_data['users'][st.session_state.current_user]
+    mood_history = store.mood_history(st.session_state.current_user)
+    history_columns = mood_columns.load(store, st.session_state.current_user)
     
     # Navigation
     nav_choice = st.radio(
@@ -491,19 +491,19 @@ else:
     if nav_choice == "📈 Dashboard":
         st.markdown("### 📊 Advanced Analytics Dashboard")
         
-        if user_data.get('mood_history') and len(user_data['mood_history']) >= 2:
+        if mood_history and len(mood_history) >= 2:
             # Calculate trends
-            trends = calculate_mood_trends(user_data['mood_history'])
+            trends = calculate_mood_trends(history_columns)
             
             # Key metrics row
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                total_entries = len(user_data['mood_history'])
+                total_entries = len(mood_history)
                 st.metric("📊 Total Entries", total_entries)
             
             with col2:
-                avg_mood = sum(entry['mood'] for entry in user_data['mood_history']) / total_entries
+                avg_mood = sum(entry['mood'] for entry in mood_history) / total_entries
                 st.metric("📈 Average Mood", f"{avg_mood:.1f}/10")
             
             with col3:
@@ -516,13 +516,13 @@ else:
                 st.metric("🔄 Trend", trend_text)
             
             # Advanced charts
-            fig = create_advanced_mood_chart(user_data['mood_history'])
+            fig = create_advanced_mood_chart(mood_history)
             if fig:
                 st.plotly_chart(fig, use_container_width=True)
             
             # AI Insights
             st.markdown("### 🧠 AI-Powered Insights")
-            insights = create_insights_report(trends, user_data['mood_history'])
+            insights = create_insights_report(trends, mood_history)
             
             for insight in insights:
                 st.markdown(f"""
@@ -586,11 +586,7 @@ else:
             if note:
                 entry['note'] = note
             
-            if 'mood_history' not in user_data:
-                user_data['mood_history'] = []
-            
-            user_data['mood_history'].append(entry)
-            save_analytics_data(app_data)
+            store.add_mood_entry(st.session_state.current_user, entry)
             
             st.success("📊 Enhanced analytics data recorded!")
             st.balloons()
@@ -598,8 +594,8 @@ else:
     elif nav_choice == "🧠 AI Insights":
         st.markdown("### 🧠 AI-Powered Mental Health Insights")
         
-        if user_data.get('mood_history') and len(user_data['mood_history']) >= 5:
-            trends = calculate_mood_trends(user_data['mood_history'])
+        if mood_history and len(mood_history) >= 5:
+            trends = calculate_mood_trends(history_columns)
             
             # Detailed insights sections
             st.markdown("#### 📈 Trend Analysis")
@@ -644,7 +640,7 @@ else:
     elif nav_choice == "📋 Reports":
         st.markdown("### 📋 Professional Analytics Reports")
         
-        if user_data.get('mood_history'):
+        if mood_history:
             # Report generation
             report_type = st.selectbox(
                 "Report Type:",
@@ -658,7 +654,7 @@ else:
                 st.markdown(f"**Report Type:** {report_type}")
                 
                 # Summary statistics
-                moods = [entry['mood'] for entry in user_data['mood_history']]
+                moods = [entry['mood'] for entry in mood_history]
                 
                 col1, col2, col3 = st.columns(3)
                 with col1:
@@ -669,8 +665,8 @@ else:
                     st.metric("🎯 Highest Mood", max(moods))
                 
                 # Trend analysis
-                trends = calculate_mood_trends(user_data['mood_history'])
-                insights = create_insights_report(trends, user_data['mood_history'])
+                trends = calculate_mood_trends(history_columns)
+                insights = create_insights_report(trends, mood_history)
                 
                 st.markdown("#### 📝 Key Findings")
                 for insight in insights:
@@ -688,7 +684,7 @@ else:
                         'lowest_mood': min(moods)
                     },
                     'insights': insights,
-                    'raw_data': user_data['mood_history']
+                    'raw_data': mood_history
                 }
                 
                 st.download_button(
@@ -705,9 +701,11 @@ else:
         
         st.write(f"**Account:** {st.session_state.current_user}")
         st.write(f"**Analytics Level:** Professional")
-        st.write(f"**Data Points:** {len(user_data.get('mood_history', []))}")
+        st.write(f"**Data Points:** {len(mood_history)}")
         
         if st.button("🚪 Logout", use_container_width=True):
+            sso_service.sign_out(st.session_state, st.query_params)
+            st.query_params.clear()
             st.session_state.current_user = None
             st.rerun()
 
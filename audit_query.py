@@ -0,0 +1,449 @@
+# MindfulBuddy - Security audit queries
+"""Indexed queries over an app's security log (see security_log).
+
+Every log file gets an index of byte offsets:
+
+    buckets   minute ("2025-09-01 10:42") -> event type -> offsets
+    users     username -> offsets
+
+so a query only reads the lines its time range, event type and user
+select, and counts per minute, hour or day come from the index alone.
+Rotated files never change, so their index is written once beside them
+(00000001.idx) and loaded on later runs. The current file is indexed
+incrementally from where the last refresh stopped. A background thread
+(open_index) keeps everything indexed; a query first indexes whatever is
+still missing.
+
+    python audit_query.py query --event LOGIN_FAILED --since "2025-09-01 10:00" --format csv
+    python audit_query.py bursts --threshold 20
+    python audit_query.py benchmark --events 1000000
+"""
+import argparse
+import array
+import bisect
+import csv
+import heapq
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import data_store
+import security_log
+
+INDEX_INTERVAL = float(os.environ.get('MINDFUL_AUDIT_INDEX_SECONDS', '30'))
+INDEX_SUFFIX = '.idx'
+EXPORT_FIELDS = ['timestamp', 'event', 'username', 'details']
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Timestamp prefix lengths of each bucket resolution
+RESOLUTIONS = {'minute': 16, 'hour': 13, 'day': 10}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _stamp(value):
+    """A query bound as a log timestamp string (or a prefix of one)"""
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime(TIME_FORMAT)
+
+
+def _before(timestamp, until):
+    """Whether timestamp is at or before until; a prefix bound such as
+    '2025-09-01' includes all of that day"""
+    return timestamp[:len(until)] <= until
+
+
+class FileIndex:
+    """Offsets of one log file's events by minute, event type and user"""
+
+    def __init__(self, inode):
+        self.inode = inode
+        self.size = 0
+        self.count = 0
+        self.first = self.last = None
+        self.buckets = {}
+        self.users = {}
+        self._keys = []
+        self.saved = False
+
+    def _add(self, offset, event):
+        timestamp = str(event.get('timestamp', ''))
+        minute = timestamp[:RESOLUTIONS['minute']]
+        by_event = self.buckets.get(minute)
+        if by_event is None:
+            by_event = self.buckets[minute] = {}
+            bisect.insort(self._keys, minute)
+        by_event.setdefault(event.get('event'), array.array('Q')).append(offset)
+        self.users.setdefault(event.get('username'), array.array('Q')).append(offset)
+        self.first = timestamp if self.first is None else min(self.first, timestamp)
+        self.last = timestamp if self.last is None else max(self.last, timestamp)
+        self.count += 1
+
+    def update(self, file):
+        """Index the complete lines added to an open file since the last update"""
+        file.seek(self.size)
+        data = file.read()
+        offset = self.size
+        for line in data[:data.rfind(b'\n') + 1].splitlines(keepends=True):
+            event = security_log._parse(line)
+            if event is not None:
+                self._add(offset, event)
+            offset += len(line)
+        self.size = offset
+
+    def offsets(self, event=None, username=None, since=None, until=None):
+        """Sorted offsets of candidate lines (exact up to the minute)"""
+        if event is None and since is None and until is None:
+            return self.users.get(username, ()) if username is not None else None
+        start = bisect.bisect_left(self._keys, since[:RESOLUTIONS['minute']]) if since else 0
+        end = bisect.bisect_right(self._keys, until[:RESOLUTIONS['minute']] + '\x7f') if until else len(self._keys)
+        postings = []
+        for minute in self._keys[start:end]:
+            by_event = self.buckets[minute]
+            if event is not None:
+                if event in by_event:
+                    postings.append(by_event[event])
+            else:
+                postings.extend(by_event.values())
+        offsets = heapq.merge(*postings)
+        if username is not None:
+            wanted = set(self.users.get(username, ()))
+            offsets = (offset for offset in offsets if offset in wanted)
+        return offsets
+
+    def counts(self, event=None, resolution='minute'):
+        """Events per bucket from the index alone"""
+        width = RESOLUTIONS[resolution]
+        totals = {}
+        for minute in self._keys:
+            by_event = self.buckets[minute]
+            if event is not None:
+                count = len(by_event.get(event, ()))
+            else:
+                count = sum(map(len, by_event.values()))
+            if count:
+                totals[minute[:width]] = totals.get(minute[:width], 0) + count
+        return totals
+
+    def to_json(self):
+        return {
+            'size': self.size, 'count': self.count, 'first': self.first, 'last': self.last,
+            'buckets': {minute: {str(event): offsets.tolist() for event, offsets in by_event.items()}
+                        for minute, by_event in self.buckets.items()},
+            'users': {str(username): offsets.tolist() for username, offsets in self.users.items()},
+        }
+
+    @classmethod
+    def from_json(cls, inode, data):
+        index = cls(inode)
+        index.size, index.count = data['size'], data['count']
+        index.first, index.last = data['first'], data['last']
+        index.buckets = {minute: {event: array.array('Q', offsets) for event, offsets in by_event.items()}
+                         for minute, by_event in data['buckets'].items()}
+        index.users = {username: array.array('Q', offsets) for username, offsets in data['users'].items()}
+        index._keys = sorted(index.buckets)
+        index.saved = True
+        return index
+
+
+def _index_path(log_path):
+    return log_path[:-len('.log')] + INDEX_SUFFIX
+
+
+def _load_index(log_path, stat):
+    """The saved index of a rotated file, if it matches the file"""
+    try:
+        with open(_index_path(log_path), encoding='utf-8') as file:
+            data = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data.get('size') != stat.st_size:
+        return None
+    return FileIndex.from_json(stat.st_ino, data)
+
+
+def _save_index(log_path, index):
+    temp_path = _index_path(log_path) + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(index.to_json(), file, separators=(',', ':'))
+    os.replace(temp_path, _index_path(log_path))
+    index.saved = True
+
+
+class AuditIndex:
+    """Indexes over every file of one security log"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.current = os.path.join(directory, security_log.CURRENT_FILE)
+        self._files = {}  # inode -> FileIndex
+        self._lock = threading.Lock()
+
+    def refresh(self) -> list:
+        """Index whatever the files gained; returns [(path, FileIndex)] oldest first"""
+        with self._lock:
+            # List and open under the log's lock so a rotation can't slip between
+            with data_store.store_lock(self.current):
+                rotated = security_log.log_files(self.directory)[:-1]
+                try:
+                    current = open(self.current, 'rb')
+                except FileNotFoundError:
+                    current = None
+            indexed = []
+            try:
+                for path in rotated:
+                    stat = os.stat(path)
+                    index = self._files.get(stat.st_ino) or _load_index(path, stat)
+                    if index is None:
+                        index = FileIndex(stat.st_ino)
+                    if index.size < stat.st_size:
+                        with open(path, 'rb') as file:
+                            index.update(file)
+                    if not index.saved:
+                        _save_index(path, index)
+                    self._files[stat.st_ino] = index
+                    indexed.append((path, index))
+                if current:
+                    inode = os.fstat(current.fileno()).st_ino
+                    index = self._files.setdefault(inode, FileIndex(inode))
+                    index.update(current)
+                    indexed.append((self.current, index))
+            finally:
+                if current:
+                    current.close()
+            return indexed
+
+    def query(self, event=None, username=None, since=None, until=None, limit=None):
+        """Matching events oldest first, streamed (limit: the newest ones)"""
+        since, until = _stamp(since), _stamp(until)
+        files = [(path, index) for path, index in self.refresh()
+                 if index.count and (since is None or index.last >= since)
+                 and (until is None or _before(index.first, until))]
+        if limit is not None:
+            return iter(self._newest(files, event, username, since, until, limit))
+        return self._scan(files, event, username, since, until)
+
+    def _read(self, path, index, offsets):
+        """Events at offsets of a file, even if it was rotated meanwhile"""
+        if os.stat(path).st_ino != index.inode:
+            renamed = [other for other in security_log.log_files(self.directory)[:-1]
+                       if os.stat(other).st_ino == index.inode]
+            if not renamed:
+                return
+            path = renamed[0]
+        with open(path, 'rb') as file:
+            for offset in offsets:
+                file.seek(offset)
+                event = security_log._parse(file.readline())
+                if event is not None:
+                    yield event
+
+    def _matches(self, event, event_type, username, since, until):
+        timestamp = str(event.get('timestamp', ''))
+        return ((event_type is None or event.get('event') == event_type)
+                and (username is None or event.get('username') == username)
+                and (since is None or timestamp >= since) and (until is None or _before(timestamp, until)))
+
+    def _scan(self, files, event_type, username, since, until):
+        for path, index in files:
+            offsets = index.offsets(event_type, username, since, until)
+            if offsets is None:
+                offsets = heapq.merge(*index.users.values())
+            for event in self._read(path, index, offsets):
+                if self._matches(event, event_type, username, since, until):
+                    yield event
+
+    def _newest(self, files, event_type, username, since, until, limit):
+        found = []
+        for path, index in reversed(files):
+            offsets = index.offsets(event_type, username, since, until)
+            offsets = sorted(offsets if offsets is not None else heapq.merge(*index.users.values()), reverse=True)
+            # Read back from the end until enough match
+            for start in range(0, len(offsets), limit):
+                batch = sorted(offsets[start:start + limit])
+                matched = [event for event in self._read(path, index, batch)
+                           if self._matches(event, event_type, username, since, until)]
+                found[:0] = matched
+                if len(found) >= limit:
+                    return found[-limit:]
+        return found
+
+    def counts(self, event=None, resolution='minute', since=None, until=None) -> dict:
+        """Events per minute, hour or day (bucket granularity), oldest first"""
+        since, until = _stamp(since), _stamp(until)
+        width = RESOLUTIONS[resolution]
+        totals = {}
+        for _, index in self.refresh():
+            for bucket, count in index.counts(event, resolution).items():
+                if (since is None or bucket >= since[:width]) and (until is None or bucket <= until[:width]):
+                    totals[bucket] = totals.get(bucket, 0) + count
+        return dict(sorted(totals.items()))
+
+    def bursts(self, event='LOGIN_FAILED', threshold=10, resolution='minute', since=None, until=None) -> list:
+        """[(bucket, count)] of buckets with at least threshold events"""
+        return [(bucket, count) for bucket, count in self.counts(event, resolution, since, until).items()
+                if count >= threshold]
+
+    def export(self, out, format='ndjson', **query) -> int:
+        """Stream matching events to a text file as CSV or NDJSON; returns how many"""
+        written = 0
+        if format == 'csv':
+            writer = csv.DictWriter(out, EXPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for event in self.query(**query):
+                writer.writerow(event)
+                written += 1
+        else:
+            for event in self.query(**query):
+                out.write(json.dumps(event) + '\n')
+                written += 1
+        return written
+
+    def start(self, interval=INDEX_INTERVAL):
+        """Keep the index up to date from a background thread"""
+        threading.Thread(target=_index_forever, args=(self, interval),
+                         name=f"audit-index:{self.directory}", daemon=True).start()
+        return self
+
+
+def _index_forever(index, interval):
+    while True:
+        try:
+            index.refresh()
+        except OSError:
+            pass  # e.g. the disk is full; try again next round
+        time.sleep(interval)
+
+
+def open_index(name) -> AuditIndex:
+    """Process-wide audit index of an app's security log, kept up to date
+    in the background"""
+    with _indexes_lock:
+        if name not in _indexes:
+            # Absolute: the background thread must not follow a chdir
+            directory = os.path.abspath(os.path.join(security_log.LOG_DIR, name))
+            os.makedirs(directory, exist_ok=True)
+            _indexes[name] = AuditIndex(directory).start()
+        return _indexes[name]
+
+
+def write_synthetic_log(directory, events, users=1000, max_bytes=security_log.MAX_BYTES):
+    """A log of events one second apart, with occasional LOGIN_FAILED bursts"""
+    os.makedirs(directory, exist_ok=True)
+    clock = datetime(2025, 1, 1)
+    number, file, size = 1, None, 0
+    kinds = ['LOGIN_SUCCESS', 'MOOD_CHECKIN', 'MOOD_CHECKIN', 'LOGOUT', 'LOGIN_FAILED']
+    for n in range(events):
+        if file is None or size >= max_bytes:
+            if file is not None:
+                file.close()
+                os.replace(os.path.join(directory, security_log.CURRENT_FILE),
+                           os.path.join(directory, f"{number:08d}.log"))
+                number += 1
+            file, size = open(os.path.join(directory, security_log.CURRENT_FILE), 'wb'), 0
+        burst = n % 50000 < 500
+        event = {
+            'timestamp': (clock + timedelta(seconds=n)).strftime(TIME_FORMAT),
+            'event': 'LOGIN_FAILED' if burst else random.choice(kinds),
+            'username': f"user{random.randrange(users):05d}",
+            'details': 'synthetic',
+        }
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        file.write(line)
+        size += len(line)
+    file.close()
+
+
+def _full_scan(directory, event_type, since, until):
+    found = 0
+    for path in security_log.log_files(directory):
+        with open(path, 'rb') as file:
+            for line in file:
+                event = json.loads(line)
+                if event['event'] == event_type and since <= event['timestamp'] <= until:
+                    found += 1
+    return found
+
+
+def benchmark(events, users):
+    """Index build and query times over a synthetic log, against a full scan"""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        directory = os.path.join(workdir, 'secure')
+        write_synthetic_log(directory, events, users)
+        results['files'] = len(security_log.log_files(directory))
+
+        started = time.perf_counter()
+        AuditIndex(directory).refresh()
+        results['index_build_s'] = time.perf_counter() - started
+
+        index = AuditIndex(directory)
+        started = time.perf_counter()
+        index.refresh()
+        results['index_load_s'] = time.perf_counter() - started
+
+        middle = datetime(2025, 1, 1) + timedelta(seconds=events // 2)
+        since, until = middle.strftime(TIME_FORMAT), (middle + timedelta(hours=1)).strftime(TIME_FORMAT)
+        timings = {
+            'failed_logins_one_hour': lambda: sum(1 for _ in index.query('LOGIN_FAILED', since=since, until=until)),
+            'user_last_5': lambda: index.query(username='user00042', limit=5),
+            'failure_bursts': lambda: index.bursts('LOGIN_FAILED', threshold=30),
+            'full_scan_one_hour': lambda: _full_scan(directory, 'LOGIN_FAILED', since, until),
+        }
+        for name, run in timings.items():
+            started = time.perf_counter()
+            run()
+            results[f"{name}_ms"] = (time.perf_counter() - started) * 1000
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Security audit queries")
+    parser.add_argument('--app', default='secure', help="app whose security log to read")
+    commands = parser.add_subparsers(dest='command', required=True)
+    query = commands.add_parser('query', help="stream matching events as CSV or NDJSON")
+    query.add_argument('--event')
+    query.add_argument('--user')
+    query.add_argument('--since', help="e.g. '2025-09-01 10:00:00'")
+    query.add_argument('--until')
+    query.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    bursts = commands.add_parser('bursts', help="minutes (or hours, days) with many events of a type")
+    bursts.add_argument('--event', default='LOGIN_FAILED')
+    bursts.add_argument('--threshold', type=int, default=10)
+    bursts.add_argument('--resolution', choices=list(RESOLUTIONS), default='minute')
+    commands.add_parser('index', help="index the rotated files now")
+    bench = commands.add_parser('benchmark', help="query times over a synthetic log")
+    bench.add_argument('--events', type=int, default=1000000)
+    bench.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'benchmark':
+        for name, value in benchmark(args.events, args.users).items():
+            print(f"{name:>28}: {value:.3f}" if isinstance(value, float) else f"{name:>28}: {value}")
+        return 0
+
+    directory = os.path.join(security_log.LOG_DIR, args.app)
+    if not os.path.isdir(directory):
+        print(f"No security log at {directory}", file=sys.stderr)
+        return 1
+    index = AuditIndex(directory)
+    if args.command == 'query':
+        index.export(sys.stdout, args.format, event=args.event, username=args.user,
+                     since=args.since, until=args.until)
+    elif args.command == 'bursts':
+        for bucket, count in index.bursts(args.event, args.threshold, args.resolution):
+            print(f"{bucket}  {count}")
+    else:
+        print(f"{sum(index.count for _, index in index.refresh())} events indexed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
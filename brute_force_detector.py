@@ -0,0 +1,279 @@
+# MindfulBuddy - Brute-force login detector
+"""Sliding-window detector for failed logins, fed by the login path.
+
+Failures are counted per username and across all usernames over the
+last WINDOW seconds, in BUCKETS time buckets: each counter is a short
+deque of [bucket number, count] pairs plus a running total, so adding a
+failure and expiring old buckets are O(1) amortized, and a counter never
+holds more than BUCKETS pairs however many failures arrive.
+
+    one username over USER_THRESHOLD     -> that username is throttled
+                                            for COOLDOWN seconds
+    all usernames over GLOBAL_THRESHOLD  -> credential stuffing is flagged
+                                            for GLOBAL_COOLDOWN seconds
+    while flagged, one client over       -> that client is throttled for
+    CLIENT_THRESHOLD                        COOLDOWN seconds
+
+Stuffing tries each leaked username once or twice, so only the global
+count sees it. The global flag is an alert (the app logs it) and a
+tighter bar for the clients taking part; it never makes other visitors
+wait, so an attacker cannot lock everyone out by spraying failures.
+Checking a flag is a few comparisons, so the login screen asks before it
+hashes anything. Per-username and per-client counters live in
+LRU-ordered dicts capped at MAX_USERS. This complements
+login_limiter, which paces each account and client on its own and so
+misses attempts spread across many usernames.
+
+    python brute_force_detector.py replay --hours 24
+"""
+import argparse
+import collections
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+WINDOW = float(os.environ.get('MINDFUL_BRUTE_WINDOW_SECONDS', '300'))
+BUCKETS = int(os.environ.get('MINDFUL_BRUTE_BUCKETS', '30'))
+USER_THRESHOLD = int(os.environ.get('MINDFUL_BRUTE_USER_THRESHOLD', '10'))
+GLOBAL_THRESHOLD = int(os.environ.get('MINDFUL_BRUTE_GLOBAL_THRESHOLD', '100'))
+COOLDOWN = float(os.environ.get('MINDFUL_BRUTE_COOLDOWN_SECONDS', '900'))
+GLOBAL_COOLDOWN = float(os.environ.get('MINDFUL_BRUTE_GLOBAL_COOLDOWN_SECONDS', '120'))
+CLIENT_THRESHOLD = int(os.environ.get('MINDFUL_BRUTE_CLIENT_THRESHOLD', '3'))
+MAX_USERS = int(os.environ.get('MINDFUL_BRUTE_MAX_USERS', '100000'))
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class SlidingCounter:
+    """Events in the last BUCKETS buckets"""
+    __slots__ = ('buckets', 'total', 'until')
+
+    def __init__(self):
+        self.buckets = collections.deque()
+        self.total = 0
+        self.until = 0.0  # throttled until (monotonic seconds)
+
+    def expire(self, oldest):
+        while self.buckets and self.buckets[0][0] < oldest:
+            self.total -= self.buckets.popleft()[1]
+
+    def add(self, bucket, oldest):
+        self.expire(oldest)
+        if self.buckets and self.buckets[-1][0] == bucket:
+            self.buckets[-1][1] += 1
+        else:
+            self.buckets.append([bucket, 1])
+        self.total += 1
+
+
+class BruteForceDetector:
+    """Per-username, per-client and global failed-login windows with
+    throttle flags"""
+
+    def __init__(self, window=WINDOW, buckets=BUCKETS, user_threshold=USER_THRESHOLD,
+                 global_threshold=GLOBAL_THRESHOLD, cooldown=COOLDOWN, global_cooldown=GLOBAL_COOLDOWN,
+                 max_users=MAX_USERS, client_threshold=CLIENT_THRESHOLD):
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self.user_threshold = user_threshold
+        self.global_threshold = global_threshold
+        self.cooldown = cooldown
+        self.global_cooldown = global_cooldown
+        self.max_users = max_users
+        self.client_threshold = client_threshold
+        self._global = SlidingCounter()
+        self._users = collections.OrderedDict()
+        self._clients = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, now):
+        bucket = int(now // self.bucket_seconds)
+        return bucket, bucket - self.buckets + 1
+
+    @staticmethod
+    def _counter(counters, key):
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = SlidingCounter()
+        else:
+            counters.move_to_end(key)
+        return counter
+
+    def record_failure(self, username, client=None, now=None) -> bool:
+        """Count a failed login (client: its address, if known); returns
+        whether it raised a flag"""
+        now = time.monotonic() if now is None else now
+        bucket, oldest = self._bucket(now)
+        raised = False
+        with self._lock:
+            counter = self._counter(self._users, username)
+            counter.add(bucket, oldest)
+            if counter.total >= self.user_threshold and counter.until <= now:
+                counter.until = now + self.cooldown
+                raised = True
+            self._global.add(bucket, oldest)
+            if self._global.total >= self.global_threshold and self._global.until <= now:
+                self._global.until = now + self.global_cooldown
+                raised = True
+            if client is not None:
+                counter = self._counter(self._clients, client)
+                counter.add(bucket, oldest)
+                if self._global.until > now and counter.total >= self.client_threshold and counter.until <= now:
+                    counter.until = now + self.cooldown
+                    raised = True
+            self._evict(self._users, now, oldest)
+            self._evict(self._clients, now, oldest)
+        return raised
+
+    def _evict(self, counters, now, oldest):
+        """Drop the least recent keys over the cap or with nothing left
+        to remember (lock held)"""
+        while counters:
+            key, counter = next(iter(counters.items()))
+            counter.expire(oldest)
+            if len(counters) <= self.max_users and (counter.total or counter.until > now):
+                break
+            del counters[key]
+
+    def retry_after(self, username, client=None, now=None) -> float:
+        """Seconds until username, from client, may try again (0 if it
+        may now); either may be None"""
+        now = time.monotonic() if now is None else now
+        wait = 0.0
+        for counters, key in ((self._users, username), (self._clients, client)):
+            counter = counters.get(key) if key is not None else None
+            if counter is not None:
+                wait = max(wait, counter.until - now)
+        return wait
+
+    def throttled(self, username=None, now=None) -> bool:
+        """Whether username is throttled right now, or without one,
+        whether credential stuffing is flagged"""
+        now = time.monotonic() if now is None else now
+        if username is None:
+            return self._global.until > now
+        return self.retry_after(username, now=now) > 0
+
+    def reset(self, username):
+        """Forget a username's failures after it signs in"""
+        with self._lock:
+            self._users.pop(username, None)
+
+    def stats(self, now=None) -> dict:
+        now = time.monotonic() if now is None else now
+        return {
+            'usernames': len(self._users),
+            'clients': len(self._clients),
+            'failures_in_window': self._global.total,
+            'global_throttle': self._global.until > now,
+        }
+
+
+def shared() -> BruteForceDetector:
+    """The process-wide detector"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = BruteForceDetector()
+        return _shared
+
+
+# Failures per second of each attack in the replay traces
+ATTACK_RATES = {'normal': 0.0, 'single': 1.0, 'spray': 2.0, 'stuffing': 20.0}
+
+
+def _arrivals(rate, start, end):
+    """Poisson arrival times in [start, end)"""
+    clock = start
+    while rate:
+        clock += random.expovariate(rate)
+        if clock >= end:
+            break
+        yield clock
+
+
+def make_trace(kind, duration, users, background_rate, attack_start):
+    """[(seconds, username, is_attack)] of failed logins: real users'
+    typos throughout, plus an attack from attack_start"""
+    trace = [(when, f"user{random.randrange(users):05d}", False)
+             for when in _arrivals(background_rate, 0.0, duration)]
+    for n, when in enumerate(_arrivals(ATTACK_RATES[kind], attack_start, duration)):
+        if kind == 'stuffing':
+            username = f"leaked{n:07d}"  # each leaked username tried once
+        elif kind == 'spray':
+            username = f"user{n % users:05d}"  # one common password per account
+        else:
+            username = 'user00042'  # one account
+        trace.append((when, username, True))
+    trace.sort()
+    return trace
+
+
+def replay(make_detector, trace):
+    """Feed a trace; returns detection latency, false flags, speed and memory"""
+    detector = make_detector()
+    started = time.perf_counter()
+    for when, username, _ in trace:
+        detector.record_failure(username, now=when)
+        detector.retry_after(username, now=when)
+    elapsed = time.perf_counter() - started
+
+    # Again with allocation tracing (too slow to time)
+    detector = make_detector()
+    attack_start = next((when for when, _, attacking in trace if attacking), None)
+    detected = None
+    attack_events = 0
+    false_flags = 0
+    tracemalloc.start()
+    for when, username, attacking in trace:
+        raised = detector.record_failure(username, now=when)
+        attack_events += attacking
+        if raised and not attacking and (attack_start is None or when < attack_start):
+            false_flags += 1
+        if attacking and detected is None and (detector.throttled(username, now=when) or detector.throttled(now=when)):
+            detected = (when - attack_start, attack_events)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'events': len(trace),
+        'detection_latency_s': detected[0] if detected else None,
+        'attack_events_before_detection': detected[1] if detected else None,
+        'false_flags': false_flags,
+        'us_per_event': elapsed / len(trace) * 1e6,
+        'usernames_tracked': len(detector._users),
+        'peak_memory_kib': peak / 1024,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Brute-force detector tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    replay_parser = commands.add_parser('replay', help="replay synthetic attack traces")
+    replay_parser.add_argument('--traces', nargs='+', default=['normal', 'single', 'spray', 'stuffing'],
+                               choices=['normal', 'single', 'spray', 'stuffing'])
+    replay_parser.add_argument('--hours', type=float, default=24.0, help="length of each trace")
+    replay_parser.add_argument('--users', type=int, default=5000)
+    replay_parser.add_argument('--background-rate', type=float, default=0.05,
+                               help="real users' failed logins per second")
+    replay_parser.add_argument('--attack-start', type=float, default=3600.0, help="seconds into the trace")
+    args = parser.parse_args(argv)
+
+    random.seed(7)
+    print(f"{'trace':>9} {'events':>8} {'latency':>9} {'attempts':>9} {'false':>6} {'us/event':>9}"
+          f" {'users':>7} {'peak KiB':>9}")
+    for kind in args.traces:
+        trace = make_trace(kind, args.hours * 3600, args.users, args.background_rate, args.attack_start)
+        result = replay(BruteForceDetector, trace)
+        latency = f"{result['detection_latency_s']:.1f}s" if result['detection_latency_s'] is not None else '-'
+        attempts = result['attack_events_before_detection'] or '-'
+        print(f"{kind:>9} {result['events']:>8} {latency:>9} {attempts:>9} {result['false_flags']:>6}"
+              f" {result['us_per_event']:>9.2f} {result['usernames_tracked']:>7} {result['peak_memory_kib']:>9.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# MindfulBuddy - Batch chat replies
+"""Answer a backlog of chat messages in one go.
+
+Messages that pile up while nobody has the app open (a WhatsApp webhook
+writing into the store, say) are answered together instead of one
+generate_ai_response call at a time: chat_router.route_many classifies
+the whole backlog (each distinct message once), each message gets the
+platform's reply for its topic and mood, and every user's messages and
+replies are saved together (store.add_message_batches: one write per user's conversation
+log with the json backend, one transaction with sqlite).
+
+    python chat_batch.py answer backlog.jsonl    # {"username": ..., "message": ..., "mood": ...} per line
+    python chat_batch.py benchmark --messages 5000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import chat_router
+import conversation_state
+import data_store
+
+# The mobile platform's replies by chat_router topic
+REPLIES = {
+    'sadness': "I hear you. Sadness can feel heavy. What started it today?",
+    'anxiety': "Anxiety is real. Want a quick 4-7-8 breathing guide?",
+    'anger': "Anger often points to something that matters. What felt unfair?",
+    'positive': "Nice. What is one thing that made you smile?",
+    'academic': "We can plan it simply. What is the next small task due?",
+    'family': "Family can be complex. What outcome would feel better?",
+    'social': "Social stuff hits hard. Who do you feel safe texting today?",
+    'advice': "Tell me your goal in one line and what you tried so far.",
+}
+DEFAULT_REPLY = "I am here. Tell me more about what you feel right now."
+LOW_MOOD_REPLIES = ["That sounds rough. What was the hardest part today?",
+                    "Thanks for sharing. Want ideas for small relief now?"]
+HIGH_MOOD_REPLIES = ["Love that energy. What went right today?",
+                     "Great to hear. Want to lock a habit while you feel good?"]
+
+
+def reply(topic, message, history, mood=None):
+    """The platform's reply to a message already routed to topic"""
+    if mood:
+        if mood <= 3:
+            return random.choice(LOW_MOOD_REPLIES)
+        if mood >= 8:
+            return random.choice(HIGH_MOOD_REPLIES)
+    return REPLIES.get(topic, DEFAULT_REPLY)
+
+
+def respond_batch(items, respond=reply) -> list:
+    """Replies for [(message, history, mood)], classified together;
+    respond(topic, message, history, mood) writes each one"""
+    topics = chat_router.route_many([message for message, _, _ in items])
+    return [respond(topic, message, history, mood) for topic, (message, history, mood) in zip(topics, items)]
+
+
+def answer_backlog(store, backlog, respond=reply, channel='chat') -> dict:
+    """Answer [(username, message, mood)] and save every message and reply
+    in one store.add_message_batches call. Each reply sees the latest
+    conversation_state.HOT_MESSAGES of the user's conversation as stored
+    before the backlog (the window the apps' replies see), so reading it
+    costs the same however long the history; messages for unknown users
+    are skipped. Returns {'answered': n, 'skipped': n, 'users': n}."""
+    known = {username for username in dict.fromkeys(username for username, _, _ in backlog)
+             if store.user_exists(username)}
+    histories = {username: store.messages(username, channel, limit=conversation_state.HOT_MESSAGES)
+                 for username in known}
+    accepted = [entry for entry in backlog if entry[0] in known]
+    replies = respond_batch([(message, histories[username], mood) for username, message, mood in accepted], respond)
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    batches = {}
+    for (username, message, _), text in zip(accepted, replies):
+        batches.setdefault(username, []).extend([
+            {"type": "user", "message": message, "timestamp": now},
+            {"type": "ai", "message": text, "timestamp": now},
+        ])
+    if batches:
+        store.add_message_batches(batches, channel)
+    return {'answered': len(accepted), 'skipped': len(backlog) - len(accepted), 'users': len(batches)}
+
+
+def read_backlog(path) -> list:
+    """[(username, message, mood)] from a JSON-lines file"""
+    backlog = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                backlog.append((entry['username'], entry['message'], entry.get('mood')))
+    return backlog
+
+
+def make_backlog(count, users):
+    """A webhook backlog: chat-length messages plus the short ones people
+    send over and over"""
+    short = ["ok", "thanks", "hi", "I feel sad", "so stressed about my exam", "can you help me?"]
+    messages = chat_router.make_messages(count, 160)
+    return [(f"user{random.randrange(users):04d}",
+             random.choice(short) if random.random() < 0.3 else messages[n],
+             random.choice([None, None, 2, 5, 9]))
+            for n in range(count)]
+
+
+def benchmark(count, users):
+    """Messages per second answering a backlog one message at a time (as
+    the app does) and as a batch, each through to disk"""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            store = data_store.open_store('ultimate', {'users': {}})
+            for n in range(users):
+                store.create_user(f"user{n:04d}", {'ai_conversations': []})
+            backlog = make_backlog(count, users)
+            chat_router.route('')  # load the intent model, if that is the backend, outside the timing
+
+            started = time.perf_counter()
+            for username, message, mood in backlog:
+                history = store.messages(username, limit=conversation_state.HOT_MESSAGES)
+                text = reply(chat_router.route(message), message, history, mood)
+                store.add_messages(username, [{"type": "user", "message": message},
+                                              {"type": "ai", "message": text}])
+            store.flush()
+            results['one_at_a_time'] = count / (time.perf_counter() - started)
+
+            started = time.perf_counter()
+            answer_backlog(store, backlog)
+            store.flush()
+            results['batch'] = count / (time.perf_counter() - started)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer chat backlogs in bulk")
+    commands = parser.add_subparsers(dest='command', required=True)
+    answer = commands.add_parser('answer', help="answer a JSON-lines backlog into an app's store")
+    answer.add_argument('backlog')
+    answer.add_argument('--store', default='ultimate',
+                        choices=sorted(name for name, layout in data_store.STORE_LAYOUTS.items()
+                                       if 'chat' in layout.get('channels', {})))
+    bench = commands.add_parser('benchmark', help="messages per second, one at a time against batched")
+    bench.add_argument('--messages', type=int, default=5000)
+    bench.add_argument('--users', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == 'answer':
+        store = data_store.open_store(args.store)
+        started = time.perf_counter()
+        result = answer_backlog(store, read_backlog(args.backlog))
+        store.flush()
+        elapsed = time.perf_counter() - started
+        print(f"{result['answered']} answered for {result['users']} users, {result['skipped']} skipped"
+              f" ({result['answered'] / elapsed if elapsed else 0:.0f} msgs/s)")
+        return 0
+    random.seed(7)
+    for name, rate in benchmark(args.messages, args.users).items():
+        print(f"{name:>14}: {rate:10.0f} msgs/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
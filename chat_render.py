@@ -0,0 +1,128 @@
+# MindfulBuddy - Chat transcript rendering
+"""HTML for the chat views, windowed and cached.
+
+A chat view shows only the latest WINDOW messages; the apps page further
+back with a "load earlier" button, WINDOW messages at a time. So the HTML
+sent on each rerun stays bounded however long the conversation is. Paging
+past the messages a session keeps (conversation_state's tail) reads them
+from the store for that rerun only.
+
+Each message's fragment is rendered once and cached (LRU, shared by every
+session in the process) under the message's id: its sender, timestamp and
+text. A rerun after a new message renders one new fragment and joins the
+rest. Message text is HTML-escaped.
+
+    python chat_render.py benchmark --messages 5000
+"""
+import argparse
+import functools
+import html
+import os
+import sys
+import time
+
+# Messages shown at first, and added by each "load earlier"
+WINDOW = int(os.environ.get('MINDFUL_CHAT_WINDOW', '50'))
+FRAGMENT_CACHE_SIZE = int(os.environ.get('MINDFUL_CHAT_FRAGMENT_CACHE', '20000'))
+
+CONTAINERS = {
+    'classic': '<div class="chat-container">{}</div>',
+    'whatsapp': '<div class="whatsapp-container">{}</div>',
+}
+
+
+def _sender(message):
+    # Messages read back from some stores say 'type' instead of 'sender'
+    return message.get('sender') or message.get('type')
+
+
+def message_id(message):
+    return _sender(message), message.get('timestamp', ''), message.get('message', '')
+
+
+@functools.lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _fragment(style, sender, timestamp, text):
+    text = html.escape(text)
+    if style == 'whatsapp':
+        timestamp = html.escape(timestamp)
+        if sender == 'user':
+            return f'<div class="user-bubble">{text}<div class="message-time">{timestamp}</div></div>'
+        return f'<div class="ai-bubble">{text}<div class="message-time ai-message-time">{timestamp}</div></div>'
+    if sender == 'user':
+        return f'<div class="user-message">{text}</div>'
+    return f'<div class="ai-message">🤖 {text}</div>'
+
+
+def fragment(message, style='classic') -> str:
+    """One message's HTML ('classic' or 'whatsapp' bubbles)"""
+    return _fragment(style, *message_id(message))
+
+
+def _total(messages):
+    # A ConversationState holds a tail of `total` messages
+    return getattr(messages, 'total', len(messages))
+
+
+def earlier(messages, shown) -> int:
+    """How many messages are hidden above the latest `shown`"""
+    return max(0, _total(messages) - shown)
+
+
+def transcript(messages, shown=WINDOW, style='classic', load=None) -> str:
+    """The chat container with the latest `shown` messages; those past
+    the messages at hand come from load(shown) (the store)"""
+    if load is not None and len(messages) < min(shown, _total(messages)):
+        messages = load(shown)
+    visible = messages[-shown:] if shown < len(messages) else messages
+    return CONTAINERS[style].format(''.join(fragment(message, style) for message in visible))
+
+
+def _full_rebuild(messages):
+    """The old view: every message concatenated on every rerun"""
+    chat_html = '<div class="chat-container">'
+    for msg in messages:
+        if msg['sender'] == 'user':
+            chat_html += f'<div class="user-message">{msg["message"]}</div>'
+        else:
+            chat_html += f'<div class="ai-message">🤖 {msg["message"]}</div>'
+    chat_html += '</div>'
+    return chat_html
+
+
+def benchmark(count, reruns):
+    """Time and bytes per rerun for a conversation of `count` messages
+    that grows by one message per rerun"""
+    def make(n):
+        return {'sender': 'user' if n % 2 == 0 else 'ai', 'timestamp': f"2024-01-01 {n // 3600 % 24:02d}:{n // 60 % 60:02d}:{n % 60:02d}",
+                'message': f"Message {n}: " + "I have been thinking about my week and how I feel. " * 3}
+
+    messages = [make(n) for n in range(count)]
+    results = {}
+    for name, render in [('full_rebuild', _full_rebuild), ('windowed', transcript)]:
+        _fragment.cache_clear()
+        render(messages)  # the first render of a session
+        conversation = list(messages)
+        started = time.perf_counter()
+        for n in range(count, count + reruns):
+            conversation.append(make(n))
+            payload = render(conversation)
+        results[f'{name}_ms'] = (time.perf_counter() - started) / reruns * 1000
+        results[f'{name}_kib'] = len(payload.encode('utf-8')) / 1024
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat transcript rendering")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench = commands.add_parser('benchmark', help="render time and payload per rerun")
+    bench.add_argument('--messages', type=int, default=5000)
+    bench.add_argument('--reruns', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    for name, value in benchmark(args.messages, args.reruns).items():
+        print(f"{name:>17}: {value:10.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# MindfulBuddy - Chat topic router
+"""Topics of chat messages: keyword lexicons or a trained intent model.
+
+Each topic has a priority (lower wins) and a lexicon of words and
+phrases. At import every word is expanded into its common inflections
+("sad": sadness, sadly; "worried": worry, worries, worrying; "study":
+studies, studying) and all of them, with the phrases, are compiled into
+one regex, an alternation shaped like a trie so each word start is
+settled by a character or two. A message is matched in one pass: its
+punctuation becomes spaces (a byte-table translate for ASCII), and the
+regex finds every keyword that starts after a space and ends a word.
+Words match whole ("sad" does not match "crusade", nor "mad" "made");
+phrases match across any whitespace.
+
+With MINDFUL_CHAT_BACKEND=model, route() asks intent_classifier's TF-IDF
+model instead of the lexicons. intent() is what the chat engines call:
+a check-in mood that calls for it comes first, then the message's topic,
+with the answer cached (LRU) on the normalized message and mood bucket.
+
+    python chat_router.py benchmark --length 2000
+"""
+import argparse
+import functools
+import os
+import random
+import re
+import string
+import sys
+import time
+
+import intent_classifier
+
+# 'keywords' (the lexicons below) or 'model' (intent_classifier)
+BACKEND = os.environ.get('MINDFUL_CHAT_BACKEND', 'keywords')
+CACHE_SIZE = int(os.environ.get('MINDFUL_INTENT_CACHE', '4096'))
+
+# (topic, priority, keywords), in the order the chat engines used to test them
+TOPICS = [
+    ('sadness', 1, ['sad', 'depressed', 'down', 'awful', 'terrible']),
+    ('anxiety', 2, ['anxious', 'worried', 'nervous', 'stressed', 'panic']),
+    ('anger', 3, ['angry', 'mad', 'frustrated', 'annoyed']),
+    ('positive', 4, ['happy', 'good', 'great', 'amazing', 'wonderful']),
+    ('academic', 5, ['school', 'work', 'job', 'study', 'exam', 'test']),
+    ('family', 6, ['family', 'parents', 'mom', 'dad', 'brother', 'sister']),
+    ('social', 7, ['friend', 'friends', 'social', 'lonely', 'alone']),
+    ('advice', 8, ['help', 'advice', 'what should', 'how can']),
+]
+
+PRIORITIES = {topic: priority for topic, priority, _ in TOPICS}
+
+
+# Inflections by word ending: (ending, replacements); other words take SUFFIXES
+INFLECTIONS = [
+    ('ied', ('y', 'ies', 'ied', 'ying')),
+    ('ed', ('', 'e', 'es', 'ed', 'ing', 'ion')),
+    ('y', ('y', 'ies', 'ied', 'ying', 'ier', 'iest', 'ily', 'iness')),
+]
+SUFFIXES = ('', 's', 'es', 'ed', 'ing', 'ness', 'ly')
+
+
+def forms(word) -> set:
+    """A lexicon word and its common inflections"""
+    for ending, replacements in INFLECTIONS:
+        if word.endswith(ending):
+            return {word[:-len(ending)] + replacement for replacement in replacements}
+    return {word + suffix for suffix in SUFFIXES}
+
+
+def _trie_pattern(words):
+    """An alternation matching exactly `words`, factored into a trie; a
+    space matches a run of spaces"""
+    root = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def branch(node):
+        alternatives = [(' +' if char == ' ' else re.escape(char)) + branch(child)
+                        for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        if len(alternatives) == 1 and '' not in node:
+            return alternatives[0]
+        return '(?:%s)%s' % ('|'.join(alternatives), '?' if '' in node else '')
+    return branch(root)
+
+
+def _compile(topics):
+    """Keyword -> topic (every inflection of the words, and the phrases),
+    and the regex over a message's bytes that finds them"""
+    keywords = {}
+    for topic, _, lexicon in topics:
+        for keyword in lexicon:
+            parts = keyword.lower().split()
+            for form in (forms(parts[0]) if len(parts) == 1 else [' '.join(parts)]):
+                keywords.setdefault(form, topic)
+    # After a space, and not followed by more of a word (any non-ASCII
+    # byte is part of a word: typographic punctuation is gone by then)
+    pattern = r' (%s)(?![a-z0-9\x80-\xff])' % _trie_pattern(keywords)
+    return keywords, re.compile(pattern.encode('ascii'))
+
+
+# Punctuation (ASCII and the common typographic kinds) becomes spaces before matching
+_SEPARATORS = str.maketrans(dict.fromkeys(string.punctuation + string.whitespace +
+                                          '\u2014\u2013\u2018\u2019\u201c\u201d\u2026\u00ab\u00bb', ' '))
+_ASCII_SEPARATORS = bytes.maketrans((string.punctuation + string.whitespace).encode('ascii'),
+                                    b' ' * len(string.punctuation + string.whitespace))
+_KEYWORDS, _PATTERN = _compile(TOPICS)
+
+
+def _separated(text) -> bytes:
+    """A lowercased message as bytes, punctuation and whitespace as spaces,
+    behind one leading space"""
+    if text.isascii():
+        return b' ' + text.encode('ascii').translate(_ASCII_SEPARATORS)
+    # Other Unicode whitespace (a no-break space, say) separates words too
+    return b' ' + ' '.join(text.translate(_SEPARATORS).split()).encode('utf-8')
+
+
+def _keyword_topic(match):
+    keyword = match.decode('ascii')
+    return _KEYWORDS.get(keyword) or _KEYWORDS[' '.join(keyword.split())]
+
+
+def _topics(message):
+    """Every topic a message mentions"""
+    return {_keyword_topic(match) for match in _PATTERN.findall(_separated(message.lower()))}
+
+
+def classify(message) -> list:
+    """Every topic the message mentions as (topic, priority), highest
+    priority first"""
+    return sorted(((topic, PRIORITIES[topic]) for topic in _topics(message)), key=lambda item: item[1])
+
+
+def route(message):
+    """The topic of a message (with keywords, the highest-priority one), or None"""
+    if BACKEND == 'model':
+        return intent_classifier.route(message)
+    return _keyword_route(message)
+
+
+def _keyword_route(message):
+    return min(_topics(message), key=PRIORITIES.get, default=None)
+
+
+def route_many(messages) -> list:
+    """route() for each of many messages; a message repeated in the batch
+    is matched once"""
+    route_one = intent_classifier.route if BACKEND == 'model' else _keyword_route
+    routes = {message: route_one(message) for message in dict.fromkeys(messages)}
+    return [routes[message] for message in messages]
+
+
+def normalize(message):
+    return ' '.join(message.lower().split())
+
+
+def mood_bucket(mood):
+    """'low' or 'high' for a check-in mood the engines answer as such, else None"""
+    if mood and mood <= 3:
+        return 'low'
+    if mood and mood >= 8:
+        return 'high'
+    return None
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _intent(text, bucket):
+    return f"{bucket}_mood" if bucket else route(text)
+
+
+def intent(message, mood=None):
+    """What a chat engine should answer: 'low_mood' or 'high_mood' when the
+    check-in mood calls for it, otherwise route(message)"""
+    return _intent(normalize(message), mood_bucket(mood))
+
+
+def _substring_route(message):
+    """The old chain: one substring scan per topic, in priority order"""
+    text = message.lower()
+    for topic, _, words in TOPICS:
+        if any(word in text for word in words):
+            return topic
+    return None
+
+
+# No filler word holds a keyword, inflected or not, as a substring: the old
+# chain would stop at it ("made" holds "mad") and be timed giving a wrong answer
+FILLER = ("today i went to the store and then came home and cooked dinner while thinking about "
+          "the week ahead and everything that happened over the weekend with everyone").split()
+
+
+def make_messages(count, length):
+    """Long messages of filler words with a keyword or two near the end"""
+    keywords = [word for _, _, words in TOPICS for word in words]
+    messages = []
+    for _ in range(count):
+        words = [random.choice(FILLER) for _ in range(length // 6)]
+        words.insert(random.randrange(len(words) // 2, len(words)), random.choice(keywords))
+        messages.append(' '.join(words)[:length])
+    return messages
+
+
+def benchmark(count, length):
+    """Messages per second for route(), classify(), route_many() and the old chain"""
+    messages = make_messages(count, length)
+    results = {}
+    for name, function in [('route', route), ('classify', classify), ('substring_chain', _substring_route)]:
+        started = time.perf_counter()
+        for message in messages:
+            function(message)
+        results[name] = count / (time.perf_counter() - started)
+    started = time.perf_counter()
+    route_many(messages)
+    results['route_many'] = count / (time.perf_counter() - started)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat topic router")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench = commands.add_parser('benchmark', help="messages per second on long messages")
+    bench.add_argument('--messages', type=int, default=2000)
+    bench.add_argument('--length', type=int, default=2000, help="characters per message")
+    classify_parser = commands.add_parser('classify', help="show the topics of a message")
+    classify_parser.add_argument('message')
+    args = parser.parse_args(argv)
+
+    if args.command == 'classify':
+        for topic, priority in classify(args.message):
+            print(f"{priority}  {topic}")
+        return 0
+    random.seed(7)
+    print(f"{args.messages} messages of {args.length} characters")
+    for name, rate in benchmark(args.messages, args.length).items():
+        print(f"{name:>16}: {rate:10.0f} msgs/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
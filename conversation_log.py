@@ -0,0 +1,471 @@
+# MindfulBuddy - Per-user conversation logs
+"""Append-only message logs, one file per user and channel.
+
+The json backend keeps each conversation in its own log instead of the
+store's shared snapshot:
+
+    conversation_logs/<store>/<xx>/<sha1 of username>.<channel>.log
+
+Each line is one message as JSON. Sending a message appends its line
+(one short write, however long the conversation); the chat view reads
+its window backwards from the end of the file, so the cost of opening a
+conversation follows the window, not the history. "Clear chat" appends a
+tombstone line ({"_cleared": <time>}) and everything before the last
+tombstone is dead. Once the dead bytes pass MINDFUL_CONVERSATION_COMPACT_BYTES
+a clear also rewrites the file with just its live messages;
+`python conversation_log.py compact` does the same for every log.
+`python conversation_log.py migrate` moves the conversations older json
+snapshots still hold into logs (otherwise each moves on its first write).
+
+Old messages are tiered out of the log. Once it holds
+MINDFUL_CONVERSATION_SEGMENT messages more than MINDFUL_CONVERSATION_HOT,
+all but the latest HOT are sealed into a compressed segment beside it
+(gzip, or lzma with MINDFUL_CONVERSATION_CODEC=lzma) and the log is
+rewritten with the hot tail behind a {"_sealed": n} line: it continues the
+first n entries of <log>.segments, the segment index (file, message count,
+first and last timestamp). Counting reads only the index; segments are
+decompressed only when a read reaches past the hot tail (paging back
+through an old conversation) or wants everything (an export). Clearing
+deletes them.
+
+Writers share the cross-process lock of data_store.store_lock on
+<log>.lock. Readers take no lock: a line is only read once its newline is
+on disk, and a compaction or seal swaps in a new file (after its segment
+and index) that open readers notice by its inode.
+
+    python conversation_log.py benchmark --messages 5000
+"""
+import argparse
+import contextlib
+import functools
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import data_store
+
+LOG_DIR = os.environ.get('MINDFUL_CONVERSATION_LOG_DIR', 'conversation_logs')
+# Dead bytes (before the last tombstone) that make a clear compact the log
+COMPACT_BYTES = int(os.environ.get('MINDFUL_CONVERSATION_COMPACT_BYTES', str(64 * 1024)))
+
+# Live messages a log keeps uncompressed; once it holds SEGMENT_MESSAGES
+# more, the older ones are sealed into a compressed segment
+HOT_MESSAGES = int(os.environ.get('MINDFUL_CONVERSATION_HOT', '1000'))
+SEGMENT_MESSAGES = int(os.environ.get('MINDFUL_CONVERSATION_SEGMENT', '1000'))
+# Compression of sealed segments: 'gzip' or 'lzma'
+CODEC = os.environ.get('MINDFUL_CONVERSATION_CODEC', 'gzip')
+
+LOG_SUFFIX = '.log'
+INDEX_SUFFIX = '.segments'
+CODECS = {'gzip': ('.gz', gzip), 'lzma': ('.xz', lzma)}
+TOMBSTONE_KEY = '_cleared'
+SEALED_KEY = '_sealed'
+_TOMBSTONE_PREFIX = b'{"' + TOMBSTONE_KEY.encode() + b'"'
+_SEALED_PREFIX = b'{"' + SEALED_KEY.encode() + b'"'
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def _encode(message):
+    return json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def _is_tombstone(line):
+    return line.startswith(_TOMBSTONE_PREFIX)
+
+
+def _is_marker(line):
+    return line.startswith(_TOMBSTONE_PREFIX) or line.startswith(_SEALED_PREFIX)
+
+
+def _replace(path, payload):
+    """Write a file whole under a temporary name and swap it in"""
+    with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), suffix='.tmp', delete=False) as file:
+        file.write(payload)
+        if data_store.FSYNC:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(file.name, path)
+
+
+@functools.lru_cache(maxsize=4)
+def _segment_lines(path):
+    """A sealed segment's lines; segments never change, so the last few
+    read stay decompressed for paging back through them"""
+    for suffix, codec in CODECS.values():
+        if path.endswith(suffix):
+            with open(path, 'rb') as file:
+                return tuple(line for line in codec.decompress(file.read()).split(b'\n') if line)
+    raise ValueError(f"Unknown segment type: {path}")
+
+
+def log_path(store_name, username, channel) -> str:
+    """Where a user's messages on a channel are kept"""
+    digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+    return os.path.join(LOG_DIR, store_name, digest[:2], f"{digest}.{channel}{LOG_SUFFIX}")
+
+
+class ConversationLog:
+    """One user's messages on one channel.
+
+    The offsets of the file already scanned (its size up to the last
+    complete line, the start of the live messages and their count) are
+    kept, so each call reads only what was appended since.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, inode):
+        self._inode, self._size, self._start, self._count = inode, 0, 0, 0
+        self._sealed = 0  # index entries this file continues
+        self._header = 0  # bytes of the line that says so
+
+    def _scan(self, file):
+        """Bring the offsets up to date with the open file"""
+        stat = os.fstat(file.fileno())
+        if stat.st_ino != self._inode or stat.st_size < self._size:
+            # A new or rewritten file: scan it from the start
+            self._reset(stat.st_ino)
+        if stat.st_size == self._size:
+            return
+        file.seek(self._size)
+        chunk = file.read(stat.st_size - self._size)
+        end = chunk.rfind(b'\n') + 1  # a torn last line is not a message yet
+        offset = self._size
+        for line in chunk[:end].split(b'\n')[:-1]:
+            offset += len(line) + 1
+            if _is_tombstone(line):
+                # Sealed segments are older, so they are cleared too
+                self._start, self._count, self._sealed = offset, 0, 0
+            elif line.startswith(_SEALED_PREFIX):
+                self._start = self._header = offset
+                self._sealed = json.loads(line)[SEALED_KEY]
+            elif line:
+                self._count += 1
+        self._size += end
+
+    def _read(self):
+        """The live part of the file as raw lines, and the index entries
+        of the segments before it"""
+        with self._lock:
+            try:
+                file = open(self.path, 'rb')
+            except FileNotFoundError:
+                self._reset(None)
+                return [], []
+            with file:
+                self._scan(file)
+                file.seek(self._start)
+                lines = file.read(self._size - self._start).split(b'\n')
+                sealed = self._sealed
+        return [line for line in lines if line and not _is_marker(line)], self._index(sealed)
+
+    def _index(self, sealed=None):
+        """The first `sealed` segment index entries (all without it)"""
+        if sealed == 0:
+            return []
+        try:
+            with open(self.index_path, 'rb') as file:
+                entries = [json.loads(line) for line in file.read().split(b'\n') if line]
+        except FileNotFoundError:
+            return []
+        return entries if sealed is None else entries[:sealed]
+
+    def _segment(self, entry):
+        return _segment_lines(os.path.join(os.path.dirname(self.path), entry['file']))
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def count(self) -> int:
+        """Live messages, sealed ones included"""
+        with self._lock:
+            try:
+                file = open(self.path, 'rb')
+            except FileNotFoundError:
+                return 0
+            with file:
+                self._scan(file)
+                count, sealed = self._count, self._sealed
+        return count + sum(entry['count'] for entry in self._index(sealed))
+
+    def messages(self) -> list:
+        """Every live message, oldest first; decompresses every segment"""
+        lines, entries = self._read()
+        sealed = [line for entry in entries for line in self._segment(entry)]
+        return [json.loads(line) for line in sealed + lines]
+
+    def recent(self, limit) -> list:
+        """The last `limit` live messages, oldest first. The file is read
+        backwards only as far as they go, and segments are decompressed
+        only if they reach past it."""
+        lines = []
+        entries = []
+        for line in data_store.reverse_lines(self.path):
+            if _is_tombstone(line) or len(lines) >= limit:
+                break
+            if line.startswith(_SEALED_PREFIX):
+                entries = self._index(json.loads(line)[SEALED_KEY])
+                break
+            lines.append(line)
+        for entry in reversed(entries):
+            if len(lines) >= limit:
+                break
+            lines.extend(reversed(self._segment(entry)[-(limit - len(lines)):]))
+        return [json.loads(line) for line in reversed(lines)]
+
+    def _locked(self):
+        """The log's writer lock (its <log>.lock sits beside it)"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return data_store.store_lock(self.path)
+
+    def _append(self, payload):
+        """Append encoded lines in one write; the caller holds the lock"""
+        with open(self.path, 'a+b') as file:
+            end = file.seek(0, os.SEEK_END)
+            if end:
+                file.seek(end - 1)
+                if file.read(1) != b'\n':
+                    # A writer died mid-line; drop the torn line
+                    file.seek(0)
+                    file.truncate(file.read().rfind(b'\n') + 1)
+            file.write(payload)
+            if data_store.FSYNC:
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _rewrite(self, entries, lines):
+        """Swap in a new index and then a new file holding `lines` after
+        those segments, and delete segments no longer indexed; the caller
+        holds the lock. Readers follow the file, which names how many
+        index entries it continues, so each swap is safe on its own."""
+        if entries:
+            _replace(self.index_path, b''.join(_encode(entry) for entry in entries))
+        header = _encode({SEALED_KEY: len(entries)}) if entries else b''
+        _replace(self.path, header + b''.join(line + b'\n' for line in lines))
+        if not entries:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.index_path)
+        self._remove_segments({entry['file'] for entry in entries})
+
+    def _remove_segments(self, keep=()):
+        directory, prefix = os.path.split(self.path)
+        suffixes = tuple(suffix for suffix, _ in CODECS.values())
+        for name in os.listdir(directory):
+            if name.startswith(prefix + '.') and name.endswith(suffixes) and name not in keep:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(directory, name))
+
+    def _seal(self):
+        """Compress all but the latest HOT_MESSAGES live messages into new
+        segments of SEGMENT_MESSAGES each; the caller holds the lock"""
+        lines, entries = self._read()
+        cut = len(lines) - HOT_MESSAGES
+        if cut <= 0:
+            return
+        suffix, codec = CODECS[CODEC]
+        for start in range(0, cut, SEGMENT_MESSAGES):
+            chunk = lines[start:min(cut, start + SEGMENT_MESSAGES)]
+            sealed = b''.join(line + b'\n' for line in chunk)
+            name = f"{os.path.basename(self.path)}.{secrets.token_hex(6)}{suffix}"
+            _replace(os.path.join(os.path.dirname(self.path), name), codec.compress(sealed))
+            first, last = json.loads(chunk[0]), json.loads(chunk[-1])
+            entries.append({'file': name, 'count': len(chunk), 'bytes': len(sealed),
+                            'first': first.get('timestamp'), 'last': last.get('timestamp')})
+        self._rewrite(entries, lines[cut:])
+
+    def append(self, messages):
+        """Append messages in one write; seals a segment once the live
+        tail has grown SEGMENT_MESSAGES past HOT_MESSAGES"""
+        if not messages:
+            return
+        with self._locked():
+            self._append(b''.join(_encode(message) for message in messages))
+            with self._lock:
+                with open(self.path, 'rb') as file:
+                    self._scan(file)
+                live = self._count
+            if live >= HOT_MESSAGES + SEGMENT_MESSAGES:
+                self._seal()
+
+    def seed(self, messages) -> bool:
+        """Start a log that does not exist yet with earlier messages (kept
+        elsewhere until now); returns False if it already existed"""
+        with self._locked():
+            if self.exists():
+                return False
+            self._append(b''.join(_encode(message) for message in messages))
+            if len(messages) >= HOT_MESSAGES + SEGMENT_MESSAGES:
+                self._seal()
+            return True
+
+    def clear(self):
+        """Drop every message with a tombstone; compacts (deleting the sealed
+        segments) once there are any, or once enough of the file is dead"""
+        if not self.exists():
+            return
+        with self._locked():
+            self._append(_encode({TOMBSTONE_KEY: time.strftime('%Y-%m-%d %H:%M:%S')}))
+        self.compact()
+
+    def compact(self, force=False) -> bool:
+        """Rewrite the file with only its live messages and drop segments
+        that were cleared; returns whether it did. Without force, only once
+        the dead part reaches COMPACT_BYTES or cleared segments are left."""
+        with self._locked():
+            lines, entries = self._read()
+            with self._lock:
+                dead = self._start - self._header
+            stale = len(self._index()) > len(entries)
+            if not stale and (not dead or (not force and dead < COMPACT_BYTES)):
+                return False
+            self._rewrite(entries, lines)
+            return True
+
+    def remove(self):
+        """Delete the log and its segments (with its user)"""
+        with self._locked():
+            for path in (self.path, self.index_path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            self._remove_segments()
+        with self._lock:
+            self._reset(None)
+
+
+def open_log(store_name, username, channel) -> ConversationLog:
+    """The process-wide log of a user's channel"""
+    path = log_path(store_name, username, channel)
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = ConversationLog(path)
+        return _logs[path]
+
+
+def all_logs(directory=LOG_DIR):
+    """Every log file under the log directory"""
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(LOG_SUFFIX):
+                yield os.path.join(root, name)
+
+
+def compact_all(directory=LOG_DIR, force=True) -> int:
+    """Compact every log; returns how many were rewritten"""
+    return sum(ConversationLog(path).compact(force) for path in all_logs(directory))
+
+
+def migrate_all() -> int:
+    """Move the conversations each app's json snapshot still holds into
+    logs; returns how many were moved"""
+    moved = 0
+    for name, layout in data_store.STORE_LAYOUTS.items():
+        if layout.get('channels') and os.path.exists(layout['file']):
+            moved += data_store.JsonStore(name).migrate_conversations()
+    return moved
+
+
+def benchmark(count, window, rounds):
+    """Per-round cost for a conversation of `count` messages kept in the
+    shared snapshot (each compaction after a send re-encodes it, opening
+    the chat parses the store) against a log (append, reverse read of the
+    window, paging back into sealed segments, export, tombstone), and the
+    log's size on disk against the plain JSON lines"""
+    import storage_benchmark
+
+    def timed(function):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            function()
+        return (time.perf_counter() - started) / rounds * 1000
+
+    message = {'sender': 'user', 'message': "I have been thinking about my week and how I feel.",
+               'timestamp': '2024-01-01 12:00:00'}
+    messages = [dict(message, message=f"{n}: {message['message']}") for n in range(count)]
+    results = {}
+    directory = tempfile.mkdtemp(prefix='mindful-log-')
+    previous = os.getcwd()
+    try:
+        os.chdir(directory)
+        path = 'conversation_data.json'
+        data = storage_benchmark.make_store_data('conversation', 200)
+        data['conversations']['user0'] = list(messages)
+        data_store.save_store(path, data)
+
+        def snapshot_compact():
+            data_store.extend_record(path, data, ['conversations', 'user0'], [message])
+            data_store.barrier()
+            data_store.compact_store(path)
+
+        def snapshot_window():
+            data_store._cache.clear()
+            data_store.load_store(path, {})['conversations']['user0'][-window:]
+
+        results['snapshot_compact_ms'] = timed(snapshot_compact)
+        results['snapshot_window_ms'] = timed(snapshot_window)
+
+        log = ConversationLog(log_path('conversation', 'user0', 'chat'))
+        log.seed(messages)
+        results['log_send_ms'] = timed(lambda: log.append([message]))
+        results['log_window_ms'] = timed(lambda: ConversationLog(log.path).recent(window))
+
+        def scroll_back():
+            _segment_lines.cache_clear()
+            ConversationLog(log.path).recent(HOT_MESSAGES + window)
+
+        results['log_scroll_back_ms'] = timed(scroll_back)
+        results['log_export_ms'] = timed(lambda: ConversationLog(log.path).messages())
+        folder, prefix = os.path.split(log.path)
+        results['plain_kib'] = sum(len(_encode(message)) for message in ConversationLog(log.path).messages()) / 1024
+        results['log_kib'] = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder)
+                                 if name.startswith(prefix) and not name.endswith('.lock')) / 1024
+
+        def log_clear():
+            log.append([message])
+            log.clear()
+
+        results['log_clear_ms'] = timed(log_clear)
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-user conversation logs")
+    commands = parser.add_subparsers(dest='command', required=True)
+    compact = commands.add_parser('compact', help="rewrite every log with only its live messages")
+    compact.add_argument('--dir', default=LOG_DIR)
+    commands.add_parser('migrate', help="move conversations still in json snapshots into logs")
+    bench = commands.add_parser('benchmark', help="snapshot against log per send, window and clear")
+    bench.add_argument('--messages', type=int, default=5000)
+    bench.add_argument('--window', type=int, default=50)
+    bench.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == 'compact':
+        print(f"compacted {compact_all(args.dir)} logs")
+        return 0
+    if args.command == 'migrate':
+        print(f"moved {migrate_all()} conversations")
+        return 0
+    for name, value in benchmark(args.messages, args.window, args.rounds).items():
+        print(f"{name:>19}: {value:10.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# MindfulBuddy - Conversation state
+"""A chat conversation plus the context the response generators ask about.
+
+ConversationState behaves like the list of messages the apps keep in
+st.session_state.conversation (append, len, iteration, indexing), but
+every append also updates, from the user's messages:
+
+    topic_counts   topic -> messages that mention it (chat_router.classify)
+    last_seen      topic -> position of the latest message that mentions it
+    sentiment      running tone in [-1, 1], an exponential moving average
+                   of each message's topic valence
+
+so "did they mention school in the last few messages?" is a dict lookup,
+however long the conversation is. Each message is classified once, when
+it is appended.
+
+Only the latest HOT_MESSAGES (MINDFUL_CHAT_HOT_MESSAGES) messages are kept
+in the session; `total` still counts every message, and views page back
+past the tail from the store (see chat_render.transcript). A session's
+memory stays bounded however long someone has used the app. Loaded at
+sign-in, the state starts from the tail, numbered from where it sits in
+the whole conversation, so positions and `mentioned(within=...)` agree
+with `total`. The counts (sender_counts, topic_counts) and tone cover
+only the messages the state has seen: the tail it was loaded with and
+everything appended since, not the history before it.
+"""
+import collections
+import os
+
+import chat_router
+
+# Tone of each topic; topics not listed are neutral
+VALENCE = {'sadness': -1.0, 'anxiety': -1.0, 'anger': -1.0, 'positive': 1.0}
+# Weight of the newest message in the running sentiment
+SENTIMENT_WEIGHT = 0.3
+# Latest messages kept in the session
+HOT_MESSAGES = int(os.environ.get('MINDFUL_CHAT_HOT_MESSAGES', '200'))
+
+
+def _sender(message):
+    # Messages read back from some stores say 'type' instead of 'sender'
+    return message.get('sender') or message.get('type')
+
+
+class ConversationState:
+    """Messages of one conversation with incrementally kept context.
+
+    messages are the latest of `total` (the store's count, when the
+    conversation started before this session).
+    """
+
+    def __init__(self, messages=(), total=None, hot=HOT_MESSAGES):
+        self.hot = hot
+        self.clear()
+        messages = list(messages)
+        if total is not None:
+            # Numbered from their place in the whole conversation
+            self.earlier = max(0, total - len(messages))
+        for message in messages:
+            self.append(message)
+
+    def clear(self):
+        self.messages = []
+        self.earlier = 0  # messages before the tail, only in the store
+        self.sender_counts = collections.Counter()
+        self.topic_counts = collections.Counter()
+        self.last_seen = {}
+        self.sentiment = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.earlier + len(self.messages)
+
+    def append(self, message):
+        position = self.total
+        self.messages.append(message)
+        if len(self.messages) > self.hot:
+            del self.messages[0]
+            self.earlier += 1
+        sender = _sender(message)
+        self.sender_counts[sender] += 1
+        if sender != 'user':
+            return
+        topics = [topic for topic, _ in chat_router.classify(message.get('message', ''))]
+        for topic in topics:
+            self.topic_counts[topic] += 1
+            self.last_seen[topic] = position
+        valences = [VALENCE[topic] for topic in topics if topic in VALENCE]
+        tone = sum(valences) / len(valences) if valences else 0.0
+        self.sentiment += SENTIMENT_WEIGHT * (tone - self.sentiment)
+
+    def mentioned(self, topic, within=None) -> bool:
+        """Whether the user mentioned a topic, optionally within the last
+        `within` messages (either sender's)"""
+        position = self.last_seen.get(topic)
+        if position is None:
+            return False
+        return within is None or position >= self.total - within
+
+    def messages_from(self, sender) -> int:
+        """Messages from sender among those the state has seen (not the
+        history before the tail it was loaded with)"""
+        return self.sender_counts[sender]
+
+    def tone(self) -> str:
+        """'positive', 'low' or 'neutral' from the running sentiment"""
+        if self.sentiment >= 0.25:
+            return 'positive'
+        if self.sentiment <= -0.25:
+            return 'low'
+        return 'neutral'
+
+    # The list interface the apps already use, over the tail
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
@@ -0,0 +1,1264 @@
+# MindfulBuddy - Shared journaled data store
+"""Data-access layer shared by the MindfulBuddy apps.
+
+Apps open a store by name and use its typed query functions (users, mood
+entries, conversations, sessions, app-wide sections) instead of walking
+the raw document; security events go to security_log instead. Two
+backends implement the same functions:
+
+- json (default): a JSON snapshot in the same layout the apps have always
+  written, plus an append-only journal next to it. Mutations are appended
+  to the journal as single records, so a check-in costs one short write
+  instead of re-encoding every user. A background compaction folds the
+  journal into the snapshot, and loading replays snapshot plus journal
+  tail. Plain JSON files from older versions load unchanged. Writers in
+  several processes are serialized by an advisory lock on <file>.lock;
+  each record carries a sequence number, and a writer whose copy is
+  behind the files merges the newer records before adding its own.
+  Compaction re-encodes only the users and sections the folded records
+  touched; set MINDFUL_COMPACT_JSON=1 for non-indented snapshots.
+  Larger snapshots get a byte-offset index (<file>.offsets) of every
+  section and dict entry, so open_user_store() can read one user's entries
+  without parsing the rest.
+  Writes are write-behind: a mutation is applied to the in-memory copy at
+  once and queued, and a single writer thread appends everything queued
+  within MINDFUL_COMMIT_WINDOW_MS to each journal in one group commit
+  (one write and one fsync). barrier() (store.flush()) waits until every
+  queued write is on disk; the queue is also flushed at exit. A window
+  of 0 writes synchronously.
+  Conversations are not kept in the snapshot: each user's channel is an
+  append-only log of its own (see conversation_log.py), so a message is
+  one short append and a clear one tombstone line; older messages are
+  sealed into compressed segments. Messages an older snapshot still
+  holds are read from it as they are, and move to the log on the first
+  write to that conversation, or all at once with
+  `python conversation_log.py migrate`. Reads never change the store, so
+  copying one (copy_store, shard_store.migrate) leaves it as it was.
+- sharded: an index file for usernames, profiles and sessions plus one
+  journaled shard per user (see shard_store.py). Set
+  MINDFUL_BACKEND=sharded; an app's single file is migrated the first
+  time its store is opened.
+- sqlite: one shared WAL-mode database (see sqlite_store.py). Set
+  MINDFUL_BACKEND=sqlite; an app's existing JSON file is imported the
+  first time its store is opened.
+"""
+import atexit
+import contextlib
+import copy
+import functools
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads in this process are serialized
+    fcntl = None
+
+import conversation_log
+import shard_store
+import sqlite_store
+
+# Backend used by open_store: 'json', 'sharded' or 'sqlite'
+BACKEND = os.environ.get('MINDFUL_BACKEND', 'json')
+
+JOURNAL_SUFFIX = '.journal'
+COMPACTING_SUFFIX = '.compacting'
+LOCK_SUFFIX = '.lock'
+OFFSETS_SUFFIX = '.offsets'
+SEQ_KEY = '_journal_seq'
+
+# Snapshots at least this large get an offset index for partial loads
+OFFSETS_MIN_BYTES = 64 * 1024
+# Offset index record: key digest, byte offset, length
+_OFFSET_RECORD = struct.Struct('>QQI')
+
+# Fold the journal into the snapshot once it holds this many records
+COMPACT_THRESHOLD = int(os.environ.get('MINDFUL_COMPACT_THRESHOLD', '500'))
+
+# Write snapshots without indentation (about half the size and encode time)
+COMPACT_JSON = os.environ.get('MINDFUL_COMPACT_JSON', '') not in ('', '0')
+
+# Times a load re-reads the files when a compaction swapped them mid-read
+LOAD_RETRIES = 5
+
+# Block size for reading append-only files backwards
+READ_BLOCK = 64 * 1024
+
+# Group commit window of the write-behind queue, in seconds (0: write synchronously)
+COMMIT_WINDOW = float(os.environ.get('MINDFUL_COMMIT_WINDOW_MS', '5')) / 1000
+
+# fsync the journal after each group commit
+FSYNC = os.environ.get('MINDFUL_FSYNC', '1') not in ('', '0')
+
+_locks = {}
+_lock_files = {}
+# Parsed stores shared by every session in this process:
+# absolute path -> (files id, data)
+_cache = {}
+# Encoded fragments of the snapshot this process last wrote:
+# absolute path -> (snapshot file id, compact?, fragments)
+_fragments = {}
+_pending = {}
+_compacting = set()
+_registry_lock = threading.Lock()
+
+# Write-behind queue: (path, data, record) already applied to data but not
+# yet in the journal. _inflight holds the batch the writer is committing.
+_queue = []
+_inflight = []
+_queue_cond = threading.Condition()
+_queued = 0
+_committed = 0
+_flush_now = False
+_writer = None
+_write_error = None
+
+
+def _lock_for(path):
+    with _registry_lock:
+        if path not in _locks:
+            _locks[path] = threading.RLock()
+        return _locks[path]
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Exclusive lock on a store across threads and processes.
+
+    Threads wait on the path's RLock; the thread holding it also takes an
+    advisory flock on <path>.lock so other worker processes wait too.
+    Re-entering from the same thread reuses the held flock.
+    """
+    with _lock_for(path):
+        held = _lock_files.get(path)
+        if held is not None or fcntl is None:
+            yield
+            return
+        with open(path + LOCK_SUFFIX, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _lock_files[path] = lock_file
+            try:
+                yield
+            finally:
+                del _lock_files[path]
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def store_lock(path):
+    """Hold a store's cross-process lock (also used for files kept beside it)"""
+    return _file_lock(path)
+
+
+def _file_id(path):
+    """Identity of a file's current contents, or None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _files_id(path):
+    """Identity of a store's snapshot and journal files, from stat alone"""
+    return tuple(_file_id(path + suffix) for suffix in ('', COMPACTING_SUFFIX, JOURNAL_SUFFIX))
+
+
+def _cached(path):
+    return _cache.get(os.path.abspath(path))
+
+
+def _cache_is_current(path):
+    cached = _cached(path)
+    return cached is not None and cached[0] == _files_id(path)
+
+
+def _recache(path, data):
+    """Note the files' new identity after a change data already has"""
+    _cache[os.path.abspath(path)] = (_files_id(path), data)
+
+
+def _container(data, keys, create=True):
+    """Walk to the dict holding the last key, creating dicts on the way"""
+    node = data
+    for key in keys[:-1]:
+        if create:
+            node = node.setdefault(key, {})
+        else:
+            node = node.get(key)
+            if node is None:
+                return None
+    return node
+
+
+def apply_record(data, record):
+    """Apply one journal record to an in-memory store.
+
+    Returns False when the record had no effect (an insert of a key that
+    already exists, a take of one that does not), True otherwise.
+    """
+    op = record['op']
+    keys = record['keys']
+
+    if op == 'take':
+        parent = _container(data, keys, create=False)
+        if parent is None or keys[-1] not in parent:
+            return False
+        del parent[keys[-1]]
+        return True
+
+    if op == 'update':
+        node = data
+        for key in keys:
+            node = node.setdefault(key, {})
+        node.update(record['value'])
+        return True
+
+    if op == 'delete':
+        parent = _container(data, keys, create=False)
+        if parent is not None:
+            parent.pop(keys[-1], None)
+        return True
+
+    parent = _container(data, keys)
+    if op == 'set':
+        parent[keys[-1]] = record['value']
+    elif op == 'insert':
+        if keys[-1] in parent:
+            return False
+        parent[keys[-1]] = record['value']
+    elif op == 'append':
+        items = parent.setdefault(keys[-1], [])
+        items.append(record['value'])
+        keep = record.get('keep')
+        if keep and len(items) > keep:
+            del items[:-keep]
+    elif op == 'extend':
+        parent.setdefault(keys[-1], []).extend(record['value'])
+    elif op == 'incr':
+        parent[keys[-1]] = parent.get(keys[-1], 0) + record['value']
+    else:
+        raise ValueError(f"Unknown journal op: {op}")
+    return True
+
+
+def _read_records(journal_path):
+    """Yield parsed records, skipping a torn final line"""
+    try:
+        with open(journal_path, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def reverse_lines(path):
+    """Yield an append-only file's complete lines from last to first,
+    reading blocks from the end"""
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with file:
+        # A torn last line (a write in progress) is not a record yet
+        end = _last_newline(file, file.seek(0, os.SEEK_END))
+        remainder = b''
+        while end > 0:
+            start = max(0, end - READ_BLOCK)
+            file.seek(start)
+            lines = (file.read(end - start) + remainder).split(b'\n')
+            remainder = lines.pop(0) if start else b''
+            for line in reversed(lines):
+                if line:
+                    yield line
+            end = start
+        if remainder:
+            yield remainder
+
+
+def _last_newline(file, end):
+    """Offset just past the last newline before end"""
+    while end > 0:
+        start = max(0, end - 4096)
+        file.seek(start)
+        position = file.read(end - start).rfind(b'\n')
+        if position >= 0:
+            return start + position + 1
+        end = start
+    return 0
+
+
+def _replay(path, data, suffixes=(COMPACTING_SUFFIX, JOURNAL_SUFFIX), strict=True, dirty=None):
+    """Apply journal records newer than data's version.
+
+    Returns (count, contiguous); contiguous is False when sequence numbers
+    were skipped, i.e. the files were compacted between our reads. In
+    strict mode nothing is applied then, so data is never left half-way.
+    The fragments the records touch are added to dirty, if given.
+    """
+    last_seq = data.get(SEQ_KEY, 0)
+    records = []
+    contiguous = True
+    for suffix in suffixes:
+        for record in _read_records(path + suffix):
+            seq = record.get('seq', 0)
+            if seq <= last_seq:
+                continue
+            if seq != last_seq + 1:
+                if strict:
+                    return 0, False
+                contiguous = False
+            records.append(record)
+            last_seq = seq
+    for record in records:
+        apply_record(data, record)
+        if dirty is not None:
+            dirty.add(tuple(record['keys'][:2]))
+    data[SEQ_KEY] = last_seq
+    return len(records), contiguous
+
+
+def _last_record_seq(journal_path):
+    """Sequence number of the last complete record in a journal, or None"""
+    try:
+        file = open(journal_path, 'rb')
+    except FileNotFoundError:
+        return None
+    with file:
+        end = file.seek(0, os.SEEK_END)
+        block = 4096
+        while True:
+            start = max(0, end - block)
+            file.seek(start)
+            lines = file.read(end - start).splitlines()
+            # The first line may be cut off by the block boundary
+            candidates = lines if start == 0 else lines[1:]
+            for line in reversed(candidates):
+                try:
+                    return json.loads(line)['seq']
+                except (ValueError, KeyError):
+                    continue
+            if start == 0:
+                return None
+            block *= 4
+
+
+def _disk_version(path):
+    """Sequence number of the newest record on disk (snapshot or journal)"""
+    for suffix in (JOURNAL_SUFFIX, COMPACTING_SUFFIX):
+        seq = _last_record_seq(path + suffix)
+        if seq is not None:
+            return seq
+    offsets = _read_offsets(path)
+    if offsets is not None:
+        return offsets[0]
+    return _read_snapshot(path, None).get(SEQ_KEY, 0)
+
+
+def _read_snapshot(path, default):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        if default is None:
+            return {}
+    with _file_lock(path):
+        # Another process may have created it while we waited
+        if os.path.exists(path):
+            return _read_snapshot(path, None)
+        data = default() if callable(default) else copy.deepcopy(default)
+        # Persist the defaults so compaction always folds onto a full layout
+        write_snapshot(path, data)
+        return data
+
+
+def _encode(value, compact, depth):
+    if compact:
+        return json.dumps(value, separators=(',', ':'))
+    # Same text json.dump(indent=2) gives at this depth; strings never hold raw newlines
+    return json.dumps(value, indent=2).replace('\n', '\n' + '  ' * depth)
+
+
+def encode_snapshot(data, fragments=None, dirty=None, compact=False):
+    """Encode a store as JSON text, re-encoding only what changed.
+
+    Each section is a fragment, and each entry of a dict section (a user,
+    a session, a counter) is a fragment of its own. fragments holds the
+    encodings from the previous call; dirty holds the (section,) and
+    (section, key) fragments modified since, and () or None means
+    everything. Returns (text, fragments). Without compact the text is
+    identical to json.dump(data, indent=2).
+    """
+    encoded = {}
+    text = ''.join(_snapshot_chunks(data, fragments, dirty, compact, encoded))
+    return text, encoded
+
+
+def _snapshot_chunks(data, fragments, dirty, compact, encoded, offsets=None):
+    """Yield the snapshot text in pieces, storing new fragments in encoded.
+
+    offsets, if given, collects (keys, byte offset, length) of every section
+    and dict entry (the text is ASCII, so characters are bytes).
+    """
+    if dirty is None or () in dirty:
+        fragments = {}
+    fragments = fragments or {}
+    dirty = dirty or set()
+    if not data:
+        yield '{}'
+        return
+    inner, outer = ('', '') if compact else ('\n    ', '\n  ')
+    colon = ':' if compact else ': '
+    yield '{'
+    written = 1
+    for index, (section, value) in enumerate(data.items()):
+        head = (',' if index else '') + outer + json.dumps(section) + colon
+        yield head
+        written += len(head)
+        start = written
+        cached = fragments.get(section)
+        if isinstance(value, dict) and value:
+            cached = cached if isinstance(cached, dict) and (section,) not in dirty else {}
+            entries = encoded[section] = {}
+            yield '{'
+            written += 1
+            for position, (key, entry) in enumerate(value.items()):
+                text = cached.get(key)
+                if text is None or (section, key) in dirty:
+                    text = _encode(entry, compact, 2)
+                entries[key] = text
+                head = (',' if position else '') + inner + json.dumps(key) + colon
+                yield head + text
+                written += len(head)
+                if offsets is not None:
+                    offsets.append(((section, key), written, len(text)))
+                written += len(text)
+            yield outer + '}'
+            written += len(outer) + 1
+        else:
+            text = cached if isinstance(cached, str) and (section,) not in dirty else None
+            text = encoded.setdefault(section, text or _encode(value, compact, 1))
+            yield text
+            written += len(text)
+        if offsets is not None:
+            offsets.append(((section,), start, written - start))
+    yield ('' if compact else '\n') + '}'
+
+
+def write_snapshot(path, data, dirty=None):
+    """Write a snapshot atomically via a temp file and rename.
+
+    When this process wrote the current file, only the fragments in dirty
+    are re-encoded (see encode_snapshot); None re-encodes everything.
+    """
+    key = os.path.abspath(path)
+    previous = _fragments.get(key)
+    fragments = None
+    if dirty is not None and previous is not None and previous[:2] == (_file_id(path), COMPACT_JSON):
+        fragments = previous[2]
+    else:
+        dirty = None
+    encoded = {}
+    offsets = []
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'w') as file:
+        file.writelines(_snapshot_chunks(data, fragments, dirty, COMPACT_JSON, encoded, offsets))
+    os.replace(tmp_path, path)
+    snapshot_id = _file_id(path)
+    _fragments[key] = (snapshot_id, COMPACT_JSON, encoded)
+    if snapshot_id[2] >= OFFSETS_MIN_BYTES:
+        _write_offsets(path, snapshot_id, data.get(SEQ_KEY, 0), offsets)
+    else:
+        try:
+            os.remove(path + OFFSETS_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+
+@functools.lru_cache(maxsize=1 << 18)
+def _offset_key(keys):
+    """64-bit digest of a section or (section, key) path"""
+    digest = hashlib.blake2b(json.dumps(keys).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def _write_offsets(path, snapshot_id, seq, offsets):
+    """Write the offset index of a snapshot: a JSON header line naming the
+    snapshot it describes, then fixed-size records sorted by key digest"""
+    records = sorted((_offset_key(keys), start, length) for keys, start, length in offsets)
+    header = json.dumps({'snapshot': list(snapshot_id), 'seq': seq}) + '\n'
+    tmp_path = f"{path}{OFFSETS_SUFFIX}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'wb') as file:
+        file.write(header.encode('ascii'))
+        file.write(b''.join(_OFFSET_RECORD.pack(*record) for record in records))
+    os.replace(tmp_path, path + OFFSETS_SUFFIX)
+
+
+def _read_offsets(path):
+    """(snapshot seq, record table) of the current snapshot's offset index,
+    or None if there is none or it describes an older snapshot"""
+    try:
+        with open(path + OFFSETS_SUFFIX, 'rb') as file:
+            header = json.loads(file.readline())
+            table = file.read()
+    except (FileNotFoundError, ValueError):
+        return None
+    snapshot_id = _file_id(path)
+    if snapshot_id is None or header.get('snapshot') != list(snapshot_id):
+        return None
+    return header['seq'], table
+
+
+def _find_offset(table, keys):
+    """(offset, length) of keys in the snapshot, None if absent, or False
+    when the digest is ambiguous"""
+    size = _OFFSET_RECORD.size
+    digest = _offset_key(keys)
+    low, high = 0, len(table) // size
+    while low < high:
+        middle = (low + high) // 2
+        if _OFFSET_RECORD.unpack_from(table, middle * size)[0] < digest:
+            low = middle + 1
+        else:
+            high = middle
+    if low * size >= len(table):
+        return None
+    found, start, length = _OFFSET_RECORD.unpack_from(table, low * size)
+    if found != digest:
+        return None
+    if (low + 1) * size < len(table) and _OFFSET_RECORD.unpack_from(table, (low + 1) * size)[0] == digest:
+        return False
+    return start, length
+
+
+class PartialData(dict):
+    """A store document holding only the wanted sections and entries.
+
+    wanted holds (section,) and (section, key) paths; None means the
+    document has since been loaded in full.
+    """
+
+    def __init__(self, wanted=()):
+        super().__init__()
+        self.wanted = set(wanted)
+
+
+def _record_scope(record, wanted):
+    """'apply' if a journal record changes something wanted, 'skip' if it
+    does not, or 'full' if it replaces a section only parts of are loaded"""
+    keys = record['keys']
+    if not keys:
+        sections = set(record['value'])
+        if any(len(entry) == 2 and entry[0] in sections for entry in wanted):
+            return 'full'
+        return 'apply'
+    if (keys[0],) in wanted or tuple(keys[:2]) in wanted:
+        return 'apply'
+    if len(keys) == 1 and any(entry[0] == keys[0] for entry in wanted):
+        return 'full'
+    return 'skip'
+
+
+def _fill_partial(path, data):
+    """(Re)load data's wanted entries: snapshot fragments via the offset
+    index plus the journal records touching them. Returns False when that
+    is not possible and the whole store has to be read instead."""
+    with _file_lock(path):
+        offsets = _read_offsets(path)
+        if offsets is None:
+            return False
+        seq, table = offsets
+        fresh = {}
+        with open(path, 'rb') as file:
+            for keys in data.wanted:
+                found = _find_offset(table, keys)
+                if found is False:
+                    return False
+                if len(keys) == 2:
+                    fresh.setdefault(keys[0], {})
+                if found is None:
+                    continue
+                file.seek(found[0])
+                value = json.loads(file.read(found[1]))
+                if len(keys) == 1:
+                    fresh[keys[0]] = value
+                else:
+                    fresh[keys[0]][keys[1]] = value
+        fresh[SEQ_KEY] = seq
+        # Records are folded while we hold the lock, so no gaps to check
+        for suffix in (COMPACTING_SUFFIX, JOURNAL_SUFFIX):
+            for record in _read_records(path + suffix):
+                if record.get('seq', 0) <= fresh[SEQ_KEY]:
+                    continue
+                scope = _record_scope(record, data.wanted)
+                if scope == 'full':
+                    return False
+                if scope == 'apply':
+                    apply_record(fresh, record)
+                fresh[SEQ_KEY] = record['seq']
+        data.clear()
+        data.update(fresh)
+        for record in _unwritten(path, data):
+            apply_record(data, record)
+    return True
+
+
+def load_partial(path, wanted):
+    """Read only some sections and dict entries of a store.
+
+    wanted holds (section,) and (section, key) paths. Returns a PartialData,
+    or None when the snapshot has no current offset index or the journal
+    replaced a section an entry is wanted from; load the whole store then.
+    """
+    data = PartialData(wanted)
+    return data if _fill_partial(path, data) else None
+
+
+def _read_store(path, default):
+    """Parse a store: snapshot (or legacy JSON file) plus journal tail"""
+    for attempt in range(LOAD_RETRIES):
+        data = _read_snapshot(path, default)
+        # A record lost to a crash leaves a permanent gap; accept it last time
+        count, contiguous = _replay(path, data, strict=attempt < LOAD_RETRIES - 1)
+        if contiguous:
+            break
+    _pending[path] = count
+    if count >= COMPACT_THRESHOLD:
+        compact_in_background(path)
+    return data
+
+
+def load_store(path, default):
+    """Process-wide copy of a store, shared by every session.
+
+    The files are parsed once; later calls only stat them and return the
+    cached copy when nothing changed, so a rerun costs the same whatever
+    the file size. When another process has written, its new journal
+    records are merged into the cached copy (a full re-read happens only
+    if they were compacted away meanwhile). Writes from this process go
+    through the same copy under the store lock.
+    """
+    cached = _cached(path)
+    if cached is not None and cached[0] == _files_id(path):
+        return cached[1]
+    with _lock_for(path):
+        cached = _cached(path)
+        if cached is None:
+            # Taken before reading: a write landing meanwhile is merged next time
+            files_id = _files_id(path)
+            data = _read_store(path, default)
+            _cache[os.path.abspath(path)] = (files_id, data)
+            return data
+    with _file_lock(path):
+        data = cached[1]
+        _catch_up(path, data, _disk_version(path))
+        _recache(path, data)
+    return data
+
+
+def _catch_up(path, data, version):
+    """Bring an in-memory store up to the on-disk version (store lock held)"""
+    if isinstance(data, PartialData) and data.wanted is not None:
+        if _fill_partial(path, data):
+            return
+        data.wanted = None
+    else:
+        count, contiguous = _replay(path, data)
+        if contiguous and data[SEQ_KEY] == version:
+            return
+    # Records we missed were already folded into the snapshot. Swap
+    # sections in place so other sessions never see an empty store.
+    fresh = _read_snapshot(path, None)
+    _replay(path, fresh, strict=False)
+    data.update(fresh)
+    for key in [key for key in data if key not in fresh]:
+        del data[key]
+    # Queued writes are not in the files yet; keep them visible
+    for record in _unwritten(path, data):
+        apply_record(data, record)
+
+
+def remove_store(path):
+    """Delete a store's snapshot and journal files"""
+    barrier()
+    with _file_lock(path):
+        for suffix in ('', COMPACTING_SUFFIX, JOURNAL_SUFFIX, OFFSETS_SUFFIX):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        _cache.pop(os.path.abspath(path), None)
+        _pending.pop(path, None)
+
+
+def save_store(path, data):
+    """Write the whole store as a fresh snapshot and drop the journal"""
+    barrier()
+    with _file_lock(path):
+        _catch_up(path, data, _disk_version(path))
+        write_snapshot(path, data)
+        for suffix in (COMPACTING_SUFFIX, JOURNAL_SUFFIX):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        _pending[path] = 0
+
+
+def _append_records(path, data, records, apply=False):
+    """Append records in one write, merging in anything other writers added first.
+
+    The caller's in-memory copy carries the version (last sequence number)
+    it was loaded at. Under the store lock that version is checked against
+    the one on disk; if another process or session has written since, their
+    records are merged into the copy before the caller's records go on top
+    with the next numbers, so no writer's change is lost. apply=False means
+    data already has the records (write-behind). Returns whether the last
+    record was applied.
+    """
+    applied = True
+    with _file_lock(path):
+        current = _disk_version(path)
+        if data.get(SEQ_KEY, 0) != current:
+            _catch_up(path, data, current)
+        for record in records:
+            current += 1
+            record['seq'] = current
+            if apply:
+                applied = apply_record(data, record)
+        with open(path + JOURNAL_SUFFIX, 'a') as file:
+            file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+            if FSYNC:
+                file.flush()
+                os.fsync(file.fileno())
+        data[SEQ_KEY] = current
+        cached = _cached(path)
+        if cached is not None and cached[1] is data:
+            _recache(path, data)
+        _pending[path] = _pending.get(path, 0) + len(records)
+        pending = _pending[path]
+    if pending >= COMPACT_THRESHOLD:
+        compact_in_background(path)
+    return applied
+
+
+def _unwritten(path, data):
+    """Queued records for this copy of a store, oldest first"""
+    with _queue_cond:
+        return [record for queued_path, queued_data, record in _inflight + _queue
+                if queued_path == path and queued_data is data]
+
+
+def _write_behind():
+    """Writer thread: commit whatever is queued once per window"""
+    global _committed, _flush_now
+    while True:
+        with _queue_cond:
+            while not _queue:
+                _queue_cond.wait()
+            deadline = time.monotonic() + COMMIT_WINDOW
+            while not _flush_now and time.monotonic() < deadline:
+                _queue_cond.wait(deadline - time.monotonic())
+            batch = list(_queue)
+            _inflight[:] = batch
+            del _queue[:]
+            _flush_now = False
+        _commit(batch)
+        with _queue_cond:
+            _committed += len(batch)
+            _queue_cond.notify_all()
+
+
+def _commit(batch):
+    """Group commit: one locked append per store, records in queue order"""
+    global _write_error
+    by_path = {}
+    for path, data, record in batch:
+        by_path.setdefault(path, []).append((data, record))
+    for path, items in by_path.items():
+        runs = []
+        for data, record in items:
+            if runs and runs[-1][0] is data:
+                runs[-1][1].append(record)
+            else:
+                runs.append((data, [record]))
+        try:
+            with _file_lock(path):
+                try:
+                    for data, records in runs:
+                        _append_records(path, data, records)
+                finally:
+                    # Still under the lock, so no reload sees them twice
+                    with _queue_cond:
+                        _inflight[:] = [item for item in _inflight if item[0] != path]
+        except Exception as error:  # keep the writer alive; barrier() reports it
+            _write_error = error
+
+
+def barrier():
+    """Wait until every write queued so far is in the journal (and fsynced).
+
+    Use after security-critical writes. Raises the last write error, if any.
+    """
+    global _flush_now, _write_error
+    with _queue_cond:
+        target = _queued
+        if _committed < target:
+            _flush_now = True
+            _queue_cond.notify_all()
+        while _committed < target:
+            _queue_cond.wait()
+        error, _write_error = _write_error, None
+    if error is not None:
+        raise error
+
+
+atexit.register(barrier)
+
+
+def _write_record(path, data, record, wait=False):
+    """Apply a record to data now and queue it for the writer thread.
+
+    wait=True (or a zero window) appends it before returning instead,
+    after anything already queued; the result then reflects the files.
+    """
+    return _write_records(path, data, [record], wait)
+
+
+def _write_records(path, data, records, wait=False):
+    """_write_record for several records, queued together so they reach
+    the journal in the same append; returns whether the last one applied"""
+    global _queued, _writer
+    if wait or COMMIT_WINDOW <= 0:
+        barrier()
+        return _append_records(path, data, records, apply=True)
+    with _lock_for(path):
+        for record in records:
+            applied = apply_record(data, record)
+        with _queue_cond:
+            _queue.extend((path, data, record) for record in records)
+            _queued += len(records)
+            if _writer is None or not _writer.is_alive():
+                _writer = threading.Thread(target=_write_behind, name='store-writer', daemon=True)
+                _writer.start()
+            _queue_cond.notify_all()
+    return applied
+
+
+def append_record(path, data, keys, value, keep=None):
+    """Append a value to the list at keys (keep trims to the last N items)"""
+    record = {'op': 'append', 'keys': list(keys), 'value': value}
+    if keep:
+        record['keep'] = keep
+    _write_record(path, data, record)
+
+
+def extend_record(path, data, keys, values):
+    """Append several values to the list at keys in one record"""
+    _write_record(path, data, {'op': 'extend', 'keys': list(keys), 'value': list(values)})
+
+
+def extend_records(path, data, batches):
+    """extend_record for several lists in one append: batches is
+    [(keys, values)]"""
+    _write_records(path, data, [{'op': 'extend', 'keys': list(keys), 'value': list(values)}
+                                for keys, values in batches])
+
+
+def set_record(path, data, keys, value):
+    """Set the value at keys"""
+    _write_record(path, data, {'op': 'set', 'keys': list(keys), 'value': value})
+
+
+def insert_record(path, data, keys, value) -> bool:
+    """Set the value at keys unless it exists; returns True if it was added.
+
+    Written synchronously, so the answer holds across processes.
+    """
+    return _write_record(path, data, {'op': 'insert', 'keys': list(keys), 'value': value}, wait=True)
+
+
+def take_record(path, data, keys) -> bool:
+    """Remove the value at keys if it exists; returns True if it was there.
+
+    Written synchronously, so of several callers in any processes exactly
+    one takes it.
+    """
+    return _write_record(path, data, {'op': 'take', 'keys': list(keys)}, wait=True)
+
+
+def update_record(path, data, keys, fields):
+    """Merge fields into the dict at keys (an empty keys list means the root)"""
+    _write_record(path, data, {'op': 'update', 'keys': list(keys), 'value': dict(fields)})
+
+
+def delete_record(path, data, keys):
+    """Remove the value at keys"""
+    _write_record(path, data, {'op': 'delete', 'keys': list(keys)})
+
+
+def increment_record(path, data, keys, amount=1):
+    """Increment the counter at keys (missing counters start at 0)"""
+    _write_record(path, data, {'op': 'incr', 'keys': list(keys), 'value': amount})
+
+
+def compact_store(path):
+    """Fold the journal into the snapshot"""
+    journal_path = path + JOURNAL_SUFFIX
+    compacting_path = path + COMPACTING_SUFFIX
+    with _file_lock(path):
+        # A leftover file from an interrupted compaction is folded first;
+        # the live journal then waits for the next round.
+        if not os.path.exists(compacting_path):
+            if not os.path.exists(journal_path):
+                return
+            cache_current = _cache_is_current(path)
+            os.replace(journal_path, compacting_path)
+            if cache_current:
+                _recache(path, _cached(path)[1])
+        _pending[path] = 0
+        compacting_id = _file_id(compacting_path)
+        snapshot_id = _file_id(path)
+
+    # Folding works on the files only, so writers keep appending meanwhile
+    data = _read_snapshot(path, None)
+    dirty = {(SEQ_KEY,)}
+    _replay(path, data, (COMPACTING_SUFFIX,), strict=False, dirty=dirty)
+
+    with _file_lock(path):
+        # Another process may have folded these records (and moved on) already
+        if _file_id(compacting_path) != compacting_id or _file_id(path) != snapshot_id:
+            return
+        # Folding leaves the contents unchanged, so an up-to-date cached copy stays valid
+        cache_current = _cache_is_current(path)
+        write_snapshot(path, data, dirty)
+        os.remove(compacting_path)
+        if cache_current:
+            _recache(path, _cached(path)[1])
+
+
+def compact_in_background(path):
+    """Start a compaction thread unless one is already running"""
+    with _registry_lock:
+        if path in _compacting:
+            return
+        _compacting.add(path)
+
+    def run():
+        try:
+            compact_store(path)
+        finally:
+            with _registry_lock:
+                _compacting.discard(path)
+
+    threading.Thread(target=run, name=f"compact:{path}", daemon=True).start()
+
+
+# Where each app keeps its data in the JSON layout. Channel templates give the
+# path of each message list; users_key None means the whole document is one
+# user's record (the original AI buddy app).
+STORE_LAYOUTS = {
+    'conversation': {
+        'file': 'conversation_data.json',
+        'channels': {'chat': 'conversations/{user}'},
+    },
+    'ai': {'file': 'ai_user_data.json', 'users_key': None},
+    'analytics': {'file': 'analytics_app_data.json'},
+    'family': {'file': 'family_data.json', 'users_key': 'family_members'},
+    'ultimate': {
+        'file': 'ultimate_platform_data.json',
+        'channels': {
+            'chat': 'users/{user}/ai_conversations',
+            'voice': 'users/{user}/voice_interactions',
+        },
+    },
+    'professional': {'file': 'professional_app_data.json'},
+    'secure': {'file': 'secure_app_data.json'},
+}
+
+# The most events a store's old security_log section held (see security_log.migrate_store)
+SECURITY_LOG_LIMIT = 100
+
+
+class JsonStore:
+    """Typed queries over a journaled JSON store.
+
+    data may be a PartialData (see open_user_store); entries it lacks are
+    then read from the snapshot the first time a query needs them.
+    """
+
+    def __init__(self, name, default=None, data=None):
+        layout = STORE_LAYOUTS[name]
+        self.name = name
+        self.path = layout['file']
+        self.users_key = layout.get('users_key', 'users')
+        self.channels = layout.get('channels', {})
+        self.history_keys = {'mood_history'}
+        for template in self.channels.values():
+            parts = template.split('/')
+            if parts[:2] == [self.users_key, '{user}']:
+                self.history_keys.add(parts[-1])
+        self.data = load_store(self.path, default) if data is None else data
+        self._logs = {}
+
+    def _need(self, *keys):
+        """Make sure a partial store has a section or entry loaded"""
+        data = self.data
+        if not isinstance(data, PartialData) or data.wanted is None:
+            return
+        if keys in data.wanted or keys[:1] in data.wanted:
+            return
+        with _file_lock(self.path):
+            data.wanted.add(keys)
+            _catch_up(self.path, data, None)
+
+    def _user_keys(self, username):
+        return [self.users_key, username] if self.users_key else []
+
+    def _record(self, username):
+        if self.users_key:
+            self._need(self.users_key, username)
+            return self.data.get(self.users_key, {}).get(username)
+        return self.data if self.data.get('name') == username else None
+
+    def _channel_keys(self, username, channel):
+        return [part.format(user=username) for part in self.channels[channel].split('/')]
+
+    def _log(self, username, channel):
+        """A user's conversation log (the file may not exist yet)"""
+        log = self._logs.get((username, channel))
+        if log is None:
+            log = self._logs[(username, channel)] = conversation_log.open_log(self.name, username, channel)
+        return log
+
+    def _unmoved(self, username, channel) -> list:
+        """Messages an older snapshot still holds for a user; they count
+        only while the user's log does not exist"""
+        keys = self._channel_keys(username, channel)
+        self._need(*keys[:2])
+        node = self.data
+        for key in keys:
+            node = node.get(key) if isinstance(node, dict) else None
+        return node or []
+
+    def _writable_log(self, username, channel):
+        """A user's conversation log, with the messages the snapshot still
+        holds moved into it first: the log is started with them and then
+        they are deleted from the snapshot, so an interrupted move leaves
+        both and the log is the one read"""
+        log = self._log(username, channel)
+        unmoved = self._unmoved(username, channel)
+        if unmoved:
+            # Another process may have moved them already; then the log exists
+            log.seed(unmoved)
+            delete_record(self.path, self.data, self._channel_keys(username, channel))
+        return log
+
+    def migrate_conversations(self) -> int:
+        """Move every conversation the snapshot still holds into its log;
+        returns how many were moved"""
+        moved = 0
+        for channel, template in self.channels.items():
+            section = template.split('/')[0]
+            if section == self.users_key:
+                usernames = self.list_users()
+            else:
+                self._need(section)
+                usernames = list(self.data.get(section, {}))
+            for username in usernames:
+                if self._unmoved(username, channel):
+                    self._writable_log(username, channel)
+                    moved += 1
+        barrier()
+        return moved
+
+    # Users
+    def list_users(self) -> list:
+        if self.users_key:
+            self._need(self.users_key)
+            return list(self.data.get(self.users_key, {}))
+        return [self.data['name']] if 'name' in self.data else []
+
+    def user_exists(self, username) -> bool:
+        return self._record(username) is not None
+
+    def get_user(self, username):
+        """Profile fields of a user (histories are read separately), or None"""
+        record = self._record(username)
+        if record is None:
+            return None
+        return {key: value for key, value in record.items() if key not in self.history_keys}
+
+    def create_user(self, username, profile) -> bool:
+        """Add a user; returns False if the username is taken"""
+        if self.user_exists(username):
+            return False
+        record = dict(profile)
+        record.setdefault('mood_history', [])
+        if self.users_key:
+            # Another worker may have taken the name since we loaded
+            return insert_record(self.path, self.data, self._user_keys(username), record)
+        else:
+            record['name'] = username
+            update_record(self.path, self.data, [], record)
+        return True
+
+    def update_user(self, username, **fields):
+        update_record(self.path, self.data, self._user_keys(username), fields)
+
+    def delete_user(self, username):
+        if self.users_key:
+            delete_record(self.path, self.data, self._user_keys(username))
+            for channel in self.channels:
+                self._logs.pop((username, channel), None)
+                conversation_log.open_log(self.name, username, channel).remove()
+
+    # Mood entries
+    def add_mood_entry(self, username, entry):
+        append_record(self.path, self.data, self._user_keys(username) + ['mood_history'], entry)
+
+    def mood_history(self, username, start=None, end=None) -> list:
+        """Mood entries in check-in order, optionally limited to a date range"""
+        entries = (self._record(username) or {}).get('mood_history', [])
+        if start is not None:
+            entries = [entry for entry in entries if entry['date'] >= start]
+        if end is not None:
+            entries = [entry for entry in entries if entry['date'] < end]
+        return list(entries)
+
+    def mood_count(self, username) -> int:
+        return len((self._record(username) or {}).get('mood_history', []))
+
+    def latest_mood(self, username):
+        entries = (self._record(username) or {}).get('mood_history', [])
+        return entries[-1] if entries else None
+
+    # Conversations
+    def messages(self, username, channel='chat', limit=None) -> list:
+        log = self._log(username, channel)
+        if not log.exists():
+            unmoved = self._unmoved(username, channel)
+            return list(unmoved[-limit:] if limit else unmoved)
+        return log.recent(limit) if limit else log.messages()
+
+    def message_count(self, username, channel='chat') -> int:
+        log = self._log(username, channel)
+        return log.count() if log.exists() else len(self._unmoved(username, channel))
+
+    def add_messages(self, username, messages, channel='chat'):
+        self._writable_log(username, channel).append(messages)
+
+    def add_message_batches(self, batches, channel='chat'):
+        """add_messages for several users, one append per user's log:
+        batches maps username -> messages"""
+        for username, messages in batches.items():
+            self._writable_log(username, channel).append(messages)
+
+    def clear_messages(self, username, channel='chat'):
+        self._writable_log(username, channel).clear()
+
+    # Sessions
+    def create_session(self, token, session):
+        set_record(self.path, self.data, ['sessions', token], session)
+
+    def get_session(self, token):
+        self._need('sessions', token)
+        return self.data.get('sessions', {}).get(token)
+
+    def delete_session(self, token):
+        if self.get_session(token) is not None:
+            delete_record(self.path, self.data, ['sessions', token])
+
+    # App-wide sections (platform stats, metadata, settings)
+    def get_section(self, section) -> dict:
+        self._need(section)
+        return dict(self.data.get(section, {}))
+
+    def set_section(self, section, value):
+        set_record(self.path, self.data, [section], value)
+
+    def increment(self, section, key, amount=1):
+        increment_record(self.path, self.data, [section, key], amount)
+
+    def flush(self):
+        """Durability barrier: return once this process's writes are on disk"""
+        barrier()
+
+
+def copy_store(source, target):
+    """Copy every record from one store into another (used for imports)"""
+    for username in source.list_users():
+        target.create_user(username, source.get_user(username))
+        for entry in source.mood_history(username):
+            target.add_mood_entry(username, entry)
+        for channel in getattr(source, 'channels', {}):
+            messages = source.messages(username, channel)
+            if messages:
+                target.add_messages(username, messages, channel)
+    for token, session in source.data.get('sessions', {}).items():
+        target.create_session(token, session)
+    for section, value in source.data.items():
+        if isinstance(value, dict) and section not in (source.users_key, 'sessions', 'conversations'):
+            target.set_section(section, value)
+
+
+def open_user_store(name, username=None, default=None):
+    """Open an app's store reading only what one user's pages need.
+
+    With the json backend and no full copy cached in this process, only
+    the user's record (and their conversation entries) are read from the
+    snapshot, through its offset index; other users, sessions and
+    sections are read one by one if a query asks for them. Without a
+    current index the whole store is loaded as usual. The other backends
+    already read per user and just open the store.
+    """
+    layout = STORE_LAYOUTS[name]
+    users_key = layout.get('users_key', 'users')
+    path = layout['file']
+    if BACKEND != 'json' or users_key is None or _cached(path) is not None or not os.path.exists(path):
+        return open_store(name, default)
+    wanted = []
+    if username is not None:
+        wanted.append((users_key, username))
+        for template in layout.get('channels', {}).values():
+            keys = template.format(user=username).split('/')
+            if keys[0] != users_key:
+                wanted.append(tuple(keys[:2]))
+    data = load_partial(path, wanted)
+    return JsonStore(name, default, data=data)
+
+
+def open_store(name, default=None):
+    """Open an app's store with the configured backend"""
+    if BACKEND == 'sqlite':
+        store = sqlite_store.SqliteStore(name)
+        if store.needs_import():
+            # First use of the database for this app: bring over its JSON data
+            # (or the app's defaults when it never wrote any). Checked again
+            # under the write lock so a second process cannot import over
+            # writes made since the first one finished.
+            with sqlite_store.transaction(store.conn):
+                if store.needs_import():
+                    path = STORE_LAYOUTS[name]['file']
+                    if os.path.exists(path):
+                        source = JsonStore(name)
+                    else:
+                        initial = default() if callable(default) else copy.deepcopy(default or {})
+                        source = JsonStore(name, data=initial)
+                    copy_store(source, store)
+                    store.mark_imported(path)
+        return store
+    if BACKEND == 'sharded':
+        if not shard_store.is_migrated(name):
+            shard_store.migrate(name, default)
+        return shard_store.ShardStore(name)
+    return JsonStore(name, default)
@@ -1,11 +1,13 @@
 # Mental Health Bot - FAMILY VERSION!
 import streamlit as st
-import json
 import os
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
+import numpy as np
+import data_store
+import mood_columns
 
 # Set page config
 st.set_page_config(
@@ -57,39 +59,49 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def default_family_data():
+    """Initial layout of the family store"""
+    return {
+        'family_members': {},
+        'family_settings': {
+            'sharing_enabled': False,
+            'parent_access': False,
+            'emergency_contacts': []
+        }
+    }
+
 def load_family_data():
     """Load all family member data"""
-    try:
-        with open('family_data.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {
-            'family_members': {},
-            'family_settings': {
-                'sharing_enabled': False,
-                'parent_access': False,
-                'emergency_contacts': []
-            }
-        }
+    return data_store.open_store('family', default_family_data)
+
+def load_family_members(store):
+    """Profile of every family member, with their check-ins as mood columns"""
+    members = {}
+    for member_name in store.list_users():
+        member_data = store.get_user(member_name)
+        member_data['moods'] = mood_columns.load(store, member_name)
+        members[member_name] = member_data
+    return members
 
-def save_family_data(data):
-    """Save family data"""
-    with open('family_data.json', 'w') as file:
-        json.dump(data, file, indent=2)
+def week_checkins(columns, now=None):
+    """Check-ins dated within the last 7 calendar days"""
+    today = mood_columns.epoch_seconds(now or datetime.now()) // mood_columns.SECONDS_PER_DAY
+    return int((columns.days() >= today - 7).sum())
 
-def create_family_overview_chart(family_data):
+def create_family_overview_chart(family_members):
     """Create chart showing all family members' moods"""
-    if not family_data['family_members']:
+    if not family_members:
         return None
     
     fig = go.Figure()
     
     colors = ['#4CAF50', '#2196F3', '#FF9800', '#9C27B0', '#F44336']
     
-    for i, (member_name, member_data) in enumerate(family_data['family_members'].items()):
-        if member_data.get('mood_history') and member_data.get('sharing_enabled', False):
-            dates = [entry['date'].split()[0] for entry in member_data['mood_history'][-14:]]  # Last 2 weeks
-            moods = [entry['mood'] for entry in member_data['mood_history'][-14:]]
+    for i, (member_name, member_data) in enumerate(family_members.items()):
+        columns = member_data['moods']
+        if len(columns) and member_data.get('sharing_enabled', False):
+            dates = np.datetime_as_string(columns.dates()[-14:], unit='D')  # Last 2 weeks
+            moods = columns.mood[-14:]
             
             fig.add_trace(go.Scatter(
                 x=dates,
@@ -111,15 +123,16 @@ def create_family_overview_chart(family_data):
     
     return fig
 
-def check_family_alerts(family_data):
+def check_family_alerts(family_members):
     """Check for any family members who might need attention"""
     alerts = []
     
-    for member_name, member_data in family_data['family_members'].items():
-        if not member_data.get('mood_history'):
+    for member_name, member_data in family_members.items():
+        columns = member_data['moods']
+        if not len(columns):
             continue
             
-        recent_moods = [entry['mood'] for entry in member_data['mood_history'][-3:]]
+        recent_moods = columns.mood[-3:]
         
         # Check for crisis patterns
         if any(mood <= 2 for mood in recent_moods):
@@ -138,37 +151,34 @@ def check_family_alerts(family_data):
             })
         
         # Check for no recent check-ins
-        if member_data['mood_history']:
-            last_checkin = datetime.strptime(member_data['mood_history'][-1]['date'].split()[0], '%Y-%m-%d')
-            if (datetime.now() - last_checkin).days > 7:
-                alerts.append({
-                    'member': member_name,
-                    'type': 'inactive',
-                    'message': f"{member_name} hasn't checked in for over a week"
-                })
+        if columns.days_since_last() > 7:
+            alerts.append({
+                'member': member_name,
+                'type': 'inactive',
+                'message': f"{member_name} hasn't checked in for over a week"
+            })
     
     return alerts
 
-def get_family_insights(family_data):
+def get_family_insights(family_members):
     """Generate insights about family mental health"""
     insights = []
     
-    if not family_data['family_members']:
+    if not family_members:
         return ["No family members added yet."]
     
     # Family mood average
     all_moods = []
     active_members = 0
     
-    for member_name, member_data in family_data['family_members'].items():
-        if member_data.get('mood_history'):
-            recent_moods = [entry['mood'] for entry in member_data['mood_history'][-7:]]  # Last week
-            if recent_moods:
-                all_moods.extend(recent_moods)
-                active_members += 1
+    for member_name, member_data in family_members.items():
+        recent_moods = member_data['moods'].mood[-7:]  # Last week
+        if len(recent_moods):
+            all_moods.append(recent_moods)
+            active_members += 1
     
     if all_moods:
-        family_avg = sum(all_moods) / len(all_moods)
+        family_avg = float(np.concatenate(all_moods).mean())
         insights.append(f"🏠 Family average mood this week: {family_avg:.1f}/10")
         
         if family_avg >= 7:
@@ -183,7 +193,8 @@ def get_family_insights(family_data):
     return insights
 
 # Initialize family data
-family_data = load_family_data()
+store = load_family_data()
+family_members = load_family_members(store)
 
 # Main header
 st.markdown('<h1 class="main-header">🏠 Family Mental Health Hub</h1>', unsafe_allow_html=True)
@@ -199,21 +210,19 @@ with st.sidebar:
     member_role = st.selectbox("Role:", ["Child/Teen", "Parent", "Adult Child", "Other"])
     
     if st.button("Add Member") and new_member_name:
-        if new_member_name not in family_data['family_members']:
-            family_data['family_members'][new_member_name] = {
+        if not store.user_exists(new_member_name):
+            store.create_user(new_member_name, {
                 'role': member_role,
-                'mood_history': [],
                 'sharing_enabled': member_role == "Child/Teen",  # Default sharing for minors
                 'created_date': datetime.now().strftime("%Y-%m-%d")
-            }
-            save_family_data(family_data)
+            })
             st.success(f"✅ Added {new_member_name} to family!")
             st.rerun()
     
     # Current family members
     st.subheader("👨‍👩‍👧‍👦 Family Members")
-    for member_name, member_data in family_data['family_members'].items():
-        checkins = len(member_data.get('mood_history', []))
+    for member_name, member_data in family_members.items():
+        checkins = len(member_data['moods'])
         st.write(f"• **{member_name}** ({member_data['role']}) - {checkins} check-ins")
 
 # Main content tabs
@@ -223,7 +232,7 @@ with tab1:
     st.header("🏠 Family Mental Health Overview")
     
     # Family alerts
-    alerts = check_family_alerts(family_data)
+    alerts = check_family_alerts(family_members)
     if alerts:
         st.markdown("### 🚨 Family Alerts")
         for alert in alerts:
@@ -239,8 +248,8 @@ with tab1:
                 st.warning(f"⚠️ {alert['message']}")
     
     # Family mood chart
-    if family_data['family_members']:
-        family_chart = create_family_overview_chart(family_data)
+    if family_members:
+        family_chart = create_family_overview_chart(family_members)
         if family_chart:
             st.plotly_chart(family_chart, use_container_width=True)
         else:
@@ -251,40 +260,34 @@ with tab1:
     
     with col1:
         st.subheader("🧠 Family Insights")
-        insights = get_family_insights(family_data)
+        insights = get_family_insights(family_members)
         for insight in insights:
             st.write(f"• {insight}")
     
     with col2:
         st.subheader("📈 Quick Stats")
-        total_checkins = sum(len(member.get('mood_history', [])) for member in family_data['family_members'].values())
+        total_checkins = sum(len(member['moods']) for member in family_members.values())
         st.metric("Total Family Check-ins", total_checkins)
-        st.metric("Family Members", len(family_data['family_members']))
+        st.metric("Family Members", len(family_members))
         
         # This week's activity
-        week_checkins = 0
-        for member_data in family_data['family_members'].values():
-            for entry in member_data.get('mood_history', []):
-                entry_date = datetime.strptime(entry['date'].split()[0], '%Y-%m-%d')
-                if (datetime.now() - entry_date).days <= 7:
-                    week_checkins += 1
-        st.metric("This Week's Check-ins", week_checkins)
+        st.metric("This Week's Check-ins", sum(week_checkins(member['moods']) for member in family_members.values()))
 
 with tab2:
     st.header("📊 Individual Check-in")
     
     # Select family member
-    if family_data['family_members']:
-        selected_member = st.selectbox("Who is checking in?", list(family_data['family_members'].keys()))
+    if family_members:
+        selected_member = st.selectbox("Who is checking in?", list(family_members.keys()))
         
         if selected_member:
-            member_data = family_data['family_members'][selected_member]
+            member_data = family_members[selected_member]
             
             st.markdown(f"""
             <div class="family-member-box">
                 <h3>👋 Hi {selected_member}!</h3>
                 <p>Role: {member_data['role']}</p>
-                <p>Total check-ins: {len(member_data.get('mood_history', []))}</p>
+                <p>Total check-ins: {len(member_data['moods'])}</p>
             </div>
             """, unsafe_allow_html=True)
             
@@ -313,8 +316,7 @@ with tab2:
                     if note:
                         entry['note'] = note
                     
-                    family_data['family_members'][selected_member]['mood_history'].append(entry)
-                    save_family_data(family_data)
+                    store.add_mood_entry(selected_member, entry)
                     
                     # Response based on mood
                     if mood_score <= 3:
@@ -331,10 +333,10 @@ with tab2:
             
             with col2:
                 # Individual stats
-                if member_data.get('mood_history'):
-                    moods = [entry['mood'] for entry in member_data['mood_history']]
-                    st.metric("Average Mood", f"{sum(moods)/len(moods):.1f}/10")
-                    st.metric("Best Day", f"{max(moods)}/10")
+                moods = member_data['moods'].mood
+                if len(moods):
+                    st.metric("Average Mood", f"{moods.mean():.1f}/10")
+                    st.metric("Best Day", f"{moods.max()}/10")
                     st.metric("Total Check-ins", len(moods))
     else:
         st.info("👈 Add family members in the sidebar to start!")
@@ -351,29 +353,30 @@ with tab3:
     """, unsafe_allow_html=True)
     
     # Show children's data
-    children_data = {name: data for name, data in family_data['family_members'].items() 
+    children_data = {name: data for name, data in family_members.items() 
                     if data['role'] == "Child/Teen" and data.get('sharing_enabled', False)}
     
     if children_data:
         for child_name, child_data in children_data.items():
             with st.expander(f"📊 {child_name}'s Mental Health Summary"):
-                if child_data.get('mood_history'):
-                    moods = [entry['mood'] for entry in child_data['mood_history']]
-                    recent_moods = moods[-7:] if len(moods) >= 7 else moods
+                columns = child_data['moods']
+                if len(columns):
+                    moods = columns.mood
+                    recent_moods = moods[-7:]
                     
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("Recent Average", f"{sum(recent_moods)/len(recent_moods):.1f}/10")
+                        st.metric("Recent Average", f"{recent_moods.mean():.1f}/10")
                     with col2:
                         st.metric("Total Check-ins", len(moods))
                     with col3:
-                        last_checkin = child_data['mood_history'][-1]['date'].split()[0]
-                        st.metric("Last Check-in", last_checkin)
+                        last_checkin = np.datetime_as_string(columns.dates()[-1], unit='D')
+                        st.metric("Last Check-in", str(last_checkin))
                     
                     # Trend analysis
                     if len(moods) >= 5:
-                        recent_avg = sum(moods[-3:]) / 3
-                        overall_avg = sum(moods) / len(moods)
+                        recent_avg = moods[-3:].mean()
+                        overall_avg = moods.mean()
                         
                         if recent_avg < 4:
                             st.error("⚠️ Consider checking in with them - recent moods are concerning.")
@@ -397,7 +400,7 @@ with tab4:
     """, unsafe_allow_html=True)
     
     # Individual member settings
-    for member_name, member_data in family_data['family_members'].items():
+    for member_name, member_data in family_members.items():
         with st.expander(f"⚙️ Settings for {member_name}"):
             
             # Sharing settings
@@ -410,15 +413,13 @@ with tab4:
             )
             
             if new_sharing != current_sharing:
-                family_data['family_members'][member_name]['sharing_enabled'] = new_sharing
-                save_family_data(family_data)
+                store.update_user(member_name, sharing_enabled=new_sharing)
                 st.success(f"✅ Updated sharing settings for {member_name}")
                 st.rerun()
             
             # Remove member
             if st.button(f"❌ Remove {member_name} from family", key=f"remove_{member_name}"):
-                del family_data['family_members'][member_name]
-                save_family_data(family_data)
+                store.delete_user(member_name)
                 st.success(f"Removed {member_name} from family")
                 st.rerun()
 
@@ -0,0 +1,249 @@
+# MindfulBuddy - Intent classifier
+"""Offline TF-IDF intent model for the chat engines.
+
+The model is trained with scikit-learn from the bundled intent_corpus.json
+plus chat_router's keyword lexicons. TfidfVectorizer runs over 3-5
+character n-grams within words, which copes with typos and word forms a
+small corpus never shows, and a logistic regression follows. The model is
+saved as plain JSON weights (intent_model.json), holding each term's
+idf and its weight for every intent. Predicting looks up each distinct
+word's n-gram rows (cached per word) and does one small numpy product, so
+the apps neither import scikit-learn nor pay its per-call overhead for
+every message. The model is loaded on the first chat message, and trained
+and saved again whenever the corpus has changed.
+
+Intents are chat_router's topics plus 'general' (small talk), which routes
+like no topic at all. So does a message whose best intent scores under
+MIN_CONFIDENCE. The chat engines use the model with
+MINDFUL_CHAT_BACKEND=model (see chat_router).
+
+    python intent_classifier.py train
+    python intent_classifier.py benchmark
+"""
+import argparse
+import collections
+import functools
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_corpus.json')
+MODEL_PATH = os.environ.get('MINDFUL_INTENT_MODEL', 'intent_model.json')
+MIN_CONFIDENCE = float(os.environ.get('MINDFUL_INTENT_MIN_CONFIDENCE', '0.3'))
+GENERAL = 'general'
+# Distinct words whose n-gram rows a model keeps
+WORD_CACHE_SIZE = 65536
+
+# Character n-grams within words, cut the way the vectorizer cuts them
+NGRAMS = (3, 5)
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def _word_terms(word):
+    """The n-grams of one word, as TfidfVectorizer(analyzer='char_wb') cuts them"""
+    word = f" {word} "
+    terms = []
+    for n in range(NGRAMS[0], NGRAMS[1] + 1):
+        terms.extend(word[start:start + n] for start in range(max(1, len(word) - n + 1)))
+        if len(word) <= n:
+            break  # a short word counts once
+    return terms
+
+
+def _corpus_id(corpus_path):
+    with open(corpus_path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+class IntentModel:
+    """Saved TF-IDF + logistic regression weights"""
+
+    def __init__(self, intents, intercepts, terms, corpus=None):
+        self.intents = intents
+        self.intercepts = intercepts
+        self.terms = terms  # term -> [idf, weight for each intent]
+        self.corpus = corpus
+        self._rows = {term: row for row, term in enumerate(terms)}
+        matrix = np.array(list(terms.values()), dtype=float).reshape(len(terms), len(intents) + 1)
+        self._idf = matrix[:, 0].copy()
+        self._weights = matrix[:, 1:].copy()
+        self._intercepts = np.array(intercepts, dtype=float)
+        self._word_rows = functools.lru_cache(maxsize=WORD_CACHE_SIZE)(self._lookup_word)
+
+    def _lookup_word(self, word):
+        return tuple(self._rows[term] for term in _word_terms(word) if term in self._rows)
+
+    def probabilities(self, message) -> dict:
+        """Intent -> probability; empty if no word of the message is known"""
+        counts = collections.Counter()
+        for word, repeats in collections.Counter(message.lower().split()).items():
+            for row in self._word_rows(word):
+                counts[row] += repeats
+        if not counts:
+            return {}
+        rows = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+        values = (1 + np.log(np.fromiter(counts.values(), dtype=float, count=len(counts)))) * self._idf[rows]
+        logits = self._intercepts + values @ self._weights[rows] / math.sqrt(values @ values)
+        exps = np.exp(logits - logits.max())
+        return dict(zip(self.intents, (exps / exps.sum()).tolist()))
+
+    def predict(self, message):
+        """The topic of a message, or None for small talk and unsure guesses"""
+        probabilities = self.probabilities(message)
+        if not probabilities:
+            return None
+        intent = max(probabilities, key=probabilities.get)
+        if intent == GENERAL or probabilities[intent] < MIN_CONFIDENCE:
+            return None
+        return intent
+
+    def to_json(self) -> dict:
+        return {'corpus': self.corpus, 'intents': self.intents, 'intercepts': self.intercepts, 'terms': self.terms}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['intents'], data['intercepts'], data['terms'], data.get('corpus'))
+
+
+def read_corpus(corpus_path=CORPUS_PATH) -> list:
+    """[(text, intent)] of the labelled corpus"""
+    with open(corpus_path, encoding='utf-8') as file:
+        corpus = json.load(file)
+    return [(text, intent) for intent, texts in corpus.items() for text in texts]
+
+
+def lexicon_examples() -> list:
+    """chat_router's keywords as [(keyword, topic)] examples"""
+    import chat_router
+    return [(keyword, topic) for topic, _, keywords in chat_router.TOPICS for keyword in keywords]
+
+
+def train(examples, corpus=None) -> IntentModel:
+    """Fit the vectorizer and classifier on [(text, intent)]"""
+    # Only training needs scikit-learn
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=NGRAMS, sublinear_tf=True)
+    features = vectorizer.fit_transform([text for text, _ in examples])
+    classifier = LogisticRegression(C=10.0, max_iter=2000)
+    classifier.fit(features, [intent for _, intent in examples])
+    terms = {}
+    for term, column in vectorizer.vocabulary_.items():
+        terms[term] = [float(vectorizer.idf_[column])] + [float(row[column]) for row in classifier.coef_]
+    return IntentModel([str(intent) for intent in classifier.classes_],
+                       [float(value) for value in classifier.intercept_], terms, corpus)
+
+
+def save(model, model_path=MODEL_PATH):
+    temp_path = f"{model_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(model.to_json(), file, separators=(',', ':'))
+    os.replace(temp_path, model_path)
+
+
+def load(model_path=MODEL_PATH, corpus_path=CORPUS_PATH) -> IntentModel:
+    """The saved model, trained and saved first if it is missing or was
+    built from another version of the corpus"""
+    corpus = _corpus_id(corpus_path)
+    try:
+        with open(model_path, encoding='utf-8') as file:
+            saved = json.load(file)
+        if saved.get('corpus') == corpus:
+            return IntentModel.from_json(saved)
+    except (OSError, ValueError):
+        pass
+    model = train(read_corpus(corpus_path) + lexicon_examples(), corpus)
+    try:
+        save(model, model_path)
+    except OSError:
+        pass  # read-only directory: keep the model in memory
+    return model
+
+
+def model() -> IntentModel:
+    """The process-wide model, loaded on first use"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = load()
+        return _model
+
+
+def route(message):
+    """The topic of a message, or None"""
+    return model().predict(message)
+
+
+def _percentile(samples, fraction):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def benchmark(count, holdout):
+    """Held-out accuracy of the model and the keyword lexicons, and
+    latency per message"""
+    import chat_router
+
+    examples = read_corpus()
+    random.shuffle(examples)
+    split = int(len(examples) * (1 - holdout))
+    held_out = train(examples[:split] + lexicon_examples())
+    expected = [None if intent == GENERAL else intent for _, intent in examples[split:]]
+    results = {
+        'model_accuracy': sum(held_out.predict(text) == want for (text, _), want in zip(examples[split:], expected)) / len(expected),
+        'keyword_accuracy': sum(chat_router._keyword_route(text) == want for (text, _), want in zip(examples[split:], expected)) / len(expected),
+    }
+
+    started = time.perf_counter()
+    full = load()
+    results['load_ms'] = (time.perf_counter() - started) * 1000
+    messages = [text for text, _ in examples] + chat_router.make_messages(count, 200)
+    for name, function in [('model', full.predict), ('keywords', chat_router._keyword_route)]:
+        samples = []
+        for message in messages:
+            started = time.perf_counter()
+            function(message)
+            samples.append((time.perf_counter() - started) * 1e6)
+        results[f'{name}_p50_us'] = _percentile(samples, 0.5)
+        results[f'{name}_p99_us'] = _percentile(samples, 0.99)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat intent classifier")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('train', help="train on the corpus and save the model")
+    bench = commands.add_parser('benchmark', help="accuracy on a held-out split and latency per message")
+    bench.add_argument('--messages', type=int, default=1000, help="long messages added to the latency run")
+    bench.add_argument('--holdout', type=float, default=0.25, help="share of the corpus held out")
+    predict = commands.add_parser('predict', help="show the intents of a message")
+    predict.add_argument('message')
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        model = train(read_corpus() + lexicon_examples(), _corpus_id(CORPUS_PATH))
+        save(model)
+        print(f"{len(model.terms)} terms, {len(model.intents)} intents -> {MODEL_PATH}")
+        return 0
+    if args.command == 'predict':
+        probabilities = load().probabilities(args.message)
+        for intent, probability in sorted(probabilities.items(), key=lambda item: -item[1]):
+            print(f"{probability:6.3f}  {intent}")
+        return 0
+    random.seed(7)
+    for name, value in benchmark(args.messages, args.holdout).items():
+        print(f"{name:>17}: {value:10.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
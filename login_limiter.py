@@ -0,0 +1,154 @@
+# MindfulBuddy - Login rate limiter
+"""Token-bucket limiter for failed logins, shared by every session.
+
+Each key (a username or a client address) has a bucket of ATTEMPTS
+tokens. A failed login takes one token, and the bucket refills at
+ATTEMPTS per WINDOW seconds. A key with no whole token left must wait
+until one comes back. Checks are a dict lookup and some arithmetic, so
+they run before any password hashing.
+
+Buckets live in an LRU-ordered dict capped at MAX_KEYS. The idle keys
+evicted first are full buckets, or nearly so, and a full bucket is the
+same as no entry. Set MINDFUL_LIMITER_DB to a SQLite file (the app
+database will do) to share the buckets between worker processes instead.
+"""
+import collections
+import math
+import os
+import threading
+import time
+
+import sqlite_store
+
+ATTEMPTS = int(os.environ.get('MINDFUL_LOGIN_ATTEMPTS', '5'))
+WINDOW = float(os.environ.get('MINDFUL_LOGIN_WINDOW_SECONDS', '600'))
+MAX_KEYS = int(os.environ.get('MINDFUL_LIMITER_MAX_KEYS', '100000'))
+DB_PATH = os.environ.get('MINDFUL_LIMITER_DB')
+
+LIMITER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS login_limits (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS login_limits_updated ON login_limits (updated);
+"""
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def user_key(username):
+    return f"user:{username}"
+
+
+def client_key(client):
+    return f"client:{client}"
+
+
+def client_keys(address) -> tuple:
+    """The bucket keys of a client address: none when the address is
+    unknown (behind some proxies), so unknown visitors do not share one
+    bucket that a single attacker could drain for all of them"""
+    return (client_key(address),) if address else ()
+
+
+def minutes(seconds) -> int:
+    """Whole minutes to show for a wait"""
+    return max(1, math.ceil(seconds / 60))
+
+
+class LoginLimiter:
+    """In-process token buckets"""
+
+    def __init__(self, attempts=ATTEMPTS, window=WINDOW, max_keys=MAX_KEYS):
+        self.attempts = attempts
+        self.rate = attempts / window
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.attempts
+        tokens, updated = bucket
+        return min(self.attempts, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, *keys) -> float:
+        """Seconds until every key may try again (0 if it may now)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = min((self._tokens(key, now) for key in keys), default=self.attempts)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def record_failure(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._buckets[key] = (max(0.0, self._tokens(key, now) - 1), now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+    def reset(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SqliteLoginLimiter:
+    """The same buckets in a SQLite table shared by worker processes"""
+
+    def __init__(self, path, attempts=ATTEMPTS, window=WINDOW):
+        self.path = path
+        self.attempts = attempts
+        self.window = window
+        self.rate = attempts / window
+        self.conn.executescript(LIMITER_SCHEMA)
+
+    @property
+    def conn(self):
+        return sqlite_store.connect(self.path)
+
+    def _tokens(self, row, now):
+        if row is None:
+            return self.attempts
+        return min(self.attempts, row['tokens'] + (now - row['updated']) * self.rate)
+
+    def retry_after(self, *keys) -> float:
+        if not keys:
+            return 0.0
+        now = time.time()
+        rows = self.conn.execute(
+            f"SELECT tokens, updated FROM login_limits WHERE key IN ({','.join('?' * len(keys))})", keys
+        ).fetchall()
+        tokens = min([self._tokens(row, now) for row in rows] or [self.attempts])
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def record_failure(self, *keys):
+        now = time.time()
+        with sqlite_store.transaction(self.conn) as conn:
+            for key in keys:
+                row = conn.execute("SELECT tokens, updated FROM login_limits WHERE key = ?", (key,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO login_limits (key, tokens, updated) VALUES (?, ?, ?)",
+                             (key, max(0.0, self._tokens(row, now) - 1), now))
+            # Buckets idle for a whole window are full again
+            conn.execute("DELETE FROM login_limits WHERE updated < ?", (now - self.window,))
+
+    def reset(self, *keys):
+        if not keys:
+            return
+        self.conn.execute(f"DELETE FROM login_limits WHERE key IN ({','.join('?' * len(keys))})", keys)
+
+
+def shared():
+    """The process-wide limiter (SQLite-backed when MINDFUL_LIMITER_DB is set)"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SqliteLoginLimiter(DB_PATH) if DB_PATH else LoginLimiter()
+        return _shared
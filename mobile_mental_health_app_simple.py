@@ -1,13 +1,18 @@
 # MindfulBuddy - ULTIMATE PLATFORM v5.2 (AI Conversation + Voice + WhatsApp Chat)
 import streamlit as st
 import json
-import hashlib
 import pandas as pd
 from datetime import datetime
 import plotly.graph_objects as go
-import os
 import random
 import re
+import chat_batch
+import chat_render
+import chat_router
+import conversation_state
+import data_store
+import password_hashing
+import sso_service
 
 # ---------- Config ----------
 st.set_page_config(
@@ -72,51 +77,40 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ---------- Data helpers ----------
-def hash_password(p: str) -> str:
-    return hashlib.sha256(p.encode()).hexdigest()
-
-def verify_password(p: str, h: str) -> bool:
-    return hash_password(p) == h
-
-def initialize_all_data_files():
-    if not os.path.exists('ultimate_platform_data.json'):
-        data = {
-            "users": {
-                "demo_user": {
-                    "password_hash": hash_password("demo123"),
-                    "age_group": "18-24",
-                    "mood_history": [
-                        {"date":"2025-08-01 10:00:00","mood":7,"energy":6,"stress":4,"sleep":8,"platform":"ultimate","note":"Feeling good today!"},
-                        {"date":"2025-08-02 09:30:00","mood":8,"energy":7,"stress":3,"sleep":9,"platform":"ultimate","note":"Great sleep last night"}
-                    ],
-                    "created_date": "2025-08-01 00:00:00",
-                    "account_type": "ultimate_professional",
-                    "ai_conversations": [],
-                    "voice_interactions": [],
-                    "preferences": {"daily_reminders": True,"crisis_monitoring": True,"voice_enabled": True,"theme": "Professional Blue"}
-                }
-            },
-            "sessions": {},
-            "platform_stats": {"total_users":1,"total_checkins":2,"voice_interactions":0,"platform_rating":4.9},
-            "app_metadata": {"version":"5.2.0","platform_level":"ultimate","features_enabled":["ai","analytics","security","family","voice","reports","ai_chat"]}
-        }
-        with open('ultimate_platform_data.json','w') as f:
-            json.dump(data, f, indent=2)
+def default_platform_data():
+    return {
+        "users": {
+            "demo_user": {
+                "password_hash": password_hashing.hash_password("demo123"),
+                "age_group": "18-24",
+                "mood_history": [
+                    {"date":"2025-08-01 10:00:00","mood":7,"energy":6,"stress":4,"sleep":8,"platform":"ultimate","note":"Feeling good today!"},
+                    {"date":"2025-08-02 09:30:00","mood":8,"energy":7,"stress":3,"sleep":9,"platform":"ultimate","note":"Great sleep last night"}
+                ],
+                "created_date": "2025-08-01 00:00:00",
+                "account_type": "ultimate_professional",
+                "ai_conversations": [],
+                "voice_interactions": [],
+                "preferences": {"daily_reminders": True,"crisis_monitoring": True,"voice_enabled": True,"theme": "Professional Blue"}
+            }
+        },
+        "sessions": {},
+        "platform_stats": {"total_users":1,"total_checkins":2,"voice_interactions":0,"platform_rating":4.9},
+        "app_metadata": {"version":"5.2.0","platform_level":"ultimate","features_enabled":["ai","analytics","security","family","voice","reports","ai_chat"]}
+    }
 
 def load_data():
-    try:
-        with open('ultimate_platform_data.json','r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        initialize_all_data_files()
-        return load_data()
-
-def save_data(d):
-    with open('ultimate_platform_data.json','w') as f:
-        json.dump(d, f, indent=2)
+    return data_store.open_store('ultimate', default_platform_data)
+
+def new_platform_user():
+    """This app's record for a user signed in through another app"""
+    return {
+        "created_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "account_type": "ultimate_professional",
+        "preferences": {"daily_reminders": True,"crisis_monitoring": True,"voice_enabled": True,"theme": "Professional Blue"}
+    }
 
-initialize_all_data_files()
-app_data = load_data()
+store = load_data()
 
 # ---------- AI conversation helpers ----------
 def extract_mood_from_speech(text: str):
@@ -161,37 +155,18 @@ def generate_voice_response(mood_score, name, speech_text=""):
     return random.choice(base)
 
 def generate_ai_response(user_message, history, user_mood=None):
-    txt = user_message.lower()
-    if user_mood:
-        if user_mood <= 3:
-            return random.choice(["That sounds rough. What was the hardest part today?",
-                                  "Thanks for sharing. Want ideas for small relief now?"])
-        if user_mood >= 8:
-            return random.choice(["Love that energy. What went right today?",
-                                  "Great to hear. Want to lock a habit while you feel good?"])
-    if any(w in txt for w in ['sad','depressed','down','awful','terrible']):
-        return "I hear you. Sadness can feel heavy. What started it today?"
-    if any(w in txt for w in ['anxious','worried','nervous','stressed','panic']):
-        return "Anxiety is real. Want a quick 4-7-8 breathing guide?"
-    if any(w in txt for w in ['angry','mad','frustrated','annoyed']):
-        return "Anger often points to something that matters. What felt unfair?"
-    if any(w in txt for w in ['happy','good','great','amazing','wonderful']):
-        return "Nice. What is one thing that made you smile?"
-    if any(w in txt for w in ['school','work','job','study','exam','test']):
-        return "We can plan it simply. What is the next small task due?"
-    if any(w in txt for w in ['family','parents','mom','dad','brother','sister']):
-        return "Family can be complex. What outcome would feel better?"
-    if any(w in txt for w in ['friend','friends','social','lonely','alone']):
-        return "Social stuff hits hard. Who do you feel safe texting today?"
-    if any(w in txt for w in ['help','advice','what should','how can']):
-        return "Tell me your goal in one line and what you tried so far."
-    return "I am here. Tell me more about what you feel right now."
+    return chat_batch.reply(chat_router.route(user_message), user_message, history, user_mood)
 
 # ---------- Session ----------
 if 'current_user' not in st.session_state: st.session_state.current_user = None
-if 'conversation' not in st.session_state: st.session_state.conversation = []
+if 'conversation' not in st.session_state: st.session_state.conversation = conversation_state.ConversationState()
 if 'chat_style' not in st.session_state: st.session_state.chat_style = "WhatsApp"
 if 'chat_mood' not in st.session_state: st.session_state.chat_mood = None
+if 'chat_shown' not in st.session_state: st.session_state.chat_shown = chat_render.WINDOW
+
+# Signed in through the shared identity service; a one-time ?sso=<code> carries the login between apps
+if 'sso' in st.query_params or st.session_state.get('sso_token'):
+    st.session_state.current_user = sso_service.resume(store, st.session_state, st.query_params, new_platform_user)
 
 # ---------- Header ----------
 st.markdown("""
@@ -211,7 +186,7 @@ st.markdown("""
 # ---------- Sidebar ----------
 with st.sidebar:
     st.markdown("### Platform Overview")
-    stats = app_data.get("platform_stats", {})
+    stats = store.get_section("platform_stats")
     st.metric("Users", f"{stats.get('total_users',0):,}")
     st.metric("Check-ins", f"{stats.get('total_checkins',0):,}")
     st.metric("Voice logs", f"{stats.get('voice_interactions',0):,}")
@@ -258,8 +233,9 @@ if st.session_state.current_user is None:
             login_name = st.text_input("Username")
             login_pass = st.text_input("Password", type="password")
             if st.button("Access Platform", type="primary", use_container_width=True):
-                users = app_data["users"]
-                if login_name and login_pass and login_name in users and verify_password(login_pass, users[login_name]["password_hash"]):
+                signed_in = sso_service.sign_in(store, login_name, login_pass, new_platform_user) if login_name and login_pass else None
+                if signed_in:
+                    sso_service.keep(st.session_state, st.query_params, signed_in['token'])
                     st.session_state.current_user = login_name
                     st.success(f"Welcome, {login_name}")
                     st.rerun()
@@ -279,27 +255,20 @@ if st.session_state.current_user is None:
         if st.button("Create Account", type="primary", use_container_width=True):
             if not su_name or not su_pass:
                 st.error("Fill all fields")
-            elif su_name in app_data["users"]:
-                st.error("Username taken")
             else:
-                app_data["users"][su_name] = {
-                    "password_hash": hash_password(su_pass),
-                    "age_group": su_age,
-                    "mood_history": [],
-                    "ai_conversations": [],
-                    "voice_interactions": [],
-                    "created_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "account_type": "ultimate_professional",
-                    "preferences": {"daily_reminders": True,"crisis_monitoring": True,"voice_enabled": True,"theme": "Professional Blue"}
-                }
-                app_data["platform_stats"]["total_users"] += 1
-                save_data(app_data)
-                st.session_state.current_user = su_name
-                st.success(f"Welcome, {su_name}")
-                st.rerun()
+                token = sso_service.sign_up(store, su_name, su_pass, {**new_platform_user(), "age_group": su_age})
+                if not token:
+                    st.error("Username taken")
+                else:
+                    store.increment("platform_stats", "total_users")
+                    sso_service.keep(st.session_state, st.query_params, token)
+                    st.session_state.current_user = su_name
+                    st.success(f"Welcome, {su_name}")
+                    st.rerun()
 
 else:
-    user = app_data["users"][st.session_state.current_user]
+    user_name = st.session_state.current_user
+    user = store.get_user(user_name)
 
     st.markdown(f"""
     <div class="ultimate-card">
@@ -315,14 +284,14 @@ else:
 
     # ----- Dashboard -----
     if nav == "🏠 Dashboard":
-        mh = user.get("mood_history", [])
+        mh = store.mood_history(user_name)
         if mh:
             moods = [r["mood"] for r in mh]
             c1, c2, c3, c4 = st.columns(4)
             with c1: st.metric("Total check-ins", len(moods))
             with c2: st.metric("Average mood", f"{sum(moods)/len(moods):.1f}/10")
             with c3: st.metric("Best day", f"{max(moods)}/10")
-            with c4: st.metric("Voice logs", len(user.get("voice_interactions", [])))
+            with c4: st.metric("Voice logs", store.message_count(user_name, "voice"))
 
             df = pd.DataFrame(mh)
             df["date"] = pd.to_datetime(df["date"])
@@ -353,9 +322,8 @@ else:
         if st.button("Save check-in", type="primary", use_container_width=True):
             entry = {"date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "mood": mood, "energy": energy, "stress": stress, "sleep": sleep, "platform": "ultimate"}
             if note: entry["note"] = note
-            user.setdefault("mood_history", []).append(entry)
-            app_data["platform_stats"]["total_checkins"] += 1
-            save_data(app_data)
+            store.add_mood_entry(user_name, entry)
+            store.increment("platform_stats", "total_checkins")
             st.success("Check-in saved")
             st.balloons()
             st.rerun()
@@ -368,39 +336,23 @@ else:
             st.session_state.chat_mood = st.slider("Quick mood", 1, 10, st.session_state.chat_mood or 6)
             st.markdown(f'<span class="mood-badge">Mood: {st.session_state.chat_mood}/10</span>', unsafe_allow_html=True)
             if st.button("Clear chat", use_container_width=True):
-                st.session_state.conversation = []
-                save_data(app_data)
+                st.session_state.conversation.clear()
+                st.session_state.chat_shown = chat_render.WINDOW
                 st.rerun()
 
         with top_c1:
             st.markdown("### AI chat")
-            # render chat
-            if st.session_state.chat_style == "WhatsApp":
-                if st.session_state.conversation:
-                    html = '<div class="whatsapp-container">'
-                    for m in st.session_state.conversation:
-                        t = m.get("timestamp","")
-                        if m["sender"] == "user":
-                            html += f'<div class="user-bubble">{m["message"]}<div class="message-time">{t}</div></div>'
-                        else:
-                            html += f'<div class="ai-bubble">{m["message"]}<div class="message-time ai-message-time">{t}</div></div>'
-                    html += '</div>'
-                    st.markdown(html, unsafe_allow_html=True)
-                else:
-                    st.info("Start the conversation below.")
+            # render chat: the latest messages, earlier ones a page at a time (see chat_render);
+            # the session keeps only its tail of this chat (conversation_state.HOT_MESSAGES)
+            if st.session_state.conversation:
+                hidden = chat_render.earlier(st.session_state.conversation.messages, st.session_state.chat_shown)
+                if hidden and st.button(f"Load earlier messages ({hidden} more)"):
+                    st.session_state.chat_shown += chat_render.WINDOW
+                    st.rerun()
+                style = "whatsapp" if st.session_state.chat_style == "WhatsApp" else "classic"
+                st.markdown(chat_render.transcript(st.session_state.conversation.messages, st.session_state.chat_shown, style), unsafe_allow_html=True)
             else:
-                # Classic
-                if st.session_state.conversation:
-                    html = '<div class="chat-container">'
-                    for m in st.session_state.conversation:
-                        if m["sender"] == "user":
-                            html += f'<div class="user-message">{m["message"]}</div>'
-                        else:
-                            html += f'<div class="ai-message">🤖 {m["message"]}</div>'
-                    html += '</div>'
-                    st.markdown(html, unsafe_allow_html=True)
-                else:
-                    st.info("Start the conversation below.")
+                st.info("Start the conversation below.")
 
             msg = st.text_area("Type your message", height=100, placeholder="Tell me what is on your mind")
             if st.button("Send", type="primary", use_container_width=True):
@@ -408,11 +360,10 @@ else:
                     st.session_state.conversation.append({"sender":"user","message":msg,"timestamp": datetime.now().strftime("%H:%M")})
                     reply = generate_ai_response(msg, st.session_state.conversation, st.session_state.chat_mood)
                     st.session_state.conversation.append({"sender":"ai","message":reply,"timestamp": datetime.now().strftime("%H:%M")})
-                    user.setdefault("ai_conversations", []).extend([
+                    store.add_messages(user_name, [
                         {"type":"user","message":msg,"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
                         {"type":"ai","message":reply,"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
                     ])
-                    save_data(app_data)
                     st.rerun()
 
     # ----- Voice -----
@@ -432,31 +383,31 @@ else:
 
         if st.button("Generate voice reply", type="primary", use_container_width=True):
             name = st.session_state.current_user
-            mood_for_reply = detected if detected is not None else (user.get("mood_history", [])[-1]["mood"] if user.get("mood_history") else None)
+            latest = store.latest_mood(user_name)
+            mood_for_reply = detected if detected is not None else (latest["mood"] if latest else None)
             resp = generate_voice_response(mood_for_reply, name, transcript or "")
-            user.setdefault("voice_interactions", []).append({
+            store.add_messages(name, [{
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "transcript": transcript,
                 "detected_mood": mood_for_reply,
                 "response": resp
-            })
-            app_data["platform_stats"]["voice_interactions"] = app_data["platform_stats"].get("voice_interactions",0) + 1
+            }], channel="voice")
+            store.increment("platform_stats", "voice_interactions")
             # Also add to chat thread
             st.session_state.conversation.append({"sender":"user","message": transcript or "(voice)", "timestamp": datetime.now().strftime("%H:%M")})
             st.session_state.conversation.append({"sender":"ai","message": resp, "timestamp": datetime.now().strftime("%H:%M")})
-            save_data(app_data)
             st.success("Voice reply created and logged")
 
-        logs = user.get("voice_interactions", [])
+        logs = store.messages(user_name, "voice", limit=5)
         if logs:
             st.markdown("#### Recent voice logs")
-            for item in logs[-5:][::-1]:
+            for item in reversed(logs):
                 st.write(f"🕒 {item['timestamp']} • Mood: {item.get('detected_mood','?')}")
                 if item.get("transcript"): st.write(f"🎙️ {item['transcript']}")
                 st.write(f"🤖 {item.get('response','')}")
                 st.markdown("---")
 
-        st.caption("To connect WhatsApp, use WhatsApp Cloud API or Twilio WhatsApp with a webhook that writes to this JSON store.")
+        st.caption("To connect WhatsApp, use WhatsApp Cloud API or Twilio WhatsApp with a webhook that writes to this JSON store. Answer a backlog of messages with `python chat_batch.py answer backlog.jsonl`.")
 
     # ----- Settings -----
     elif nav == "⚙️ Settings":
@@ -468,8 +419,8 @@ else:
             st.write("**Plan:** Ultimate Professional")
         with s2:
             st.write(f"**Member since:** {user.get('created_date','Unknown')[:10]}")
-            st.write(f"**Mood check-ins:** {len(user.get('mood_history', []))}")
-            st.write(f"**AI conversations:** {len(user.get('ai_conversations', []))}")
+            st.write(f"**Mood check-ins:** {store.mood_count(user_name)}")
+            st.write(f"**AI conversations:** {store.message_count(user_name)}")
 
         st.markdown("#### Data")
         d1, d2 = st.columns(2)
@@ -479,9 +430,9 @@ else:
                     "user": st.session_state.current_user,
                     "exported": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                     "account_type": user.get("account_type"),
-                    "mood_history": user.get("mood_history", []),
-                    "ai_conversations": user.get("ai_conversations", []),
-                    "voice_interactions": user.get("voice_interactions", []),
+                    "mood_history": store.mood_history(user_name),
+                    "ai_conversations": store.messages(user_name),
+                    "voice_interactions": store.messages(user_name, "voice"),
                     "preferences": user.get("preferences", {}),
                     "platform": "MindfulBuddy Ultimate v5.2"
                 }
@@ -494,8 +445,11 @@ else:
 
         st.markdown("---")
         if st.button("Logout", use_container_width=True):
+            sso_service.sign_out(st.session_state, st.query_params)
+            st.query_params.clear()
             st.session_state.current_user = None
-            st.session_state.conversation = []
+            st.session_state.conversation.clear()
+            st.session_state.chat_shown = chat_render.WINDOW
             st.rerun()
 
 # ---------- Footer ----------
@@ -0,0 +1,181 @@
+# MindfulBuddy - Columnar mood history
+"""Columnar, memory-mapped copy of each user's mood history.
+
+Mood entries live in the stores as dicts with string dates, which every
+analytics pass had to re-parse. Here each user gets fixed-width binary
+columns instead:
+
+    mood_columns/<store>/<xx>/<sha1>/timestamp.i64   seconds since the epoch
+    mood_columns/<store>/<xx>/<sha1>/mood.u8         (and energy, stress, sleep)
+    mood_columns/<store>/<xx>/<sha1>/side.jsonl      notes, activities, ...
+
+Timestamps are the entry's wall-clock time encoded as if it were UTC, so
+converting back gives the same date and hour the user saw. A score of 0
+means it was not recorded. Side-table lines carry the row number of the
+entry they belong to.
+
+The columns are derived from the store: load() appends whatever entries
+the store has that the files do not, then maps each file with
+numpy.memmap, so analytics get read-only NumPy arrays without parsing or
+copying anything.
+"""
+import calendar
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+import data_store
+
+COLUMNS_DIR = os.environ.get('MINDFUL_COLUMNS_DIR', 'mood_columns')
+
+SCORES = ('mood', 'energy', 'stress', 'sleep')
+COLUMNS = {'timestamp': np.int64, **{score: np.uint8 for score in SCORES}}
+SIDE_FILE = 'side.jsonl'
+SECONDS_PER_DAY = 86400
+
+
+def epoch_seconds(moment):
+    """Wall-clock datetime (or entry date string) to the column encoding"""
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    return calendar.timegm(moment.timetuple())
+
+
+def column_dir(store_name, username):
+    digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+    return os.path.join(COLUMNS_DIR, store_name, digest[:2], digest)
+
+
+def _column_path(directory, column):
+    suffix = 'i64' if COLUMNS[column] is np.int64 else 'u8'
+    return os.path.join(directory, f"{column}.{suffix}")
+
+
+def _row_count(directory):
+    """Rows present in every column (a crash can leave some columns longer)"""
+    counts = []
+    for column, dtype in COLUMNS.items():
+        try:
+            size = os.path.getsize(_column_path(directory, column))
+        except FileNotFoundError:
+            return 0
+        counts.append(size // np.dtype(dtype).itemsize)
+    return min(counts)
+
+
+def _truncate(directory, rows):
+    for column, dtype in COLUMNS.items():
+        path = _column_path(directory, column)
+        if os.path.exists(path):
+            os.truncate(path, rows * np.dtype(dtype).itemsize)
+    if rows == 0:
+        try:
+            os.remove(os.path.join(directory, SIDE_FILE))
+        except FileNotFoundError:
+            pass
+
+
+def _append(directory, entries, first_row):
+    """Append entries as rows; the side table goes first, timestamps last"""
+    side_lines = []
+    for offset, entry in enumerate(entries):
+        extra = {key: value for key, value in entry.items() if key not in ('date',) + SCORES}
+        if extra:
+            side_lines.append(json.dumps({'row': first_row + offset, **extra}) + '\n')
+    if side_lines:
+        with open(os.path.join(directory, SIDE_FILE), 'a') as file:
+            file.writelines(side_lines)
+
+    values = {score: [entry.get(score) or 0 for entry in entries] for score in SCORES}
+    values['timestamp'] = [epoch_seconds(entry['date']) for entry in entries]
+    for column in list(SCORES) + ['timestamp']:
+        with open(_column_path(directory, column), 'ab') as file:
+            file.write(np.asarray(values[column], dtype=COLUMNS[column]).tobytes())
+
+
+def _last_row_matches(directory, rows, entry):
+    """Whether the last stored row is this entry (guards against a user
+    deleted and re-created under the same name)"""
+    if rows == 0:
+        return True
+    columns = MoodColumns(directory, rows)
+    return (int(columns.timestamp[-1]) == epoch_seconds(entry['date'])
+            and int(columns.mood[-1]) == entry['mood'])
+
+
+def sync(store, username):
+    """Append the store's new mood entries to the user's columns; returns the row count"""
+    directory = column_dir(store.name, username)
+    rows = _row_count(directory)
+    if rows == store.mood_count(username) and (
+            rows == 0 or _last_row_matches(directory, rows, store.latest_mood(username))):
+        return rows
+    os.makedirs(directory, exist_ok=True)
+    with data_store.store_lock(os.path.join(directory, 'columns')):
+        rows = _row_count(directory)
+        _truncate(directory, rows)
+        history = store.mood_history(username)
+        if rows > len(history) or (rows and not _last_row_matches(directory, rows, history[rows - 1])):
+            rows = 0
+            _truncate(directory, 0)
+        if len(history) > rows:
+            _append(directory, history[rows:], rows)
+        return len(history)
+
+
+def load(store, username):
+    """The user's mood history as memory-mapped columns, synced with the store"""
+    rows = sync(store, username)
+    return MoodColumns(column_dir(store.name, username), rows)
+
+
+class MoodColumns:
+    """Read-only NumPy views of one user's mood columns"""
+
+    def __init__(self, directory, rows):
+        self.directory = directory
+        self.rows = rows
+        for column, dtype in COLUMNS.items():
+            if rows:
+                array = np.memmap(_column_path(directory, column), dtype=dtype, mode='r', shape=(rows,))
+            else:
+                array = np.zeros(0, dtype=dtype)
+            setattr(self, column, array)
+        self._side = None
+
+    def __len__(self):
+        return self.rows
+
+    def dates(self):
+        """Timestamps as datetime64 values (wall-clock time)"""
+        return self.timestamp.astype('datetime64[s]')
+
+    def days(self):
+        """Calendar day number of each entry"""
+        return self.timestamp // SECONDS_PER_DAY
+
+    def days_since_last(self, now=None):
+        """Whole days between the last entry's date and now"""
+        now = epoch_seconds(now or datetime.now())
+        return (now - int(self.days()[-1]) * SECONDS_PER_DAY) // SECONDS_PER_DAY
+
+    def side(self):
+        """Notes, activities and other extra fields by row number"""
+        if self._side is None:
+            self._side = {}
+            try:
+                with open(os.path.join(self.directory, SIDE_FILE)) as file:
+                    for line in file:
+                        try:
+                            fields = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        row = fields.pop('row')
+                        if row < self.rows:
+                            self._side[row] = fields
+            except FileNotFoundError:
+                pass
+        return self._side
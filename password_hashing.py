@@ -0,0 +1,160 @@
+# MindfulBuddy - Password hashing service
+"""Password hashing shared by the apps.
+
+Hashes are PBKDF2-HMAC-SHA256 with a per-password salt, stored as
+
+    pbkdf2_sha256$<iterations>$<salt>$<hash>      (base64 salt and hash)
+
+The work factor is MINDFUL_PASSWORD_ITERATIONS. Hashing runs in a bounded
+pool of MINDFUL_HASH_WORKERS threads (default: one per core). PBKDF2 runs
+in OpenSSL without the GIL, so the threads use every core, while a login
+burst queues for a worker instead of running every hash at once and
+stalling the other sessions.
+
+Old bare SHA-256 hex digests still verify. After a successful login they
+(and hashes made with fewer iterations than the current setting) are
+rehashed on the pool and saved through the app's store by the thread
+that checked the login, since a store's connection (SqliteStore) may
+belong to that thread. The upgrade costs one more hash, once per user.
+
+    python password_hashing.py benchmark --iterations 100000 300000 600000
+"""
+import argparse
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+
+ALGORITHM = 'pbkdf2_sha256'
+ITERATIONS = int(os.environ.get('MINDFUL_PASSWORD_ITERATIONS', '600000'))
+WORKERS = int(os.environ.get('MINDFUL_HASH_WORKERS', '0')) or os.cpu_count() or 1
+SALT_BYTES = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='password-hash')
+        return _pool
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+def _derive(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+
+def _hash_now(password, iterations):
+    salt = secrets.token_bytes(SALT_BYTES)
+    return f"{ALGORITHM}${iterations}${_b64(salt)}${_b64(_derive(password, salt, iterations))}"
+
+
+def _verify_now(password, stored):
+    if is_legacy(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+    try:
+        algorithm, iterations, salt, expected = stored.split('$')
+        if algorithm != ALGORITHM:
+            return False
+        derived = _derive(password, base64.b64decode(salt), int(iterations))
+        return hmac.compare_digest(derived, base64.b64decode(expected))
+    except ValueError:
+        return False
+
+
+def is_legacy(stored) -> bool:
+    """Whether a stored hash is an old bare SHA-256 hex digest"""
+    return len(stored) == 64 and all(char in '0123456789abcdef' for char in stored)
+
+
+def needs_rehash(stored, iterations=None) -> bool:
+    """Whether a stored hash is legacy or weaker than the current setting"""
+    if is_legacy(stored):
+        return True
+    try:
+        return int(stored.split('$')[1]) < (iterations or ITERATIONS)
+    except (IndexError, ValueError):
+        return True
+
+
+def hash_password(password, iterations=None) -> str:
+    """Hash a new password on the pool (waits for the result)"""
+    return _executor().submit(_hash_now, password, iterations or ITERATIONS).result()
+
+
+def verify_password(password, stored) -> bool:
+    """Check a password against a stored hash on the pool"""
+    if not stored:
+        return False
+    return _executor().submit(_verify_now, password, stored).result()
+
+
+def check_password(store, username, password, user=None) -> bool:
+    """Verify a login; on success a legacy or weaker hash is replaced with
+    a current one"""
+    if user is None:
+        user = store.get_user(username)
+    stored = (user or {}).get('password_hash')
+    if not verify_password(password, stored):
+        return False
+    if needs_rehash(stored):
+        store.update_user(username, password_hash=hash_password(password))
+    return True
+
+
+def benchmark(iterations_list, logins, workers):
+    """Logins per second (one verification each) at each cost setting"""
+    results = []
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for iterations in iterations_list:
+            stored = _hash_now('correct horse', iterations)
+            started = time.perf_counter()
+            _verify_now('correct horse', stored)
+            single_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            assert all(pool.map(lambda _: _verify_now('correct horse', stored), range(logins)))
+            elapsed = time.perf_counter() - started
+            results.append({
+                'iterations': iterations,
+                'hash_ms': single_ms,
+                'logins_per_sec': logins / elapsed,
+                'logins_per_sec_per_core': logins / elapsed / min(workers, os.cpu_count() or 1),
+            })
+    finally:
+        pool.shutdown()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Password hashing tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench = commands.add_parser('benchmark', help="logins per second at several cost settings")
+    bench.add_argument('--iterations', type=int, nargs='+', default=[100000, 300000, 600000])
+    bench.add_argument('--logins', type=int, default=64)
+    bench.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args(argv)
+
+    print(f"{args.workers} workers, {os.cpu_count()} cores")
+    print(f"{'iterations':>10} {'one hash':>10} {'logins/s':>10} {'per core':>10}")
+    for result in benchmark(args.iterations, args.logins, args.workers):
+        print(f"{result['iterations']:>10} {result['hash_ms']:>8.1f}ms {result['logins_per_sec']:>10.1f}"
+              f" {result['logins_per_sec_per_core']:>10.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
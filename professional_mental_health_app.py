@@ -3,6 +3,8 @@ import streamlit as st
 import json
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
+import data_store
+import sso_service
 
 # Professional page config
 st.set_page_config(
@@ -184,26 +186,28 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def default_professional_data():
+    """Initial layout of the professional store"""
+    return {
+        'users': {},
+        'app_metadata': {
+            'version': '1.0.0',
+            'launch_date': datetime.now().strftime("%Y-%m-%d"),
+            'total_users': 0,
+            'total_checkins': 0
+        }
+    }
+
 def load_professional_data():
     """Load professional app data"""
-    try:
-        with open('professional_app_data.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {
-            'users': {},
-            'app_metadata': {
-                'version': '1.0.0',
-                'launch_date': datetime.now().strftime("%Y-%m-%d"),
-                'total_users': 0,
-                'total_checkins': 0
-            }
-        }
+    return data_store.open_store('professional', default_professional_data)
 
-def save_professional_data(data):
-    """Save professional app data"""
-    with open('professional_app_data.json', 'w') as file:
-        json.dump(data, file, indent=2)
+def new_professional_user():
+    """This app's record for a user signed in through another app"""
+    return {
+        'created_date': datetime.now().strftime("%Y-%m-%d %H:%M"),
+        'account_type': 'professional'
+    }
 
 def get_professional_mood_status(mood_score):
     """Get professional status indicator"""
@@ -231,12 +235,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load professional data
-app_data = load_professional_data()
+store = load_professional_data()
 
 # Initialize session state
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 
+# Signed in through the shared identity service; a one-time ?sso=<code> carries the login between apps
+if 'sso' in st.query_params or st.session_state.get('sso_token'):
+    st.session_state.current_user = sso_service.resume(store, st.session_state, st.query_params, new_professional_user)
+
 # Professional welcome section
 if st.session_state.current_user is None:
     st.markdown("""
@@ -292,7 +300,7 @@ if st.session_state.current_user is None:
         login_name = st.text_input("Username:", key="login_name", placeholder="Enter your username")
         
         if st.button("🚀 Access Platform", type="primary", use_container_width=True):
-            if login_name and login_name in app_data['users']:
+            if login_name and store.user_exists(login_name):
                 st.session_state.current_user = login_name
                 st.success(f"✅ Welcome back, {login_name}!")
                 st.rerun()
@@ -312,16 +320,14 @@ if st.session_state.current_user is None:
             privacy_consent = st.checkbox("I agree to the Privacy Policy and Terms of Service")
         
         if st.button("🎉 Create Professional Account", type="primary", use_container_width=True):
-            if signup_name and privacy_consent and signup_name not in app_data['users']:
-                app_data['users'][signup_name] = {
+            if signup_name and privacy_consent and not store.user_exists(signup_name):
+                store.create_user(signup_name, {
                     'age_group': age_group,
                     'user_type': user_type,
-                    'mood_history': [],
                     'created_date': datetime.now().strftime("%Y-%m-%d %H:%M"),
                     'account_type': 'professional'
-                }
-                app_data['app_metadata']['total_users'] += 1
-                save_professional_data(app_data)
+                })
+                store.increment('app_metadata', 'total_users')
                 st.session_state.current_user = signup_name
                 st.success(f"🎉 Professional account created! Welcome, {signup_name}!")
                 st.balloons()
@@ -335,11 +341,12 @@ if st.session_state.current_user is None:
 
 else:
     # Professional dashboard for logged-in users
-    user_data = app_data['users'][st.session_state.current_user]
+    user_data = store.get_user(st.session_state.current_user)
+    mood_history = store.mood_history(st.session_state.current_user)
     
     # Professional status bar
-    if user_data.get('mood_history'):
-        latest_mood = user_data['mood_history'][-1]['mood']
+    if mood_history:
+        latest_mood = mood_history[-1]['mood']
         status_class, status_text, status_emoji = get_professional_mood_status(latest_mood)
         
         st.markdown(f"""
@@ -361,10 +368,10 @@ else:
         st.markdown("### 📊 Professional Dashboard")
         
         # Quick stats
-        if user_data.get('mood_history'):
+        if mood_history:
             col1, col2, col3, col4 = st.columns(4)
             
-            moods = [entry['mood'] for entry in user_data['mood_history']]
+            moods = [entry['mood'] for entry in mood_history]
             
             with col1:
                 st.metric("Total Check-ins", len(moods))
@@ -419,12 +426,8 @@ else:
             if note:
                 entry['note'] = note
             
-            if 'mood_history' not in user_data:
-                user_data['mood_history'] = []
-            
-            user_data['mood_history'].append(entry)
-            app_data['app_metadata']['total_checkins'] += 1
-            save_professional_data(app_data)
+            store.add_mood_entry(st.session_state.current_user, entry)
+            store.increment('app_metadata', 'total_checkins')
             
             st.success("✅ Check-in completed successfully!")
             st.balloons()
@@ -432,10 +435,10 @@ else:
     elif nav_choice == "📈 Analytics":
         st.markdown("### 📈 Professional Analytics")
         
-        if user_data.get('mood_history'):
+        if mood_history:
             # Create professional chart
-            moods = [entry['mood'] for entry in user_data['mood_history']]
-            dates = [entry['date'].split()[0] for entry in user_data['mood_history']]
+            moods = [entry['mood'] for entry in mood_history]
+            dates = [entry['date'].split()[0] for entry in mood_history]
             
             fig = go.Figure()
             fig.add_trace(go.Scatter(
@@ -483,7 +486,7 @@ else:
         if st.button("📤 Export Professional Data", use_container_width=True):
             export_data = {
                 'username': st.session_state.current_user,
-                'mood_history': user_data.get('mood_history', []),
+                'mood_history': mood_history,
                 'export_date': datetime.now().strftime("%Y-%m-%d %H:%M"),
                 'platform': 'MindfulBuddy Professional'
             }
@@ -498,6 +501,8 @@ else:
         
         # Logout
         if st.button("🚪 Logout", use_container_width=True):
+            sso_service.sign_out(st.session_state, st.query_params)
+            st.query_params.clear()
             st.session_state.current_user = None
             st.rerun()
 
@@ -1,10 +1,13 @@
 # MindfulBuddy - SECURE PROFESSIONAL VERSION 2.0
 import streamlit as st
-import json
-import hashlib
-import secrets
-from datetime import datetime, timedelta
+from datetime import datetime
 import plotly.graph_objects as go
+import brute_force_detector
+import data_store
+import login_limiter
+import security_log
+import session_store
+import sso_service
 
 # Secure page config
 st.set_page_config(
@@ -15,17 +18,9 @@ st.set_page_config(
 )
 
 # Security functions
-def hash_password(password):
-    """Securely hash password"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(password, hashed):
-    """Verify password against hash"""
-    return hash_password(password) == hashed
-
-def generate_session_token():
-    """Generate secure session token"""
-    return secrets.token_urlsafe(32)
+def generate_session_token(username):
+    """Start a session and return its token (HMAC-signed with MINDFUL_SESSION_MODE=signed)"""
+    return sessions.start(username, ip='hidden_for_privacy')
 
 def check_password_strength(password):
     """Check if password meets security requirements"""
@@ -167,44 +162,53 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def load_secure_data():
-    """Load secure app data with encryption"""
-    try:
-        with open('secure_app_data.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {
-            'users': {},
-            'sessions': {},
-            'security_log': [],
-            'app_metadata': {
-                'version': '2.0.0',
-                'security_level': 'professional',
-                'encryption_enabled': True,
-                'last_security_update': datetime.now().strftime("%Y-%m-%d")
-            }
+def default_secure_data():
+    """Initial layout of the secure store"""
+    return {
+        'users': {},
+        'sessions': {},
+        'app_metadata': {
+            'version': '2.0.0',
+            'security_level': 'professional',
+            'encryption_enabled': True,
+            'last_security_update': datetime.now().strftime("%Y-%m-%d")
         }
+    }
 
-def save_secure_data(data):
-    """Save secure app data"""
-    with open('secure_app_data.json', 'w') as file:
-        json.dump(data, file, indent=2)
+def load_secure_data(username=None):
+    """Load secure app data with encryption (only what username's pages need)"""
+    return data_store.open_user_store('secure', username, default_secure_data)
 
-def log_security_event(app_data, event_type, username, details):
-    """Log security events"""
-    if 'security_log' not in app_data:
-        app_data['security_log'] = []
-    
-    app_data['security_log'].append({
+def new_secure_user():
+    """This app's record for a user signed in through another app"""
+    return {
+        'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'account_type': 'secure_professional',
+        'security_settings': {
+            'two_factor': False,
+            'session_timeout': 24,
+            'login_notifications': True
+        }
+    }
+
+def log_security_event(store, event_type, username, details, durable=False):
+    """Log security events (durable: wait until the event and the
+    store writes before it are on disk)"""
+    if durable:
+        store.flush()
+    security_events.append({
         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         'event': event_type,
         'username': username,
         'details': details
-    })
-    
-    # Keep only last 100 log entries
-    if len(app_data['security_log']) > 100:
-        app_data['security_log'] = app_data['security_log'][-100:]
+    }, durable=durable)
+
+def record_login_failure(store, detector, username, address):
+    """Feed a failed login to the brute-force detector; a flag it raises
+    (an account, a client or credential stuffing) goes to the security log"""
+    if detector.record_failure(username, address):
+        scope = 'credential stuffing across accounts' if detector.throttled() else 'repeated failures'
+        log_security_event(store, 'BRUTE_FORCE_FLAG', username, f"Brute-force detector: {scope}", durable=True)
 
 # Secure header
 st.markdown("""
@@ -221,26 +225,38 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load secure data
-app_data = load_secure_data()
+store = load_secure_data(st.session_state.get('current_user'))
+sessions = session_store.open_sessions('secure')
+security_events = security_log.open_log('secure')
 
 # Initialize secure session state
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 if 'session_token' not in st.session_state:
     st.session_state.session_token = None
-if 'login_attempts' not in st.session_state:
-    st.session_state.login_attempts = 0
+
+# Signed in through the shared identity service; a one-time ?sso=<code> carries the login between apps
+if 'sso' in st.query_params or st.session_state.get('sso_token'):
+    signed_in = sso_service.resume(store, st.session_state, st.query_params, new_secure_user)
+    if signed_in != st.session_state.current_user:
+        # A login carried over from another app is held to the same limits as one typed here
+        address = getattr(st.context, 'ip_address', None)
+        wait = max(login_limiter.shared().retry_after(*login_limiter.client_keys(address), login_limiter.user_key(signed_in)),
+                   brute_force_detector.shared().retry_after(signed_in, address)) if signed_in else 0
+        if wait:
+            sso_service.keep(st.session_state, st.query_params, None)
+            log_security_event(store, 'LOGIN_BLOCKED', signed_in, 'SSO restore while throttled', durable=True)
+            st.error(f"🚨 Too many failed login attempts for this account. Please wait {login_limiter.minutes(wait)} minutes before trying again.")
+            signed_in = None
+        elif signed_in:
+            log_security_event(store, 'LOGIN_SUCCESS', signed_in, 'SSO restore from another app', durable=True)
+        st.session_state.current_user = signed_in
+        st.session_state.session_token = generate_session_token(signed_in) if signed_in else None
 
 # Security check - validate session
 if st.session_state.current_user and st.session_state.session_token:
-    session_valid = False
-    if 'sessions' in app_data and st.session_state.session_token in app_data['sessions']:
-        session_data = app_data['sessions'][st.session_state.session_token]
-        if session_data['username'] == st.session_state.current_user:
-            # Check if session hasn't expired (24 hours)
-            session_time = datetime.strptime(session_data['created'], "%Y-%m-%d %H:%M:%S")
-            if datetime.now() - session_time < timedelta(hours=24):
-                session_valid = True
+    # Unknown, expired (24 hours) or another user's session
+    session_valid = sessions.validate(st.session_state.session_token, st.session_state.current_user) is not None
     
     if not session_valid:
         st.session_state.current_user = None
@@ -299,8 +315,16 @@ if st.session_state.current_user is None:
     tab1, tab2 = st.tabs(["🔑 Secure Login", "➕ Create Secure Account"])
     
     with tab1:
-        if st.session_state.login_attempts >= 5:
-            st.error("🚨 Too many failed login attempts. Please wait 10 minutes before trying again.")
+        # Failed logins are limited per client and per username, across tabs and sessions,
+        # and watched across all usernames for credential stuffing
+        limiter = login_limiter.shared()
+        detector = brute_force_detector.shared()
+        # No per-client bucket when Streamlit cannot see the address; the username bucket still applies
+        address = getattr(st.context, 'ip_address', None)
+        clients = login_limiter.client_keys(address)
+        client_wait = max(limiter.retry_after(*clients), detector.retry_after(None, address))
+        if client_wait:
+            st.error(f"🚨 Too many failed login attempts. Please wait {login_limiter.minutes(client_wait)} minutes before trying again.")
         else:
             st.markdown("### 🔐 Secure Login")
             
@@ -323,37 +347,34 @@ if st.session_state.current_user is None:
                 """, unsafe_allow_html=True)
             
             if st.button("🔐 Secure Login", type="primary", use_container_width=True):
-                if login_name and login_password:
-                    if login_name in app_data['users']:
-                        user_data = app_data['users'][login_name]
-                        if verify_password(login_password, user_data['password_hash']):
+                wait = max(limiter.retry_after(*clients, login_limiter.user_key(login_name)),
+                           detector.retry_after(login_name, address)) if login_name else 0
+                if wait:
+                    st.error(f"🚨 Too many failed login attempts for this account. Please wait {login_limiter.minutes(wait)} minutes before trying again.")
+                elif login_name and login_password:
+                    signed_in = sso_service.sign_in(store, login_name, login_password, new_secure_user)
+                    if signed_in or store.user_exists(login_name) or sso_service.client().has_user(login_name):
+                        if signed_in:
                             # Successful login
-                            session_token = generate_session_token()
+                            session_token = generate_session_token(login_name)
+                            sso_service.keep(st.session_state, st.query_params, signed_in['token'])
                             st.session_state.current_user = login_name
                             st.session_state.session_token = session_token
-                            st.session_state.login_attempts = 0
+                            limiter.reset(login_limiter.user_key(login_name))
+                            detector.reset(login_name)
                             
-                            # Store session
-                            if 'sessions' not in app_data:
-                                app_data['sessions'] = {}
-                            app_data['sessions'][session_token] = {
-                                'username': login_name,
-                                'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                'ip': 'hidden_for_privacy'
-                            }
-                            
-                            log_security_event(app_data, 'LOGIN_SUCCESS', login_name, 'Secure login completed')
-                            save_secure_data(app_data)
+                            log_security_event(store, 'LOGIN_SUCCESS', login_name, 'Secure login completed', durable=True)
                             
                             st.success(f"🔐 Secure login successful! Welcome back, {login_name}!")
                             st.rerun()
                         else:
-                            st.session_state.login_attempts += 1
-                            log_security_event(app_data, 'LOGIN_FAILED', login_name, 'Invalid password')
-                            save_secure_data(app_data)
+                            limiter.record_failure(*clients, login_limiter.user_key(login_name))
+                            record_login_failure(store, detector, login_name, address)
+                            log_security_event(store, 'LOGIN_FAILED', login_name, 'Invalid password', durable=True)
                             st.error("❌ Invalid password. Please try again.")
                     else:
-                        st.session_state.login_attempts += 1
+                        limiter.record_failure(*clients, login_limiter.user_key(login_name))
+                        record_login_failure(store, detector, login_name, address)
                         st.error("❌ Username not found. Please check your username or create an account.")
                 else:
                     st.error("⚠️ Please enter both username and password.")
@@ -400,32 +421,22 @@ if st.session_state.current_user is None:
             if all([signup_name, signup_password, confirm_password, privacy_consent, security_consent]):
                 if len(signup_name) < 3:
                     st.error("⚠️ Username must be at least 3 characters long.")
-                elif signup_name in app_data['users']:
-                    st.error("❌ Username already taken. Please choose another.")
                 elif signup_password != confirm_password:
                     st.error("❌ Passwords don't match. Please try again.")
                 else:
                     is_strong, message = check_password_strength(signup_password)
+                    sso_token = sso_service.sign_up(store, signup_name, signup_password,
+                                                    {**new_secure_user(), 'age_group': age_group, 'user_type': user_type}) \
+                        if is_strong else None
                     if not is_strong:
                         st.error(f"❌ {message}")
+                    elif not sso_token:
+                        st.error("❌ Username already taken. Please choose another.")
                     else:
+                        # Signing in is done on the login tab
+                        sso_service.client().logout(sso_token)
                         # Create secure account
-                        app_data['users'][signup_name] = {
-                            'password_hash': hash_password(signup_password),
-                            'age_group': age_group,
-                            'user_type': user_type,
-                            'mood_history': [],
-                            'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            'account_type': 'secure_professional',
-                            'security_settings': {
-                                'two_factor': False,
-                                'session_timeout': 24,
-                                'login_notifications': True
-                            }
-                        }
-                        
-                        log_security_event(app_data, 'ACCOUNT_CREATED', signup_name, 'New secure account created')
-                        save_secure_data(app_data)
+                        log_security_event(store, 'ACCOUNT_CREATED', signup_name, 'New secure account created', durable=True)
                         
                         st.success(f"🛡️ Secure account created successfully! You can now log in, {signup_name}!")
                         st.balloons()
@@ -434,7 +445,7 @@ if st.session_state.current_user is None:
 
 else:
     # Secure dashboard for logged-in users
-    user_data = app_data['users'][st.session_state.current_user]
+    user_data = store.get_user(st.session_state.current_user)
     
     # Session info bar
     st.markdown(f"""
@@ -455,10 +466,11 @@ else:
         st.markdown("### 🛡️ Secure Dashboard")
         
         # Quick secure stats
-        if user_data.get('mood_history'):
+        mood_history = store.mood_history(st.session_state.current_user)
+        if mood_history:
             col1, col2, col3, col4 = st.columns(4)
             
-            moods = [entry['mood'] for entry in user_data['mood_history']]
+            moods = [entry['mood'] for entry in mood_history]
             
             with col1:
                 st.metric("🔒 Secure Check-ins", len(moods))
@@ -499,12 +511,8 @@ else:
             if note:
                 entry['note'] = note  # In real app, this would be encrypted
             
-            if 'mood_history' not in user_data:
-                user_data['mood_history'] = []
-            
-            user_data['mood_history'].append(entry)
-            log_security_event(app_data, 'MOOD_CHECKIN', st.session_state.current_user, f'Mood: {mood_score}')
-            save_secure_data(app_data)
+            store.add_mood_entry(st.session_state.current_user, entry)
+            log_security_event(store, 'MOOD_CHECKIN', st.session_state.current_user, f'Mood: {mood_score}')
             
             st.success("🔐 Secure check-in completed and encrypted!")
             st.balloons()
@@ -537,7 +545,7 @@ else:
             </div>
             """.format(
                 user_data.get('created_date', 'Unknown'),
-                len(user_data.get('mood_history', []))
+                store.mood_count(st.session_state.current_user)
             ), unsafe_allow_html=True)
         
         # Security actions
@@ -555,10 +563,8 @@ else:
         
         with col3:
             if st.button("📋 Security Log", use_container_width=True):
-                if 'security_log' in app_data:
-                    user_logs = [log for log in app_data['security_log'] if log['username'] == st.session_state.current_user]
-                    for log in user_logs[-5:]:  # Show last 5 events
-                        st.text(f"{log['timestamp']} - {log['event']}")
+                for log in security_events.recent(st.session_state.current_user, limit=5):  # Show last 5 events
+                    st.text(f"{log['timestamp']} - {log['event']}")
     
     elif nav_choice == "⚙️ Settings":
         st.markdown("### ⚙️ Secure Settings")
@@ -573,11 +579,11 @@ else:
         # Secure logout
         if st.button("🚪 Secure Logout", use_container_width=True):
             # Clean up session
-            if st.session_state.session_token in app_data.get('sessions', {}):
-                del app_data['sessions'][st.session_state.session_token]
+            sessions.delete(st.session_state.session_token)
+            sso_service.sign_out(st.session_state, st.query_params)
+            st.query_params.clear()
             
-            log_security_event(app_data, 'LOGOUT', st.session_state.current_user, 'Secure logout completed')
-            save_secure_data(app_data)
+            log_security_event(store, 'LOGOUT', st.session_state.current_user, 'Secure logout completed', durable=True)
             
             st.session_state.current_user = None
             st.session_state.session_token = None
@@ -0,0 +1,274 @@
+# MindfulBuddy - Security event log
+"""Append-only security log with an in-memory ring buffer.
+
+Events are appended as JSON lines to
+
+    security_logs/<app>/current.log         the file being written
+    security_logs/<app>/00000001.log ...    full files, oldest first
+
+and the current file is renamed to the next number once it reaches
+MAX_BYTES, so nothing is thrown away. Appends and rotation happen under
+the file's data_store.store_lock, so worker processes can share one log.
+
+Each process keeps the newest RING_CAPACITY events in a fixed-size ring
+with a per-user index (the ring positions of each user's events, oldest
+first), so "last k events for a user" costs O(k). The ring is filled by
+reading whatever the log files gained since the last read, which picks up
+other processes' events too.
+
+A user with fewer than k events in the ring is looked up in the files
+only if they may have older ones: their events were evicted from the
+ring, or the ring was filled from a longer history when the process
+started and the files have not been asked about them yet. That lookup
+goes through audit_query's per-user offset index, so it reads only the
+user's own lines; a user it shows to be wholly in the ring is not looked
+up again until the ring evicts one of their events. Quiet and new users
+on a busy app stay O(k).
+
+Stores used to keep the last 100 events in a security_log section of the
+app's JSON file. open_log() moves them into the log once (migrate_store),
+as the first rotated file 00000000.log, ahead of everything logged since.
+"""
+import collections
+import itertools
+import json
+import os
+import threading
+
+import data_store
+
+LOG_DIR = os.environ.get('MINDFUL_SECURITY_LOG_DIR', 'security_logs')
+MAX_BYTES = int(os.environ.get('MINDFUL_SECURITY_LOG_BYTES', str(1 << 20)))
+RING_CAPACITY = int(os.environ.get('MINDFUL_SECURITY_RING', '10000'))
+CURRENT_FILE = 'current.log'
+# The events a store kept before this log, ahead of every other file
+MIGRATED_FILE = '00000000.log'
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def log_files(directory) -> list:
+    """A log's rotated files oldest first, then its current file"""
+    rotated = sorted(name for name in os.listdir(directory) if name.endswith('.log') and name[:-4].isdigit())
+    return [os.path.join(directory, name) for name in rotated] + [os.path.join(directory, CURRENT_FILE)]
+
+
+def _parse(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class SecurityLog:
+    """One app's security log: rotating files plus a per-process ring"""
+
+    def __init__(self, name, directory=None, capacity=RING_CAPACITY, max_bytes=MAX_BYTES):
+        self.name = name
+        self.directory = directory or os.path.join(LOG_DIR, name)
+        self.current = os.path.join(self.directory, CURRENT_FILE)
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._slots = [None] * capacity
+        self._count = 0
+        self._by_user = {}
+        # Users with events older than the ring (evicted), and users known
+        # to have none; whether the ring started with the whole history
+        self._evicted = set()
+        self._covered = set()
+        self._complete = False
+        self._index = None
+        # Position in the files up to which events are in the ring; with
+        # no current file yet, the newest rotated file read
+        self._inode = None
+        self._offset = 0
+        self._rotated = ''
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._warm()
+
+    def files(self) -> list:
+        """Rotated files oldest first, then the current file"""
+        return log_files(self.directory)
+
+    # Ring buffer
+    def _add(self, event):
+        slot = self._count % self.capacity
+        old = self._slots[slot]
+        if old is not None:
+            # The evicted event is the oldest of its user's in the ring
+            positions = self._by_user[old.get('username')]
+            positions.popleft()
+            if not positions:
+                del self._by_user[old.get('username')]
+            self._evicted.add(old.get('username'))
+            self._covered.discard(old.get('username'))
+        self._slots[slot] = event
+        self._by_user.setdefault(event.get('username'), collections.deque()).append(self._count)
+        self._count += 1
+
+    def _warm(self):
+        """Fill the ring with the newest events on disk"""
+        with data_store.store_lock(self.current):
+            stat = os.stat(self.current) if os.path.exists(self.current) else None
+            self._inode, self._offset = (stat.st_ino, stat.st_size) if stat else (None, 0)
+            rotated = self.files()[:-1]
+            self._rotated = os.path.basename(rotated[-1]) if rotated else ''
+            events = list(itertools.islice(self._read_backwards(), self.capacity))
+        self._complete = len(events) < self.capacity
+        for event in reversed(events):
+            self._add(event)
+
+    def _read_range(self, path, start):
+        """Events after byte offset start; returns (events, new offset)"""
+        try:
+            with open(path, 'rb') as file:
+                file.seek(start)
+                data = file.read()
+        except FileNotFoundError:
+            return [], start
+        complete = data.rfind(b'\n') + 1
+        events = [event for event in map(_parse, data[:complete].split(b'\n')) if event is not None]
+        return events, start + complete
+
+    def _sync(self):
+        """Add events appended to the files since the last read (lock held)"""
+        try:
+            stat = os.stat(self.current)
+        except FileNotFoundError:
+            return
+        if stat.st_ino == self._inode and stat.st_size == self._offset:
+            return
+        if stat.st_ino != self._inode:
+            # Rotated: finish the file we were reading, then any newer full files
+            rotated = self.files()[:-1]
+            inodes = [os.stat(path).st_ino for path in rotated]
+            if self._inode is None:
+                # There was no current file: every file rotated since is new
+                for path in rotated:
+                    if os.path.basename(path) > self._rotated:
+                        for event in self._read_range(path, 0)[0]:
+                            self._add(event)
+            elif self._inode in inodes:
+                index = inodes.index(self._inode)
+                events, _ = self._read_range(rotated[index], self._offset)
+                for path in rotated[index + 1:]:
+                    events += self._read_range(path, 0)[0]
+                for event in events:
+                    self._add(event)
+            self._offset = 0
+        self._inode = stat.st_ino
+        events, self._offset = self._read_range(self.current, self._offset)
+        for event in events:
+            self._add(event)
+
+    # Writing
+    def append(self, event, durable=False):
+        """Append an event (durable: fsync before returning)"""
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock, data_store.store_lock(self.current):
+            try:
+                size = os.path.getsize(self.current)
+            except FileNotFoundError:
+                size = 0
+            if size and size + len(line) > self.max_bytes:
+                rotated = self.files()[:-1]
+                number = int(os.path.basename(rotated[-1])[:-4]) + 1 if rotated else 1
+                os.replace(self.current, os.path.join(self.directory, f"{number:08d}.log"))
+            with open(self.current, 'ab') as file:
+                file.write(line)
+                if durable:
+                    file.flush()
+                    os.fsync(file.fileno())
+            self._sync()
+
+    # Reading
+    def recent(self, username=None, limit=5) -> list:
+        """The last limit events (of one user, if given), oldest first"""
+        with self._lock, data_store.store_lock(self.current):
+            self._sync()
+            if username is None:
+                first = max(0, self._count - min(limit, self.capacity))
+                events = [self._slots[n % self.capacity] for n in range(first, self._count)]
+            else:
+                positions = self._by_user.get(username, ())
+                events = [self._slots[n % self.capacity]
+                          for n in reversed(list(itertools.islice(reversed(positions), limit)))]
+            ring_full = self._count >= self.capacity
+            older = ring_full and (username is None or (
+                username not in self._covered and (username in self._evicted or not self._complete)))
+        if len(events) < limit and older:
+            if username is None:
+                return self.tail(limit)
+            # Older than the ring: the user's own lines, through the index
+            found = self._user_events(username, limit)
+            if len(found) <= len(events):
+                with self._lock:
+                    if username not in self._evicted:
+                        self._covered.add(username)
+            return found
+        return events
+
+    def _user_events(self, username, limit):
+        """A user's last limit events from the files' per-user offset index
+        (the app's process-wide one, unless the log is somewhere else)"""
+        import audit_query  # it builds on this module
+        if self._index is None:
+            shared = os.path.abspath(self.directory) == os.path.abspath(os.path.join(LOG_DIR, self.name))
+            self._index = audit_query.open_index(self.name) if shared else audit_query.AuditIndex(self.directory)
+        return list(self._index.query(username=username, limit=limit))
+
+    def _read_backwards(self):
+        for path in reversed(self.files()):
+            for line in data_store.reverse_lines(path):
+                event = _parse(line)
+                if event is not None:
+                    yield event
+
+    def tail(self, limit, username=None) -> list:
+        """The last limit events (of one user, if given) read from the
+        files, newest blocks first; oldest first"""
+        events = (event for event in self._read_backwards()
+                  if username is None or event.get('username') == username)
+        return list(itertools.islice(events, limit))[::-1]
+
+
+def migrate_store(name) -> int:
+    """Move the events an app's JSON store kept in its security_log section
+    into the app's log; returns how many moved (0 once they have)"""
+    path = data_store.STORE_LAYOUTS.get(name, {}).get('file')
+    if path is None or not os.path.exists(path):
+        return 0
+    data = data_store.load_partial(path, [('security_log',)])
+    if data is None:
+        data = data_store.load_store(path, None)
+    events = data.get('security_log')
+    if events is None:
+        return 0
+    directory = os.path.join(LOG_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, MIGRATED_FILE)
+    moved = 0
+    with data_store.store_lock(os.path.join(directory, CURRENT_FILE)):
+        # Already there if a process stopped before dropping the section
+        if events and not os.path.exists(target):
+            with open(target + '.tmp', 'wb') as file:
+                file.writelines((json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+                                for event in events)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(target + '.tmp', target)
+            moved = len(events)
+        data_store.take_record(path, data, ['security_log'])
+    return moved
+
+
+def open_log(name) -> SecurityLog:
+    """Process-wide security log of an app, with its store's old events
+    moved in first"""
+    with _logs_lock:
+        if name not in _logs:
+            migrate_store(name)
+            _logs[name] = SecurityLog(name)
+        return _logs[name]
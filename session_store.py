@@ -0,0 +1,269 @@
+# MindfulBuddy - Login session store
+"""Login sessions kept apart from the app's user document.
+
+Each app's sessions live in their own journaled store, <app>_sessions.json
+(see data_store), so a login or logout never rewrites user data:
+
+    {"sessions": {token: {"username": ..., "created": ..., "expires": epoch}}}
+
+Every session records its expiry time as epoch seconds, so validating a
+token is a dict lookup and a comparison instead of parsing dates. Each
+process keeps a min-heap of (expires, token). A background sweeper pops
+the expired ones every SWEEP_INTERVAL seconds and deletes them in one
+group commit. Heap entries for sessions removed meanwhile are skipped
+when popped.
+
+With MINDFUL_SESSION_MODE=signed no session table is written at all:
+start() issues a token carrying the username, issue time, expiry and a
+random id, signed with HMAC-SHA256 under a server key, and any worker
+holding the key verifies it on its own. Logout adds the token's id to a
+small revocation list (<app>_revoked.json) until the token would have
+expired anyway. The key comes from MINDFUL_SESSION_KEY, or is generated
+once into MINDFUL_SESSION_KEY_FILE (default session.key) and shared by
+every worker using that directory.
+"""
+import base64
+import hashlib
+import heapq
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+
+import data_store
+
+# How long a login stays valid
+SESSION_TTL = float(os.environ.get('MINDFUL_SESSION_TTL_HOURS', '24')) * 3600
+
+# Seconds between expiry sweeps
+SWEEP_INTERVAL = float(os.environ.get('MINDFUL_SESSION_SWEEP_SECONDS', '60'))
+
+# 'store' (a session table) or 'signed' (stateless signed tokens)
+SESSION_MODE = os.environ.get('MINDFUL_SESSION_MODE', 'store')
+
+KEY_FILE = os.environ.get('MINDFUL_SESSION_KEY_FILE', 'session.key')
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def sessions_path(name):
+    return f"{name}_sessions.json"
+
+
+def _default():
+    return {'sessions': {}}
+
+
+def _revoked_default():
+    return {'revoked': {}}
+
+
+def server_key(key_file=None, variable='MINDFUL_SESSION_KEY') -> bytes:
+    """The signing key: the environment variable, or the shared key file
+    (created with a random key by the first worker to need it)"""
+    key = os.environ.get(variable)
+    if key:
+        return key.encode('utf-8')
+    key_file = key_file or KEY_FILE
+    try:
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(key_file, 'rb') as file:
+            key = file.read()
+        if key:
+            return key
+        time.sleep(0.05)  # another worker is still writing it
+        with open(key_file, 'rb') as file:
+            return file.read()
+    key = secrets.token_hex(32).encode('ascii')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(key)
+    return key
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign_token(key, username, ttl, now=None) -> str:
+    """A token carrying username, issue time, expiry and a random id"""
+    now = int(time.time() if now is None else now)
+    payload = {'u': username, 'iat': now, 'exp': now + int(ttl), 'jti': secrets.token_urlsafe(12)}
+    body = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    signature = hmac.new(key, body.encode('ascii'), hashlib.sha256).digest()
+    return f"{body}.{_b64encode(signature)}"
+
+
+def verify_token(key, token, now=None):
+    """The payload of a correctly signed, unexpired token, or None"""
+    body, _, signature = token.partition('.')
+    expected = hmac.new(key, body.encode('ascii', 'replace'), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(_b64decode(signature), expected):
+            return None
+        payload = json.loads(_b64decode(body))
+    except ValueError:
+        return None
+    if payload.get('exp', 0) <= (time.time() if now is None else now):
+        return None
+    return payload
+
+
+class SessionStore:
+    """Sessions of one app with an expiry-ordered index"""
+
+    def __init__(self, name, ttl=SESSION_TTL, path=None, mode=None):
+        self.name = name
+        self.ttl = ttl
+        self.path = path or sessions_path(name)
+        self.mode = mode or SESSION_MODE
+        self.revoked_path = f"{name}_revoked.json"
+        self._key = server_key() if self.mode == 'signed' else None
+        self._heap = []
+        # token -> the expiry its live heap entry was pushed with
+        self._indexed = {}
+        self._lock = threading.Lock()
+
+    def _sessions(self):
+        return data_store.load_store(self.path, _default).get('sessions', {})
+
+    def _index(self, token, expires):
+        """Push a heap entry (lock held); older entries for token go stale"""
+        heapq.heappush(self._heap, (expires, token))
+        self._indexed[token] = expires
+
+    def start(self, username, **fields) -> str:
+        """Start a session for username and return its token (fields are
+        only kept in store mode)"""
+        if self.mode == 'signed':
+            return sign_token(self._key, username, self.ttl)
+        token = secrets.token_urlsafe(32)
+        self.create(token, username, **fields)
+        return token
+
+    def create(self, token, username, **fields):
+        """Record a session for username under token; returns the session"""
+        now = time.time()
+        session = {
+            'username': username,
+            'created': datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+            'expires': now + self.ttl,
+            **fields,
+        }
+        data = data_store.load_store(self.path, _default)
+        data_store.set_record(self.path, data, ['sessions', token], session)
+        with self._lock:
+            self._index(token, session['expires'])
+        return session
+
+    def validate(self, token, username=None):
+        """The session for token if it exists, has not expired and (if
+        given) belongs to username; None otherwise"""
+        if self.mode == 'signed':
+            return self._validate_signed(token, username)
+        session = self._sessions().get(token)
+        if session is None or session.get('expires', 0) <= time.time():
+            return None
+        if username is not None and session['username'] != username:
+            return None
+        return session
+
+    def _validate_signed(self, token, username):
+        payload = verify_token(self._key, token)
+        if payload is None or (username is not None and payload['u'] != username):
+            return None
+        if payload['jti'] in data_store.load_store(self.revoked_path, _revoked_default).get('revoked', {}):
+            return None
+        return {'username': payload['u'], 'created': datetime.fromtimestamp(payload['iat']).strftime(
+            "%Y-%m-%d %H:%M:%S"), 'expires': payload['exp']}
+
+    def take(self, token):
+        """The session for token, ended as it is read so that only one
+        caller in any process gets it (single-use tokens); store mode only"""
+        session = self.validate(token)
+        if session is None:
+            return None
+        # Checked and deleted in one locked journal record
+        data = data_store.load_store(self.path, _default)
+        if not data_store.take_record(self.path, data, ['sessions', token]):
+            return None
+        return session
+
+    def delete(self, token):
+        """End a session (in signed mode: revoke the token until it expires)"""
+        if self.mode == 'signed':
+            payload = verify_token(self._key, token)
+            if payload is not None:
+                data = data_store.load_store(self.revoked_path, _revoked_default)
+                data_store.set_record(self.revoked_path, data, ['revoked', payload['jti']], payload['exp'])
+            return
+        data = data_store.load_store(self.path, _default)
+        if token in data.get('sessions', {}):
+            data_store.delete_record(self.path, data, ['sessions', token])
+
+    def sweep(self, now=None) -> int:
+        """Delete every expired session (or revocation of an expired token
+        in signed mode); returns how many were removed"""
+        now = time.time() if now is None else now
+        if self.mode == 'signed':
+            data = data_store.load_store(self.revoked_path, _revoked_default)
+            expired = [jti for jti, expires in data.get('revoked', {}).items() if expires <= now]
+            for jti in expired:
+                data_store.delete_record(self.revoked_path, data, ['revoked', jti])
+            return len(expired)
+        data = data_store.load_store(self.path, _default)
+        sessions = data.get('sessions', {})
+        with self._lock:
+            # Sessions other processes created since the last sweep
+            for token in sessions.keys() - self._indexed.keys():
+                self._index(token, sessions[token].get('expires', 0))
+            expired = []
+            while self._heap and self._heap[0][0] <= now:
+                expires, token = heapq.heappop(self._heap)
+                if self._indexed.get(token) != expires:
+                    continue
+                del self._indexed[token]
+                session = sessions.get(token)
+                if session is None:
+                    continue
+                if session.get('expires', 0) <= now:
+                    expired.append(token)
+                else:
+                    # Another process re-created it with a later expiry
+                    self._index(token, session['expires'])
+        # Queued together, so they reach the journal in one group commit
+        for token in expired:
+            data_store.delete_record(self.path, data, ['sessions', token])
+        return len(expired)
+
+    def __len__(self):
+        return len(self._sessions())
+
+
+def _sweep_forever(store, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            store.sweep()
+        except OSError:
+            pass  # e.g. the disk is full; try again next round
+
+
+def open_sessions(name, ttl=SESSION_TTL, mode=None):
+    """Process-wide session store of an app, with its sweeper running"""
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = SessionStore(name, ttl, mode=mode)
+            store.sweep()
+            threading.Thread(target=_sweep_forever, args=(store, SWEEP_INTERVAL),
+                             name=f"sessions:{name}", daemon=True).start()
+        return store
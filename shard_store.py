@@ -0,0 +1,221 @@
+# MindfulBuddy - Per-user sharded storage backend
+"""Sharded JSON backend for data_store.
+
+Instead of one file holding every user, each app gets a directory next to
+its old data file:
+
+    <store>/index.json              usernames, profiles and password hashes,
+                                    sessions and app-wide sections
+    <store>/users/ab/<hash>.json    one user's mood history and messages
+
+Shards are named by a hash of the username and bucketed into 256
+subdirectories by its first two hex digits. Index and shards are ordinary
+journaled stores (data_store.load_store), so they share the locking,
+journaling and per-process caching. Login and session checks read only the
+index; a check-in or chat message appends to the user's shard only.
+
+Migrate existing single-file stores with
+
+    python shard_store.py migrate [store ...]
+
+or set MINDFUL_BACKEND=sharded and each store is migrated when an app
+first opens it.
+"""
+import argparse
+import copy
+import hashlib
+import os
+import sys
+
+import data_store
+
+INDEX_FILE = 'index.json'
+USERS_DIR = 'users'
+
+
+def store_dir(name):
+    """Directory of an app's sharded store, named after its single file"""
+    return os.path.splitext(data_store.STORE_LAYOUTS[name]['file'])[0]
+
+
+def shard_path(directory, username):
+    digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+    return os.path.join(directory, USERS_DIR, digest[:2], digest + '.json')
+
+
+def is_migrated(name) -> bool:
+    return os.path.exists(os.path.join(store_dir(name), INDEX_FILE))
+
+
+def migrate(name, default=None) -> int:
+    """Split an app's single-file store into index and shards.
+
+    The index is written last, so an interrupted migration simply runs
+    again. Returns the number of users migrated.
+    """
+    path = data_store.STORE_LAYOUTS[name]['file']
+    if os.path.exists(path):
+        source = data_store.JsonStore(name)
+    else:
+        initial = default() if callable(default) else copy.deepcopy(default or {})
+        source = data_store.JsonStore(name, data=initial)
+    directory = store_dir(name)
+    os.makedirs(directory, exist_ok=True)
+
+    index = {
+        'users': {},
+        'sessions': dict(source.data.get('sessions', {})),
+    }
+    for section, value in source.data.items():
+        if isinstance(value, dict) and section not in (source.users_key, 'sessions', 'conversations'):
+            index[section] = value
+
+    users = source.list_users()
+    for username in users:
+        index['users'][username] = source.get_user(username)
+        shard = {
+            'mood_history': source.mood_history(username),
+            'messages': {channel: source.messages(username, channel) for channel in source.channels},
+        }
+        user_path = shard_path(directory, username)
+        os.makedirs(os.path.dirname(user_path), exist_ok=True)
+        data_store.write_snapshot(user_path, shard)
+
+    data_store.write_snapshot(os.path.join(directory, INDEX_FILE), index)
+    return len(users)
+
+
+class ShardStore:
+    """Typed queries over an index file plus one journaled shard per user"""
+
+    def __init__(self, name, directory=None):
+        self.name = name
+        self.directory = directory or store_dir(name)
+        self.index_path = os.path.join(self.directory, INDEX_FILE)
+        self.index = data_store.load_store(self.index_path, None)
+
+    def _shard(self, username, create=False):
+        path = shard_path(self.directory, username)
+        if create:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path, data_store.load_store(path, None)
+
+    # Users (index only)
+    def list_users(self) -> list:
+        return list(self.index.get('users', {}))
+
+    def user_exists(self, username) -> bool:
+        return username in self.index.get('users', {})
+
+    def get_user(self, username):
+        """Profile fields of a user (histories are read separately), or None"""
+        user = self.index.get('users', {}).get(username)
+        return dict(user) if user is not None else None
+
+    def create_user(self, username, profile) -> bool:
+        """Add a user; returns False if the username is taken"""
+        profile = dict(profile)
+        profile.pop('mood_history', None)
+        return data_store.insert_record(self.index_path, self.index, ['users', username], profile)
+
+    def update_user(self, username, **fields):
+        data_store.update_record(self.index_path, self.index, ['users', username], fields)
+
+    def delete_user(self, username):
+        if self.user_exists(username):
+            data_store.delete_record(self.index_path, self.index, ['users', username])
+        data_store.remove_store(shard_path(self.directory, username))
+
+    # Mood entries
+    def add_mood_entry(self, username, entry):
+        path, shard = self._shard(username, create=True)
+        data_store.append_record(path, shard, ['mood_history'], entry)
+
+    def mood_history(self, username, start=None, end=None) -> list:
+        """Mood entries in check-in order, optionally limited to a date range"""
+        entries = self._shard(username)[1].get('mood_history', [])
+        if start is not None:
+            entries = [entry for entry in entries if entry['date'] >= start]
+        if end is not None:
+            entries = [entry for entry in entries if entry['date'] < end]
+        return list(entries)
+
+    def mood_count(self, username) -> int:
+        return len(self._shard(username)[1].get('mood_history', []))
+
+    def latest_mood(self, username):
+        entries = self._shard(username)[1].get('mood_history', [])
+        return entries[-1] if entries else None
+
+    # Conversations
+    def messages(self, username, channel='chat', limit=None) -> list:
+        messages = self._shard(username)[1].get('messages', {}).get(channel, [])
+        return messages[-limit:] if limit else list(messages)
+
+    def message_count(self, username, channel='chat') -> int:
+        return len(self._shard(username)[1].get('messages', {}).get(channel, []))
+
+    def add_messages(self, username, messages, channel='chat'):
+        path, shard = self._shard(username, create=True)
+        data_store.extend_record(path, shard, ['messages', channel], messages)
+
+    def add_message_batches(self, batches, channel='chat'):
+        """add_messages for several users: one record per user's shard,
+        all queued for the same group commit"""
+        for username, messages in batches.items():
+            self.add_messages(username, messages, channel)
+
+    def clear_messages(self, username, channel='chat'):
+        path, shard = self._shard(username, create=True)
+        data_store.set_record(path, shard, ['messages', channel], [])
+
+    # Sessions (index)
+    def create_session(self, token, session):
+        data_store.set_record(self.index_path, self.index, ['sessions', token], session)
+
+    def get_session(self, token):
+        return self.index.get('sessions', {}).get(token)
+
+    def delete_session(self, token):
+        if token in self.index.get('sessions', {}):
+            data_store.delete_record(self.index_path, self.index, ['sessions', token])
+
+    # App-wide sections (index)
+    def get_section(self, section) -> dict:
+        return dict(self.index.get(section, {}))
+
+    def set_section(self, section, value):
+        data_store.set_record(self.index_path, self.index, [section], value)
+
+    def increment(self, section, key, amount=1):
+        data_store.increment_record(self.index_path, self.index, [section, key], amount)
+
+    def flush(self):
+        """Durability barrier: return once this process's writes are on disk"""
+        data_store.barrier()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded storage tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = commands.add_parser('migrate', help="split single-file stores into shards")
+    migrate_parser.add_argument('stores', nargs='*',
+                                help="stores to migrate (default: every store with a data file)")
+    args = parser.parse_args(argv)
+    unknown = set(args.stores) - set(data_store.STORE_LAYOUTS)
+    if unknown:
+        parser.error(f"unknown stores: {', '.join(sorted(unknown))}")
+
+    names = args.stores or [name for name, layout in data_store.STORE_LAYOUTS.items()
+                            if os.path.exists(layout['file'])]
+    for name in names:
+        if is_migrated(name):
+            print(f"{name}: already migrated to {store_dir(name)}/")
+            continue
+        count = migrate(name)
+        print(f"{name}: {count} users -> {store_dir(name)}/")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
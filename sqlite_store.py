@@ -0,0 +1,307 @@
+# MindfulBuddy - SQLite storage backend
+"""SQLite backend for data_store, shared by all the apps.
+
+Every app keeps its rows in one WAL-mode database, namespaced by an app
+column, so readers never block each other and a user's mood history is a
+ranged index lookup instead of a full JSON parse. SqliteStore implements the
+same query functions as data_store.JsonStore.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+DB_PATH = os.environ.get('MINDFUL_DB', 'mindful_buddy.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    app TEXT NOT NULL,
+    username TEXT NOT NULL,
+    password_hash TEXT,
+    created_date TEXT,
+    profile TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (app, username)
+);
+CREATE TABLE IF NOT EXISTS mood_entries (
+    id INTEGER PRIMARY KEY,
+    app TEXT NOT NULL,
+    username TEXT NOT NULL,
+    date TEXT NOT NULL,
+    mood INTEGER NOT NULL,
+    energy INTEGER,
+    stress INTEGER,
+    sleep INTEGER,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_mood_user_date ON mood_entries (app, username, date);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    app TEXT NOT NULL,
+    username TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    timestamp TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_user ON conversations (app, username, channel, id);
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    app TEXT NOT NULL,
+    username TEXT NOT NULL,
+    created TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_user ON sessions (app, username);
+CREATE TABLE IF NOT EXISTS meta (
+    app TEXT NOT NULL,
+    section TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (app, section)
+);
+"""
+
+MOOD_COLUMNS = ('energy', 'stress', 'sleep')
+IMPORT_MARKER = '_imported'
+
+_local = threading.local()
+
+
+def connect(path=None):
+    """Per-thread connection (Streamlit runs each session on its own thread)"""
+    path = path or DB_PATH
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    if path not in connections:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        connections[path] = conn
+    return connections[path]
+
+
+class transaction:
+    """BEGIN IMMEDIATE ... COMMIT on a connection, rolled back on error.
+
+    Nested uses join the outer transaction.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.outer = False
+
+    def __enter__(self):
+        self.outer = not self.conn.in_transaction
+        if self.outer:
+            self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.outer:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _mood_row_to_entry(row):
+    entry = {'date': row['date'], 'mood': row['mood']}
+    for column in MOOD_COLUMNS:
+        if row[column] is not None:
+            entry[column] = row[column]
+    entry.update(json.loads(row['extra']))
+    return entry
+
+
+class SqliteStore:
+    """Typed queries for one app's rows in the shared database"""
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.conn = connect(path)
+
+    def needs_import(self) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM meta WHERE app = ? AND section = ?", (self.name, IMPORT_MARKER)
+        ).fetchone()
+        return row is None
+
+    def mark_imported(self, source):
+        self.set_section(IMPORT_MARKER, {'source': source})
+
+    # Users
+    def list_users(self) -> list:
+        rows = self.conn.execute(
+            "SELECT username FROM users WHERE app = ? ORDER BY rowid", (self.name,)
+        )
+        return [row['username'] for row in rows]
+
+    def user_exists(self, username) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM users WHERE app = ? AND username = ?", (self.name, username)
+        ).fetchone()
+        return row is not None
+
+    def get_user(self, username):
+        """Profile fields of a user (histories are read separately), or None"""
+        row = self.conn.execute(
+            "SELECT password_hash, created_date, profile FROM users WHERE app = ? AND username = ?",
+            (self.name, username)
+        ).fetchone()
+        if row is None:
+            return None
+        user = json.loads(row['profile'])
+        if row['password_hash'] is not None:
+            user['password_hash'] = row['password_hash']
+        if row['created_date'] is not None:
+            user['created_date'] = row['created_date']
+        return user
+
+    def create_user(self, username, profile) -> bool:
+        """Add a user; returns False if the username is taken"""
+        profile = dict(profile)
+        profile.pop('mood_history', None)
+        password_hash = profile.pop('password_hash', None)
+        created_date = profile.pop('created_date', None)
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO users (app, username, password_hash, created_date, profile) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self.name, username, password_hash, created_date, json.dumps(profile))
+        )
+        return cursor.rowcount == 1
+
+    def update_user(self, username, **fields):
+        with transaction(self.conn):
+            user = self.get_user(username)
+            if user is None:
+                return
+            user.update(fields)
+            password_hash = user.pop('password_hash', None)
+            created_date = user.pop('created_date', None)
+            self.conn.execute(
+                "UPDATE users SET password_hash = ?, created_date = ?, profile = ? "
+                "WHERE app = ? AND username = ?",
+                (password_hash, created_date, json.dumps(user), self.name, username)
+            )
+
+    def delete_user(self, username):
+        with transaction(self.conn):
+            for table in ('users', 'mood_entries', 'conversations', 'sessions'):
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE app = ? AND username = ?", (self.name, username)
+                )
+
+    # Mood entries
+    def add_mood_entry(self, username, entry):
+        extra = {key: value for key, value in entry.items()
+                 if key not in ('date', 'mood') + MOOD_COLUMNS}
+        self.conn.execute(
+            "INSERT INTO mood_entries (app, username, date, mood, energy, stress, sleep, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.name, username, entry['date'], entry['mood'],
+             entry.get('energy'), entry.get('stress'), entry.get('sleep'), json.dumps(extra))
+        )
+
+    def mood_history(self, username, start=None, end=None) -> list:
+        """Mood entries in check-in order, optionally limited to a date range"""
+        query = "SELECT * FROM mood_entries WHERE app = ? AND username = ?"
+        params = [self.name, username]
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND date < ?"
+            params.append(end)
+        query += " ORDER BY id"
+        return [_mood_row_to_entry(row) for row in self.conn.execute(query, params)]
+
+    def mood_count(self, username) -> int:
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM mood_entries WHERE app = ? AND username = ?", (self.name, username)
+        ).fetchone()
+        return row[0]
+
+    def latest_mood(self, username):
+        row = self.conn.execute(
+            "SELECT * FROM mood_entries WHERE app = ? AND username = ? ORDER BY id DESC LIMIT 1",
+            (self.name, username)
+        ).fetchone()
+        return _mood_row_to_entry(row) if row else None
+
+    # Conversations
+    def messages(self, username, channel='chat', limit=None) -> list:
+        if limit:
+            rows = self.conn.execute(
+                "SELECT body FROM (SELECT id, body FROM conversations "
+                "WHERE app = ? AND username = ? AND channel = ? ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (self.name, username, channel, limit)
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT body FROM conversations WHERE app = ? AND username = ? AND channel = ? ORDER BY id",
+                (self.name, username, channel)
+            )
+        return [json.loads(row['body']) for row in rows]
+
+    def message_count(self, username, channel='chat') -> int:
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM conversations WHERE app = ? AND username = ? AND channel = ?",
+            (self.name, username, channel)
+        ).fetchone()
+        return row[0]
+
+    def add_messages(self, username, messages, channel='chat'):
+        self.add_message_batches({username: messages}, channel)
+
+    def add_message_batches(self, batches, channel='chat'):
+        """add_messages for several users in one transaction"""
+        with transaction(self.conn):
+            self.conn.executemany(
+                "INSERT INTO conversations (app, username, channel, timestamp, body) VALUES (?, ?, ?, ?, ?)",
+                [(self.name, username, channel, message.get('timestamp'), json.dumps(message))
+                 for username, messages in batches.items() for message in messages]
+            )
+
+    def clear_messages(self, username, channel='chat'):
+        self.conn.execute(
+            "DELETE FROM conversations WHERE app = ? AND username = ? AND channel = ?",
+            (self.name, username, channel)
+        )
+
+    # Sessions
+    def create_session(self, token, session):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sessions (token, app, username, created, body) VALUES (?, ?, ?, ?, ?)",
+            (token, self.name, session['username'], session.get('created'), json.dumps(session))
+        )
+
+    def get_session(self, token):
+        row = self.conn.execute(
+            "SELECT body FROM sessions WHERE token = ? AND app = ?", (token, self.name)
+        ).fetchone()
+        return json.loads(row['body']) if row else None
+
+    def delete_session(self, token):
+        self.conn.execute("DELETE FROM sessions WHERE token = ? AND app = ?", (token, self.name))
+
+    # App-wide sections (platform stats, metadata, settings)
+    def get_section(self, section) -> dict:
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE app = ? AND section = ?", (self.name, section)
+        ).fetchone()
+        return json.loads(row['value']) if row else {}
+
+    def set_section(self, section, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (app, section, value) VALUES (?, ?, ?)",
+            (self.name, section, json.dumps(value))
+        )
+
+    def increment(self, section, key, amount=1):
+        with transaction(self.conn):
+            value = self.get_section(section)
+            value[key] = value.get(key, 0) + amount
+            self.set_section(section, value)
+
+    def flush(self):
+        """Durability barrier: with synchronous=NORMAL, commits are only
+        fsynced at a checkpoint, so run one"""
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
@@ -0,0 +1,617 @@
+# MindfulBuddy - Single sign-on service
+"""One login for every app.
+
+The identity service owns the credentials (sso_identity.json) and login
+sessions (sso_sessions.json, see session_store) for all apps. It runs as a
+small local server:
+
+    python sso_service.py serve                  # Unix socket mindful_sso.sock
+    MINDFUL_SSO_ADDRESS=127.0.0.1:8765 python sso_service.py serve   # TCP instead
+
+Requests and replies are JSON lines ({"op": "validate", "token": ...}),
+many per connection. The Unix socket is readable by its owner only; a TCP
+client must first answer a challenge with an HMAC under the service key
+(MINDFUL_SSO_KEY, or the key file sso.key shared with the apps). Failed
+logins are paced per username with login_limiter. The server keeps
+sessions it has seen in memory and
+remembers an HMAC of each user's last good password, so validating a
+token is a dict lookup and a repeat login skips PBKDF2. Each app process
+keeps a small pool of open connections to it.
+
+Apps call client(), a pooled client of the service. While nothing
+listens at the service address it runs requests on an in-process
+IdentityService over the same files instead (without the in-memory
+session cache, since other processes may change them), and tries the
+service again every RECONNECT_SECONDS. A request that fails on the
+server comes back as an error reply; one whose connection breaks is
+sent again only if running it twice changes nothing.
+
+Every identity has a permanent id, and an app's record of a user holds
+the id it belongs to (sso_id). restore() turns a token back into a
+username on each run and creates the app's own record for a user it
+hasn't seen, but never attaches to a record linked to another identity
+or to none. A record from before the service is linked (or, if the
+service doesn't know the username, moved over with a new hash) on a
+login whose password matches the app's own hash; if the service knows
+the username as someone else, that account signs in to its own app only.
+
+The token stays in the app's session state. To carry the login to
+another app the page URL holds a one-time code (?sso=<code>) that expires
+after CODE_TTL seconds; the app that opens it swaps it for the token and
+puts a fresh code in its own URL.
+
+    python sso_service.py benchmark
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import data_store
+import login_limiter
+import password_hashing
+import session_store
+import storage_benchmark
+
+SERVICE_NAME = 'sso'
+SOCKET_PATH = os.environ.get('MINDFUL_SSO_SOCKET', 'mindful_sso.sock')
+# host:port to use TCP (e.g. where Unix sockets aren't available)
+ADDRESS = os.environ.get('MINDFUL_SSO_ADDRESS')
+POOL_SIZE = int(os.environ.get('MINDFUL_SSO_POOL', '4'))
+TIMEOUT = float(os.environ.get('MINDFUL_SSO_TIMEOUT_SECONDS', '5'))
+KEY_FILE = os.environ.get('MINDFUL_SSO_KEY_FILE', 'sso.key')
+# How long a one-time code in a page URL stays usable
+CODE_TTL = float(os.environ.get('MINDFUL_SSO_CODE_SECONDS', '300'))
+# How long a client runs requests in-process before trying a stopped service again
+RECONNECT_SECONDS = float(os.environ.get('MINDFUL_SSO_RECONNECT_SECONDS', '30'))
+
+# What clients may ask; moving an app's users over is done in-process only
+OPS = {'ping', 'has_user', 'register', 'login', 'validate', 'logout', 'issue_code', 'redeem'}
+# Requests safe to send again after a broken connection: running them twice changes nothing
+IDEMPOTENT = {'ping', 'has_user', 'validate', 'logout'}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _default():
+    return {'users': {}}
+
+
+def service_address():
+    """The service's Unix socket path, or (host, port) with MINDFUL_SSO_ADDRESS"""
+    if ADDRESS:
+        host, _, port = ADDRESS.rpartition(':')
+        return host or '127.0.0.1', int(port)
+    return SOCKET_PATH
+
+
+def service_key() -> bytes:
+    """The key TCP clients prove they hold"""
+    return session_store.server_key(KEY_FILE, 'MINDFUL_SSO_KEY')
+
+
+def _proof(key, nonce) -> bytes:
+    return hmac.new(key, nonce.encode('utf-8'), hashlib.sha256).hexdigest().encode('ascii')
+
+
+class IdentityService:
+    """Credentials and sessions shared by every app"""
+
+    def __init__(self, name=SERVICE_NAME, cache=False):
+        self.path = f"{name}_identity.json"
+        self.sessions = session_store.open_sessions(name)
+        # Always a table: a code is deleted when it is used
+        self.codes = session_store.open_sessions(f"{name}_codes", CODE_TTL, mode='store')
+        self.limiter = login_limiter.shared()
+        self._key = secrets.token_bytes(32)
+        # username -> (stored hash, HMAC of the password that matched it)
+        self._verified = {}
+        # token -> ({'username', 'id'}, expires); only safe while this is the only writer
+        self._cached = {} if cache else None
+        self._lock = threading.Lock()
+
+    def _data(self):
+        return data_store.load_store(self.path, _default)
+
+    # The store interface password_hashing.check_password needs
+    def get_user(self, username):
+        return self._data().get('users', {}).get(username)
+
+    def update_user(self, username, **fields):
+        data = self._data()
+        for field, value in fields.items():
+            data_store.set_record(self.path, data, ['users', username, field], value)
+
+    def ping(self):
+        return True
+
+    def has_user(self, username) -> bool:
+        return self.get_user(username) is not None
+
+    def identity(self, username):
+        """The permanent id of a username's identity, or None"""
+        user = self.get_user(username)
+        if user is None:
+            return None
+        if 'id' not in user:
+            # Registered before identities had ids
+            data_store.insert_record(self.path, self._data(), ['users', username, 'id'], secrets.token_hex(8))
+            user = self.get_user(username)
+        return user['id']
+
+    def register(self, username, password) -> bool:
+        """Add a user; False if the username is taken"""
+        record = {
+            'id': secrets.token_hex(8),
+            'password_hash': password_hashing.hash_password(password),
+            'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if not data_store.insert_record(self.path, self._data(), ['users', username], record):
+            return False
+        self._remember(username, record['password_hash'], password)
+        return True
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode('utf-8'), hashlib.sha256).digest()
+
+    def _remember(self, username, stored, password):
+        with self._lock:
+            self._verified[username] = (stored, self._digest(password))
+
+    def _start(self, username):
+        token = self.sessions.start(username)
+        if self._cached is not None:
+            found = {'username': username, 'id': self.identity(username)}
+            self._cached[token] = (found, time.time() + self.sessions.ttl)
+        return token
+
+    def login(self, username, password) -> dict:
+        """{'token': ..., 'id': identity id}, or {'error': 'unknown' |
+        'invalid' | 'throttled'}"""
+        # Apart from the apps' own buckets for the same username
+        key = 'sso:' + login_limiter.user_key(username)
+        if self.limiter.retry_after(key) > 0:
+            return {'error': 'throttled'}
+        user = self.get_user(username)
+        if user is None:
+            self.limiter.record_failure(key)
+            return {'error': 'unknown'}
+        stored = user.get('password_hash')
+        remembered = self._verified.get(username)
+        if not (remembered and remembered[0] == stored and hmac.compare_digest(remembered[1], self._digest(password))):
+            if not password_hashing.check_password(self, username, password, user):
+                self.limiter.record_failure(key)
+                return {'error': 'invalid'}
+            self._remember(username, stored, password)
+        self.limiter.reset(key)
+        return {'token': self._start(username), 'id': self.identity(username)}
+
+    def validate(self, token):
+        """{'username': ..., 'id': identity id} for a live session token,
+        or None"""
+        if self._cached is not None:
+            cached = self._cached.get(token)
+            if cached is not None and cached[1] > time.time():
+                return cached[0]
+        session = self.sessions.validate(token)
+        if session is None:
+            return None
+        found = {'username': session['username'], 'id': self.identity(session['username'])}
+        if found['id'] is None:
+            return None
+        if self._cached is not None:
+            self._cached[token] = (found, session['expires'])
+        return found
+
+    def logout(self, token):
+        if self._cached is not None:
+            self._cached.pop(token, None)
+        self.sessions.delete(token)
+
+    def issue_code(self, token):
+        """A one-time code for a live session token, good for CODE_TTL
+        seconds; None if the token is not live"""
+        found = self.validate(token)
+        if found is None:
+            return None
+        return self.codes.start(found['username'], session=token)
+
+    def redeem(self, code):
+        """The session token a code was issued for, using the code up; None
+        if it is unknown, used or expired, or the session has ended"""
+        entry = self.codes.take(code)
+        if entry is None:
+            return None
+        return entry['session'] if self.validate(entry['session']) is not None else None
+
+    def call(self, request):
+        """Run one decoded request"""
+        request = dict(request)
+        op = request.pop('op', None)
+        if op not in OPS:
+            raise ValueError(f"unknown op {op!r}")
+        return getattr(self, op)(**request)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if self.server.key is not None and not self._authenticate():
+            return
+        for line in self.rfile:
+            try:
+                reply = {'result': self.server.service.call(json.loads(line))}
+            except (TypeError, ValueError) as error:
+                reply = {'error': str(error)}
+            except Exception as error:
+                # Fails this request only; the client must not think the connection died
+                self.server.handle_error(self.request, self.client_address)
+                reply = {'error': f"identity service failed: {error!r}", 'failed': True}
+            self._send(reply)
+
+    def _send(self, reply):
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def _authenticate(self) -> bool:
+        """Challenge the client to prove it holds the service key"""
+        nonce = secrets.token_hex(16)
+        self._send({'nonce': nonce})
+        try:
+            proof = str(json.loads(self.rfile.readline()).get('proof', ''))
+        except (ValueError, AttributeError):
+            proof = ''
+        passed = hmac.compare_digest(proof.encode('utf-8'), _proof(self.server.key, nonce))
+        self._send({'result': True} if passed else {'error': 'not authenticated'})
+        return passed
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(address=None, service=None):
+    """A server for the identity service (not yet serving)"""
+    address = address or service_address()
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)  # left behind by a stopped server
+        umask = os.umask(0o177)  # owner-only from the moment it exists
+        try:
+            server = _UnixServer(address, _Handler)
+        finally:
+            os.umask(umask)
+        server.key = None
+    else:
+        server = _TCPServer(address, _Handler)
+        server.key = service_key()
+    server.service = service or IdentityService(cache=True)
+    return server
+
+
+class ServiceDown(ConnectionError):
+    """Nothing listens at the identity service's address"""
+
+
+def _alive(sock) -> bool:
+    """Whether an idle connection is still open and has nothing unread"""
+    sock.setblocking(False)
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+        return False  # closed by the server, or out of step
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(TIMEOUT)
+
+
+class ServiceClient:
+    """Pooled connections to a running identity service; with a fallback
+    (an IdentityService factory) requests run in-process while it is down"""
+
+    def __init__(self, address, pool_size=POOL_SIZE, key=None, fallback=None):
+        self.address = address
+        self.pool_size = pool_size
+        self.key = key
+        self.fallback = fallback
+        self._local = None
+        self._down_until = 0.0
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        try:
+            if isinstance(self.address, str):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(TIMEOUT)
+                try:
+                    sock.connect(self.address)
+                except OSError:
+                    sock.close()
+                    raise
+                return sock, sock.makefile('rb')
+            sock = socket.create_connection(self.address, timeout=TIMEOUT)
+        except (FileNotFoundError, ConnectionRefusedError) as error:
+            raise ServiceDown(f"identity service is not running: {error}") from error
+        reader = sock.makefile('rb')
+        try:
+            nonce = json.loads(reader.readline() or b'{}').get('nonce', '')
+            proof = _proof(self.key or service_key(), nonce).decode('ascii')
+            sock.sendall(json.dumps({'proof': proof}).encode('utf-8') + b'\n')
+            if 'result' not in json.loads(reader.readline() or b'{}'):
+                raise PermissionError("identity service refused the key")
+        except (OSError, ValueError) as error:
+            reader.close()
+            sock.close()
+            raise ConnectionError(f"identity service handshake failed: {error}") from error
+        return sock, reader
+
+    def _pooled(self):
+        """An idle connection the server still holds open, or None"""
+        while True:
+            try:
+                sock, reader = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if _alive(sock):
+                return sock, reader
+            reader.close()
+            sock.close()
+
+    def _run_locally(self, op, args):
+        if self._local is None:
+            self._local = self.fallback()
+        return self._local.call({'op': op, **args})
+
+    def call(self, op, **args):
+        if self.fallback is not None and time.monotonic() < self._down_until:
+            return self._run_locally(op, args)
+        request = json.dumps({'op': op, **args}).encode('utf-8') + b'\n'
+        for attempt in range(2):
+            connection = self._pooled()
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except ServiceDown:
+                    if self.fallback is None:
+                        raise
+                    self._down_until = time.monotonic() + RECONNECT_SECONDS
+                    return self._run_locally(op, args)
+            sock, reader = connection
+            try:
+                sock.sendall(request)
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("identity service closed the connection")
+            except OSError:
+                reader.close()
+                sock.close()
+                # The server may have run it already
+                if attempt or op not in IDEMPOTENT:
+                    raise
+                continue
+            if self._idle.qsize() < self.pool_size:
+                self._idle.put(connection)
+            else:
+                reader.close()
+                sock.close()
+            reply = json.loads(line)
+            if 'error' in reply:
+                raise (RuntimeError if reply.get('failed') else ValueError)(reply['error'])
+            return reply['result']
+
+    def has_user(self, username) -> bool:
+        return self.call('has_user', username=username)
+
+    def register(self, username, password) -> bool:
+        return self.call('register', username=username, password=password)
+
+    def login(self, username, password) -> dict:
+        return self.call('login', username=username, password=password)
+
+    def validate(self, token):
+        return self.call('validate', token=token)
+
+    def logout(self, token):
+        return self.call('logout', token=token)
+
+    def issue_code(self, token):
+        return self.call('issue_code', token=token)
+
+    def redeem(self, code):
+        return self.call('redeem', code=code)
+
+
+def client():
+    """The process-wide identity client: the running service, or an
+    in-process IdentityService while the service isn't running"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ServiceClient(service_address(), fallback=IdentityService)
+        return _client
+
+
+def _owns(store, username, password, user) -> bool:
+    """Whether password opens the app's own (pre-service) account"""
+    return bool(user and user.get('password_hash')
+                and password_hashing.check_password(store, username, password, user))
+
+
+def sign_in(store, username, password, new_user=None):
+    """Sign in for an app; returns {'token': session token}, or None.
+
+    The app's record must be the identity's: one linked to it, or one
+    from before the service whose own hash the password matches (it is
+    linked then, and moved over if the service doesn't know the
+    username). Such an account whose username the service knows as
+    someone else signs in to this app only, {'token': None}. new_user()
+    is the app's own record for a signed-in user the app hasn't seen yet."""
+    identity = client()
+    result = identity.login(username, password)
+    user = store.get_user(username)
+    if 'token' not in result:
+        if result['error'] == 'throttled' or (user or {}).get('sso_id') \
+                or not _owns(store, username, password, user):
+            return None
+        if result['error'] == 'unknown' and identity.register(username, password):
+            result = identity.login(username, password)
+        if 'token' not in result:
+            return {'token': None}
+        store.update_user(username, sso_id=result['id'])
+        return {'token': result['token']}
+    if user is None:
+        if new_user is None or store.create_user(username, {**new_user(), 'sso_id': result['id']}):
+            return {'token': result['token']}
+    elif user.get('sso_id') == result['id']:
+        return {'token': result['token']}
+    elif not user.get('sso_id') and _owns(store, username, password, user):
+        store.update_user(username, sso_id=result['id'])
+        return {'token': result['token']}
+    # The app's username belongs to someone else
+    identity.logout(result['token'])
+    return None
+
+
+def sign_up(store, username, password, record):
+    """Create an identity for every app plus this app's record linked to
+    it; returns a session token, or None if the username is taken in the
+    service or in this app"""
+    identity = client()
+    if store.user_exists(username) or not identity.register(username, password):
+        return None
+    result = identity.login(username, password)  # remembered, so no second hash
+    if 'token' not in result or not store.create_user(username, {**record, 'sso_id': result['id']}):
+        return None
+    return result['token']
+
+
+def restore(store, token, new_user=None):
+    """The signed-in username for a session token, or None; an app record
+    of the username not linked to the token's identity is never used"""
+    if not token:
+        return None
+    found = client().validate(token)
+    if found is None:
+        return None
+    user = store.get_user(found['username'])
+    if user is None:
+        if new_user is not None and not store.create_user(found['username'], {**new_user(), 'sso_id': found['id']}):
+            return None
+        return found['username']
+    return found['username'] if user.get('sso_id') == found['id'] else None
+
+
+def keep(state, params, token):
+    """Keep a session token in the app's session state (st.session_state)
+    and a fresh one-time code for it in the page URL (st.query_params)"""
+    state['sso_token'] = token
+    state['sso_code'] = client().issue_code(token) if token else None
+    if state['sso_code']:
+        params['sso'] = state['sso_code']
+    else:
+        params.pop('sso', None)
+
+
+def resume(store, state, params, new_user=None):
+    """The signed-in username for a page run, or None: a code in the URL
+    this session didn't issue (another app's, or a reload's) is swapped
+    for its token first"""
+    code = params.get('sso')
+    if code and code != state.get('sso_code'):
+        token = client().redeem(code)
+        if token:
+            keep(state, params, token)
+        else:
+            params.pop('sso', None)
+    return restore(store, state.get('sso_token'), new_user)
+
+
+def sign_out(state, params):
+    """End the identity session kept in the app's session state"""
+    if state.get('sso_token'):
+        client().logout(state['sso_token'])
+    keep(state, params, None)
+
+
+def benchmark(rounds, users):
+    """Switching apps: a token lookup in the service against the old
+    per-app parse of the user file plus a password hash"""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            service = IdentityService(cache=True)
+            service.register('alice', password='correct horse')
+            server = make_server(os.path.join(workdir, 'sso.sock'), service)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            remote = ServiceClient(server.server_address)
+            token = remote.login('alice', 'correct horse')['token']
+
+            def timed(name, run, count):
+                started = time.perf_counter()
+                for _ in range(count):
+                    run()
+                results[name] = (time.perf_counter() - started) / count * 1e6
+
+            timed('validate_us', lambda: remote.validate(token), rounds)
+            timed('repeat_login_us', lambda: remote.login('alice', 'correct horse'), rounds)
+            stored = service.get_user('alice')['password_hash']
+            app_file = json.dumps(storage_benchmark.make_store_data('analytics', users))
+
+            def old_switch():
+                json.loads(app_file)
+                password_hashing.verify_password('correct horse', stored)
+            timed('parse_and_hash_us', old_switch, max(1, rounds // 200))
+            server.shutdown()
+            server.server_close()
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Single sign-on identity service")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('serve', help="run the identity service")
+    bench = commands.add_parser('benchmark', help="time session checks against a full login")
+    bench.add_argument('--rounds', type=int, default=2000)
+    bench.add_argument('--users', type=int, default=1000, help="users in the app file the old way parses")
+    args = parser.parse_args(argv)
+
+    if args.command == 'benchmark':
+        for name, value in benchmark(args.rounds, args.users).items():
+            print(f"{name:>18}: {value:10.1f}")
+        return 0
+
+    server = make_server()
+    print(f"Identity service listening on {server.server_address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        data_store.barrier()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,406 @@
+# MindfulBuddy - Storage benchmarks
+"""Benchmarks for the data store.
+
+save: the original save_analytics_data (json.dump of the whole store with
+indent=2) against data_store.write_snapshot after a single check-in, which
+re-encodes only the changed user, in the indented and compact formats.
+
+suite: every app's store (the load_*_data functions) built at each size
+of users x check-ins x conversation length, per backend. Measures p50/p99
+of a cold load (new process) and a rerun (warm open) reading a user's
+profile and check-ins, a check-in as the request sees it and with a
+durability barrier, a login and a data export. The login is the secure
+app's: sso_service.sign_in against an identity service running in the
+scratch directory, the app's own session and one-time code, and a
+durable LOGIN_SUCCESS event in security_log. Each sampled user signs in
+once before timing (linking their pre-service record), so the timed
+logins are a returning user's. With --output the results are written as
+JSON to compare between versions.
+
+    python storage_benchmark.py save --users 1000 10000 100000
+    python storage_benchmark.py suite --users 1000 10000 --output bench.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import data_store
+import password_hashing
+import security_log
+import session_store
+import sqlite_store
+import sso_service
+
+ENTRIES_PER_USER = 10
+MESSAGES_PER_USER = 20
+SAMPLES = 50
+
+# Store name -> the app function that opens it
+SUITE_STORES = {
+    'conversation': 'load_conversation_data',
+    'family': 'load_family_data',
+    'analytics': 'load_analytics_data',
+    'secure': 'load_secure_data',
+    'professional': 'load_professional_data',
+    'ultimate': 'load_data',
+    'ai': 'load_user_data',
+}
+
+
+def make_analytics_data(users, entries=ENTRIES_PER_USER):
+    """An analytics store with the given number of users and check-ins each"""
+    data = {
+        'users': {},
+        'sessions': {},
+        'analytics': {'total_reports_generated': 0, 'advanced_insights_enabled': True},
+        'app_metadata': {'version': '3.0.0', 'analytics_level': 'professional', 'ai_insights': True},
+    }
+    for n in range(users):
+        data['users'][f"user{n}"] = {
+            'password_hash': f"{n:064x}",
+            'created_date': "2025-08-01 10:00:00",
+            'account_type': 'analytics_professional',
+            'mood_history': [
+                {
+                    'date': f"2025-08-{day % 28 + 1:02d} 10:00",
+                    'mood': (n + day) % 10 + 1,
+                    'energy': (n + 2 * day) % 10 + 1,
+                    'stress': (n + 3 * day) % 10 + 1,
+                    'sleep': (n + 4 * day) % 10 + 1,
+                    'activities': ['Exercise', 'Work'],
+                    'platform': 'analytics_professional',
+                }
+                for day in range(entries)
+            ],
+        }
+    return data
+
+
+def save_analytics_data(data, path):
+    """The analytics app's original save: the whole store, indented"""
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=2)
+
+
+def _timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+def benchmark_save(users, repeats=5, entries=ENTRIES_PER_USER):
+    """Milliseconds per save after one check-in, old save against incremental"""
+    data = make_analytics_data(users, entries)
+    result = {'users': users}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'analytics_app_data.json')
+        result['save_analytics_data_ms'] = statistics.median(
+            _timed(save_analytics_data, data, path) for _ in range(repeats)
+        )
+        result['indented_bytes'] = os.path.getsize(path)
+
+        compact_setting = data_store.COMPACT_JSON
+        try:
+            for mode, compact in (('indented', False), ('compact', True)):
+                data_store.COMPACT_JSON = compact
+                result[f"{mode}_full_ms"] = _timed(data_store.write_snapshot, path, data)
+                times = []
+                for n in range(repeats):
+                    username = f"user{n * 7919 % users}"
+                    data['users'][username]['mood_history'].append({'date': "2025-09-01 09:00", 'mood': 6})
+                    times.append(_timed(data_store.write_snapshot, path, data, {('users', username)}))
+                result[f"{mode}_incremental_ms"] = statistics.median(times)
+            result['compact_bytes'] = os.path.getsize(path)
+        finally:
+            data_store.COMPACT_JSON = compact_setting
+    return result
+
+
+def _mood_entry(n, day):
+    return {
+        'date': f"2025-08-{day % 28 + 1:02d} {day % 24:02d}:00",
+        'mood': (n + day) % 10 + 1,
+        'energy': (n + 2 * day) % 10 + 1,
+        'stress': (n + 3 * day) % 10 + 1,
+        'sleep': (n + 4 * day) % 10 + 1,
+        'activities': ['Exercise', 'Work'],
+        'notes': "Benchmark check-in",
+    }
+
+
+def password_hash(n):
+    return hashlib.sha256(f"password{n}".encode()).hexdigest()
+
+
+def make_store_data(name, users, entries=ENTRIES_PER_USER, messages=MESSAGES_PER_USER):
+    """A store in the app's JSON layout: users with check-ins and messages,
+    one session each and a full security_log section of the old kind"""
+    layout = data_store.STORE_LAYOUTS[name]
+    users_key = layout.get('users_key', 'users')
+    data = {}
+    if users_key:
+        data = {users_key: {}, 'sessions': {}, 'security_log': []}
+    for n in range(users if users_key else 1):
+        username = f"user{n}"
+        record = {
+            'password_hash': password_hash(n),
+            'created_date': "2025-08-01 10:00:00",
+            'mood_history': [_mood_entry(n, day) for day in range(entries)],
+        }
+        if users_key:
+            data[users_key][username] = record
+            data['sessions'][f"token{n}"] = {'username': username, 'created': "2025-08-01 10:00:00"}
+        else:
+            data.update(record, name=username)
+        for template in layout.get('channels', {}).values():
+            keys = template.format(user=username).split('/')
+            node = data
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+            node[keys[-1]] = [
+                {'sender': 'user' if m % 2 == 0 else 'ai', 'message': f"Benchmark message {m}",
+                 'timestamp': "2025-08-01 10:00:00"}
+                for m in range(messages)
+            ]
+    if users_key:
+        data['security_log'] = [
+            {'timestamp': "2025-08-01 10:00:00", 'event': 'LOGIN_SUCCESS', 'username': f"user{n % users}",
+             'details': "Benchmark"}
+            for n in range(data_store.SECURITY_LOG_LIMIT)
+        ]
+    return data
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))]
+
+
+def _summary(times):
+    return {
+        'p50_ms': percentile(times, 50),
+        'p99_ms': percentile(times, 99),
+        'mean_ms': statistics.fmean(times),
+        'samples': len(times),
+    }
+
+
+def _open(name, username=None):
+    if name == 'secure':
+        return data_store.open_user_store(name, username)
+    return data_store.open_store(name)
+
+
+def _load(name, n, cold):
+    """Open the store (as a fresh process would, if cold) and read a user's dashboard data"""
+    if cold:
+        data_store._cache.clear()
+        data_store._fragments.clear()
+    username = f"user{n}"
+    store = _open(name, username)
+    return store.get_user(username), store.mood_history(username)
+
+
+def _sign_in(name, n):
+    username = f"user{n}"
+    store = _open(name, username)
+    signed_in = sso_service.sign_in(store, username, f"password{n}", dict)
+    assert signed_in and signed_in['token']
+    return store, username, signed_in['token']
+
+
+def _login(name, n):
+    """A login as the secure app does it"""
+    store, username, token = _sign_in(name, n)
+    session_store.open_sessions(name).start(username)
+    sso_service.keep({}, {}, token)
+    store.flush()
+    security_log.open_log(name).append({'timestamp': "2025-09-01 10:00:00", 'event': 'LOGIN_SUCCESS',
+                                        'username': username, 'details': "Benchmark login"}, durable=True)
+
+
+def _export(name, n):
+    username = f"user{n}"
+    store = _open(name, username)
+    export = {
+        'user': username,
+        'profile': store.get_user(username),
+        'mood_history': store.mood_history(username),
+    }
+    for channel in getattr(store, 'channels', None) or data_store.STORE_LAYOUTS[name].get('channels', {}):
+        export[channel] = store.messages(username, channel)
+    return json.dumps(export, indent=2)
+
+
+def _checkin(name, n, durable):
+    username = f"user{n}"
+    store = _open(name, username)
+    store.add_mood_entry(username, _mood_entry(n, 99))
+    if durable:
+        store.flush()
+
+
+def benchmark_store(name, backend, users, entries, messages, samples=SAMPLES):
+    """p50/p99 of each operation on one store; run inside a scratch directory"""
+    single_user = data_store.STORE_LAYOUTS[name].get('users_key', 'users') is None
+    data = make_store_data(name, users, entries, messages)
+    data_store.write_snapshot(data_store.STORE_LAYOUTS[name]['file'], data)
+    del data
+    _open(name)  # migrate or import for the sharded and sqlite backends
+    security_log.open_log(name)  # moves the old security_log section over
+    data_store.barrier()
+
+    def pick(sample):
+        return 0 if single_user else sample * 7919 % users
+
+    # A first sign-in links the app's record, hashing the password twice;
+    # the timed logins never hash (the service remembers a good password)
+    iterations = password_hashing.ITERATIONS
+    password_hashing.ITERATIONS = 1000
+    try:
+        for n in {pick(sample) for sample in range(samples)}:
+            _sign_in(name, n)
+    finally:
+        password_hashing.ITERATIONS = iterations
+    data_store.barrier()
+
+    operations = {
+        'load_cold': lambda n: _load(name, n, cold=True),
+        'load_warm': lambda n: _load(name, n, cold=False),
+        'checkin': lambda n: _checkin(name, n, durable=False),
+        'checkin_durable': lambda n: _checkin(name, n, durable=True),
+        'login': lambda n: _login(name, n),
+        'export': lambda n: _export(name, n),
+    }
+    results = []
+    for operation, function in operations.items():
+        times = [_timed(function, pick(sample)) for sample in range(samples)]
+        data_store.barrier()
+        results.append({
+            'store': name, 'loader': SUITE_STORES[name], 'backend': backend, 'operation': operation,
+            'users': 1 if single_user else users, 'entries': entries, 'messages': messages,
+            **_summary(times),
+        })
+    return results
+
+
+def run_suite(stores, backends, sizes, entries, messages, samples=SAMPLES):
+    """Run benchmark_store for every store, backend and user count in a temp directory"""
+    results = []
+    cwd = os.getcwd()
+    settings = data_store.BACKEND, data_store.COMPACT_THRESHOLD, sqlite_store.DB_PATH, sso_service.SOCKET_PATH
+    try:
+        for backend in backends:
+            for users in sizes:
+                with tempfile.TemporaryDirectory() as workdir:
+                    os.chdir(workdir)
+                    data_store.BACKEND = backend
+                    # No background compaction: it would outlive the chdir back
+                    data_store.COMPACT_THRESHOLD = sys.maxsize
+                    sqlite_store.DB_PATH = os.path.join(workdir, 'bench.db')
+                    sso_service.SOCKET_PATH = os.path.join(workdir, 'sso.sock')
+                    _reset_singletons()
+                    server = sso_service.make_server()
+                    threading.Thread(target=server.serve_forever, daemon=True).start()
+                    try:
+                        for name in stores:
+                            results.extend(benchmark_store(name, backend, users, entries, messages, samples))
+                            print_suite_results(results[-6:], header=not results[:-6])
+                    finally:
+                        server.shutdown()
+                        server.server_close()
+                        data_store.barrier()
+                    os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        data_store.BACKEND, data_store.COMPACT_THRESHOLD, sqlite_store.DB_PATH, sso_service.SOCKET_PATH = settings
+        _reset_singletons()
+    return results
+
+
+def _reset_singletons():
+    """Forget the stores, logs, sessions and identity client of the last scratch directory"""
+    data_store._cache.clear()
+    security_log._logs.clear()
+    session_store._stores.clear()
+    sso_service._client = None
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def write_results(path, benchmark, args, results):
+    """Results plus what they were measured on, as JSON"""
+    report = {
+        'benchmark': benchmark,
+        'revision': _git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('benchmark', 'output')},
+        'results': results,
+    }
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def print_suite_results(results, header=True):
+    if header:
+        print(f"{'store':>13} {'backend':>8} {'users':>7} {'operation':>16} {'p50':>10} {'p99':>10}")
+    for result in results:
+        print(f"{result['store']:>13} {result['backend']:>8} {result['users']:>7} {result['operation']:>16}"
+              f" {result['p50_ms']:>8.2f}ms {result['p99_ms']:>8.2f}ms")
+
+
+def print_save_results(results):
+    print(f"{'users':>8} {'old save':>10} {'full':>10} {'incr':>10} {'full cmp':>10} {'incr cmp':>10}"
+          f" {'size':>9} {'size cmp':>9}")
+    for result in results:
+        print(f"{result['users']:>8} {result['save_analytics_data_ms']:>8.1f}ms"
+              f" {result['indented_full_ms']:>8.1f}ms {result['indented_incremental_ms']:>8.1f}ms"
+              f" {result['compact_full_ms']:>8.1f}ms {result['compact_incremental_ms']:>8.1f}ms"
+              f" {result['indented_bytes'] / 1e6:>7.1f}MB {result['compact_bytes'] / 1e6:>7.1f}MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MindfulBuddy storage benchmarks")
+    parser.add_argument('benchmark', choices=['save', 'suite'])
+    parser.add_argument('--users', type=int, nargs='+',
+                        help='store sizes (default: 1000 10000 100000 for save, 1000 10000 for suite)')
+    parser.add_argument('--entries', type=int, default=ENTRIES_PER_USER, help='check-ins per user')
+    parser.add_argument('--messages', type=int, default=MESSAGES_PER_USER, help='conversation length per user')
+    parser.add_argument('--repeats', type=int, default=5, help='saves per size (save)')
+    parser.add_argument('--samples', type=int, default=SAMPLES, help='runs of each operation (suite)')
+    parser.add_argument('--stores', nargs='+', choices=list(SUITE_STORES), default=list(SUITE_STORES))
+    parser.add_argument('--backends', nargs='+', choices=['json', 'sharded', 'sqlite'], default=['json'])
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'save':
+        results = [benchmark_save(users, args.repeats, args.entries)
+                   for users in args.users or [1000, 10000, 100000]]
+        print_save_results(results)
+    else:
+        results = run_suite(args.stores, args.backends, args.users or [1000, 10000],
+                            args.entries, args.messages, args.samples)
+    if args.output:
+        write_results(args.output, args.benchmark, args, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# MindfulBuddy - Concurrent writer stress test for the shared data store
+"""Run N worker processes writing to one store and check nothing was lost.
+
+Each worker plays a Streamlit process of the mobile/ultimate apps: it races
+the others to create the same user, then records check-ins and bumps the
+platform counter. Half of the workers keep the copy they loaded at start
+(a long-lived session with a stale view), the others reload every few
+writes like a rerun. A low compaction threshold makes compactions overlap
+with the writes.
+
+    python store_stress_test.py --writers 8 --entries 200
+    python store_stress_test.py --backend sqlite
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import data_store
+import sqlite_store
+
+STORE = 'ultimate'
+SHARED_USER = 'stress_user'
+
+
+def default_data():
+    return {'users': {}, 'platform_stats': {'total_users': 0, 'total_checkins': 0}}
+
+
+def configure(workdir, backend, compact_threshold):
+    os.chdir(workdir)
+    data_store.BACKEND = backend
+    data_store.COMPACT_THRESHOLD = compact_threshold
+    sqlite_store.DB_PATH = os.path.join(workdir, 'stress.db')
+
+
+def run_writer(writer, entries, workdir, backend, compact_threshold, start_event, results):
+    configure(workdir, backend, compact_threshold)
+    store = data_store.open_store(STORE, default_data)
+    start_event.wait()
+
+    created = store.create_user(SHARED_USER, {'password_hash': 'x', 'age_group': '25-34'})
+    if created:
+        store.increment('platform_stats', 'total_users')
+
+    reload_every = 5 if writer % 2 else 0
+    for n in range(entries):
+        if reload_every and n % reload_every == 0:
+            store = data_store.open_store(STORE, default_data)
+        store.add_mood_entry(SHARED_USER, {
+            'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'mood': n % 10 + 1,
+            'writer': writer,
+            'n': n,
+        })
+        store.increment('platform_stats', 'total_checkins')
+    store.flush()
+    results.put((writer, created))
+
+
+def check(store, writers, entries, created):
+    """Return a list of problems found in the final store"""
+    problems = []
+    expected = writers * entries
+    history = store.mood_history(SHARED_USER)
+    seen = {(entry['writer'], entry['n']) for entry in history}
+    missing = {(w, n) for w in range(writers) for n in range(entries)} - seen
+    if missing:
+        problems.append(f"{len(missing)} check-ins lost, e.g. {sorted(missing)[:5]}")
+    if len(history) != len(seen):
+        problems.append(f"{len(history) - len(seen)} duplicate check-ins")
+    stats = store.get_section('platform_stats')
+    if stats.get('total_checkins') != expected:
+        problems.append(f"total_checkins is {stats.get('total_checkins')}, expected {expected}")
+    if created != 1:
+        problems.append(f"{created} writers created {SHARED_USER}, expected exactly 1")
+    if stats.get('total_users') != 1:
+        problems.append(f"total_users is {stats.get('total_users')}, expected 1")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--entries', type=int, default=200, help='check-ins per writer')
+    parser.add_argument('--backend', choices=['json', 'sharded', 'sqlite'], default='json')
+    parser.add_argument('--compact-threshold', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as workdir:
+        start_event = context.Event()
+        results = context.Queue()
+        workers = [
+            context.Process(target=run_writer, args=(
+                writer, args.entries, workdir, args.backend, args.compact_threshold, start_event, results
+            ))
+            for writer in range(args.writers)
+        ]
+        for worker in workers:
+            worker.start()
+        started = time.perf_counter()
+        start_event.set()
+        outcomes = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        cwd = os.getcwd()
+        # No background compaction here: it would outlive the chdir back
+        configure(workdir, args.backend, sys.maxsize)
+        try:
+            if args.backend == 'json':
+                data_store.compact_store(data_store.STORE_LAYOUTS[STORE]['file'])
+            store = data_store.open_store(STORE, default_data)
+            created = sum(1 for _, was_created in outcomes if was_created)
+            problems = check(store, args.writers, args.entries, created)
+        finally:
+            os.chdir(cwd)
+
+    total = args.writers * args.entries
+    print(f"{args.backend}: {args.writers} writers x {args.entries} check-ins = {total} "
+          f"in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+    if problems:
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        return 1
+    print("OK: no check-ins lost")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
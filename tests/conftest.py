@@ -0,0 +1,51 @@
+# MindfulBuddy - Shared test fixtures
+"""Every test runs in its own empty directory with fresh process-wide
+singletons, since the stores, logs and keys all live at relative paths.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+
+# Cheap hashes; set before password_hashing reads it
+os.environ.setdefault('MINDFUL_PASSWORD_ITERATIONS', '1000')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import audit_query
+import brute_force_detector
+import chat_render
+import chat_router
+import conversation_log
+import data_store
+import intent_classifier
+import login_limiter
+import security_log
+import session_store
+import sqlite_store
+import sso_service
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data_store, 'BACKEND', 'json')
+    monkeypatch.setattr(audit_query, '_indexes', {})
+    monkeypatch.setattr(sso_service, '_client', None)
+    monkeypatch.setattr(intent_classifier, '_model', None)
+    chat_router._intent.cache_clear()
+    chat_render._fragment.cache_clear()
+    monkeypatch.setattr(conversation_log, '_logs', {})
+    monkeypatch.setattr(login_limiter, '_shared', None)
+    monkeypatch.setattr(brute_force_detector, '_shared', None)
+    monkeypatch.setattr(session_store, '_stores', {})
+    monkeypatch.setattr(security_log, '_logs', {})
+    # Connections are cached per thread by path, and the path is relative
+    monkeypatch.setattr(sqlite_store, '_local', threading.local())
+    data_store._cache.clear()
+    yield tmp_path
+    # Queued writes go to relative paths: finish them before leaving
+    data_store.barrier()
+    data_store._cache.clear()
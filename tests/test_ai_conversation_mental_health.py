@@ -0,0 +1,18 @@
+# MindfulBuddy - AI conversation app tests
+import conversation_state
+
+
+def messages(*texts):
+    return [{'sender': 'user' if n % 2 == 0 else 'ai', 'message': text} for n, text in enumerate(texts)]
+
+
+def test_low_mood_reply_names_what_was_mentioned():
+    # Runs the page in streamlit's bare mode; only the response functions are used
+    import ai_conversation_mental_health as app
+    history = conversation_state.ConversationState(messages("My exam went badly", "I'm sorry", "I feel low"))
+    assert "school or work" in app.generate_supportive_response("I feel low", history)
+    # Outside the last three messages, or only the AI's words: no mention
+    history = conversation_state.ConversationState(messages("Lost my job", "Oh no", "hmm", "ok", "I feel low"))
+    assert "school or work" not in app.generate_supportive_response("I feel low", history)
+    history = conversation_state.ConversationState(messages("I feel low", "Is it school?", "Not really"))
+    assert "school or work" not in app.generate_supportive_response("Not really", history)
@@ -0,0 +1,73 @@
+# MindfulBuddy - Audit query tests
+import io
+import json
+import os
+
+import audit_query
+import security_log
+
+
+def event(minute, second, kind, username):
+    return {'timestamp': f'2026-01-01 10:{minute:02d}:{second:02d}', 'event': kind, 'username': username}
+
+
+def write(log, count, start=0):
+    for n in range(start, start + count):
+        log.append(event(n // 10, n % 10, 'LOGIN_FAILED' if n % 3 == 0 else 'LOGIN_SUCCESS',
+                         'alice' if n % 2 else 'bob'))
+
+
+def test_queries_read_only_matching_lines():
+    log = security_log.SecurityLog('app')
+    write(log, 30)
+    index = audit_query.AuditIndex(log.directory)
+    failed = list(index.query(event='LOGIN_FAILED'))
+    assert len(failed) == 10 and all(entry['event'] == 'LOGIN_FAILED' for entry in failed)
+    alice = list(index.query(username='alice', since='2026-01-01 10:01', until='2026-01-01 10:01'))
+    assert [entry['timestamp'][-5:] for entry in alice] == [f'01:{s:02d}' for s in (1, 3, 5, 7, 9)]
+    newest = list(index.query(username='bob', limit=2))
+    assert [entry['timestamp'][-5:] for entry in newest] == ['02:06', '02:08']
+
+
+def test_offsets_stay_valid_after_the_log_rotates():
+    log = security_log.SecurityLog('app', max_bytes=1000)
+    write(log, 8)
+    index = audit_query.AuditIndex(log.directory)
+    before = list(index.query(username='alice'))
+    # The indexed current file is renamed, and new ones follow it
+    write(log, 40, start=8)
+    rotated = log.files()[:-1]
+    assert len(rotated) >= 3
+    assert list(index.query(username='alice'))[:len(before)] == before
+    assert len(list(index.query(username='alice'))) == 24
+    assert len(list(index.query())) == 48
+    # Rotated files keep their index in a sidecar, loaded by a fresh index
+    assert all(os.path.exists(path[:-4] + audit_query.INDEX_SUFFIX) for path in rotated)
+    fresh = audit_query.AuditIndex(log.directory)
+    assert list(fresh.query(event='LOGIN_FAILED')) == list(index.query(event='LOGIN_FAILED'))
+    assert all(file_index.saved for _, file_index in fresh.refresh()[:-1])
+
+
+def test_a_changed_sidecar_is_rebuilt():
+    log = security_log.SecurityLog('app', max_bytes=300)
+    write(log, 10)
+    rotated = log.files()[0]
+    audit_query.AuditIndex(log.directory).refresh()
+    with open(rotated[:-4] + audit_query.INDEX_SUFFIX, 'w') as file:
+        json.dump({'size': 1}, file)
+    assert len(list(audit_query.AuditIndex(log.directory).query())) == 10
+
+
+def test_counts_bursts_and_export():
+    log = security_log.SecurityLog('app')
+    write(log, 30)
+    index = audit_query.AuditIndex(log.directory)
+    assert index.counts() == {'2026-01-01 10:00': 10, '2026-01-01 10:01': 10, '2026-01-01 10:02': 10}
+    assert index.counts('LOGIN_FAILED', resolution='hour') == {'2026-01-01 10': 10}
+    assert index.bursts(threshold=4) == [('2026-01-01 10:00', 4)]
+    out = io.StringIO()
+    assert index.export(out, format='csv', username='alice', limit=2) == 2
+    assert out.getvalue().splitlines()[0] == 'timestamp,event,username,details'
+    out = io.StringIO()
+    assert index.export(out, event='LOGIN_SUCCESS') == 20
+    assert json.loads(out.getvalue().splitlines()[0])['event'] == 'LOGIN_SUCCESS'
@@ -0,0 +1,53 @@
+# MindfulBuddy - Brute-force detector tests
+import random
+
+import brute_force_detector
+from brute_force_detector import BruteForceDetector
+
+
+def detector(**settings):
+    defaults = dict(window=60, buckets=6, user_threshold=3, global_threshold=10,
+                    cooldown=100, global_cooldown=50, client_threshold=2)
+    return BruteForceDetector(**{**defaults, **settings})
+
+
+def test_one_username_is_throttled():
+    watch = detector()
+    assert not watch.record_failure('alice', now=1)
+    watch.record_failure('alice', now=2)
+    assert watch.record_failure('alice', now=3)
+    assert watch.retry_after('alice', now=4) == 99
+    assert watch.retry_after('bob', now=4) == 0
+    watch.reset('alice')
+    assert not watch.throttled('alice', now=4)
+
+
+def test_failures_leave_the_window():
+    watch = detector()
+    watch.record_failure('alice', now=1)
+    watch.record_failure('alice', now=2)
+    assert not watch.record_failure('alice', now=200)
+
+
+def test_stuffing_flags_without_locking_out_other_clients():
+    watch = detector()
+    raised = [watch.record_failure(f"leaked{n}", client='attacker', now=n / 10) for n in range(10)]
+    assert any(raised) and watch.throttled(now=1)
+    assert watch.retry_after(None, 'attacker', now=1) > 0
+    assert watch.retry_after('alice', 'visitor', now=1) == 0
+    assert watch.stats(now=1)['global_throttle']
+
+
+def test_counters_are_capped():
+    watch = detector(max_users=5)
+    for n in range(20):
+        watch.record_failure(f"user{n}", client=f"client{n}", now=1)
+    assert watch.stats(now=1)['usernames'] <= 5 and watch.stats(now=1)['clients'] <= 5
+
+
+def test_replay_catches_stuffing_without_false_flags():
+    random.seed(7)
+    trace = brute_force_detector.make_trace('stuffing', 600, 500, 0.05, 300)
+    result = brute_force_detector.replay(BruteForceDetector, trace)
+    assert result['false_flags'] == 0
+    assert result['detection_latency_s'] is not None and result['detection_latency_s'] < 10
@@ -0,0 +1,82 @@
+# MindfulBuddy - Batch chat reply tests
+import json
+
+import pytest
+
+import chat_batch
+import conversation_state
+import data_store
+
+
+@pytest.fixture(params=['json', 'sharded', 'sqlite'])
+def store(request, monkeypatch):
+    monkeypatch.setattr(data_store, 'BACKEND', request.param)
+    store = data_store.open_store('ultimate', {'users': {}})
+    for username in ('alice', 'bob'):
+        store.create_user(username, {'ai_conversations': []})
+    return store
+
+
+def test_backlog_is_answered_and_saved_per_user(store):
+    store.add_messages('alice', [{'type': 'user', 'message': 'earlier'}])
+    backlog = [('alice', 'I feel sad', None), ('mallory', 'hi', None),
+               ('bob', 'my exam is tomorrow', 5), ('alice', 'thanks', None)]
+    assert chat_batch.answer_backlog(store, backlog) == {'answered': 3, 'skipped': 1, 'users': 2}
+    store.flush()
+    alice = store.messages('alice')
+    assert [message['type'] for message in alice] == ['user', 'user', 'ai', 'user', 'ai']
+    assert alice[2]['message'] == chat_batch.REPLIES['sadness']
+    assert store.messages('bob')[1]['message'] == chat_batch.REPLIES['academic']
+    assert not store.user_exists('mallory')
+
+
+def test_replies_see_the_history_before_the_backlog(store):
+    store.add_messages('alice', [{'type': 'user', 'message': 'earlier'}])
+    seen = []
+
+    def respond(topic, message, history, mood):
+        seen.append(len(history))
+        return topic or 'none'
+    chat_batch.answer_backlog(store, [('alice', 'hi', None), ('alice', 'sad', None)], respond)
+    assert seen == [1, 1]
+
+
+def test_replies_see_only_the_latest_window(store, monkeypatch):
+    monkeypatch.setattr(conversation_state, 'HOT_MESSAGES', 3)
+    store.add_messages('alice', [{'type': 'user', 'message': f"earlier {n}"} for n in range(5)])
+    seen = []
+
+    def respond(topic, message, history, mood):
+        seen.append([entry['message'] for entry in history])
+        return 'ok'
+    chat_batch.answer_backlog(store, [('alice', 'hi', None)], respond)
+    assert seen == [["earlier 2", "earlier 3", "earlier 4"]]
+
+
+def test_each_user_is_looked_up_once(store, monkeypatch):
+    looked_up = []
+    user_exists = store.user_exists
+
+    def counted(username):
+        looked_up.append(username)
+        return user_exists(username)
+    monkeypatch.setattr(store, 'user_exists', counted)
+    backlog = [('alice', 'hi', None), ('mallory', 'hi', None), ('alice', 'sad', None), ('mallory', 'ok', None)]
+    assert chat_batch.answer_backlog(store, backlog)['skipped'] == 2
+    assert looked_up == ['alice', 'mallory']
+
+
+def test_mood_decides_before_topic():
+    assert chat_batch.reply('sadness', 'x', [], mood=2) in chat_batch.LOW_MOOD_REPLIES
+    assert chat_batch.reply('sadness', 'x', [], mood=9) in chat_batch.HIGH_MOOD_REPLIES
+    assert chat_batch.reply(None, 'x', [], mood=5) == chat_batch.DEFAULT_REPLY
+
+
+def test_answer_command_reads_a_json_lines_backlog(tmp_path, capsys):
+    store = data_store.open_store('ultimate', {'users': {}})
+    store.create_user('alice', {'ai_conversations': []})
+    path = tmp_path / 'backlog.jsonl'
+    path.write_text(json.dumps({'username': 'alice', 'message': 'so anxious'}) + '\n\n')
+    assert chat_batch.main(['answer', str(path)]) == 0
+    assert capsys.readouterr().out.startswith('1 answered for 1 users, 0 skipped')
+    assert data_store.open_store('ultimate').messages('alice')[1]['message'] == chat_batch.REPLIES['anxiety']
@@ -0,0 +1,52 @@
+# MindfulBuddy - Chat rendering tests
+import chat_render
+from conversation_state import ConversationState
+
+
+def conversation(count):
+    return [{'sender': 'user' if n % 2 == 0 else 'ai', 'timestamp': f"10:{n:02d}", 'message': f"message {n}"}
+            for n in range(count)]
+
+
+def test_only_the_window_is_rendered():
+    messages = conversation(10)
+    page = chat_render.transcript(messages, shown=3)
+    assert page.startswith('<div class="chat-container">')
+    assert "message 6" not in page
+    assert [n for n in range(10) if f"message {n}<" in page] == [7, 8, 9]
+    assert chat_render.earlier(messages, 3) == 7
+    assert chat_render.earlier(messages, 50) == 0
+    assert chat_render.transcript(messages, shown=50).count('-message">') == 10
+
+
+def test_text_is_escaped():
+    page = chat_render.transcript([{'type': 'user', 'timestamp': '<t>', 'message': '<script>x</script>'}], style='whatsapp')
+    assert '<script>' not in page and '&lt;script&gt;' in page and '&lt;t&gt;' in page
+    assert 'class="user-bubble"' in page
+
+
+def test_fragments_are_rendered_once():
+    messages = conversation(5)
+    chat_render.transcript(messages)
+    assert chat_render._fragment.cache_info().misses == 5
+    messages.append({'sender': 'user', 'timestamp': "10:05", 'message': "message 5"})
+    chat_render.transcript(messages)
+    assert chat_render._fragment.cache_info().misses == 6
+
+
+def test_windowed_rerun_is_smaller_than_a_full_rebuild():
+    results = chat_render.benchmark(500, 10)
+    assert results['windowed_kib'] < results['full_rebuild_kib'] / 5
+
+
+def test_paging_past_the_tail_loads_from_the_store():
+    stored = conversation(10)
+    state = ConversationState(stored[-4:], total=10, hot=4)
+    loads = []
+
+    def load(shown):
+        loads.append(shown)
+        return stored[-shown:]
+    assert chat_render.earlier(state, 3) == 7
+    assert "message 5" not in chat_render.transcript(state, shown=3, load=load) and loads == []
+    assert "message 3<" in chat_render.transcript(state, shown=7, load=load) and loads == [7]
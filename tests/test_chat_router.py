@@ -0,0 +1,47 @@
+# MindfulBuddy - Chat topic router tests
+import chat_router
+
+
+def test_highest_priority_topic_wins():
+    assert chat_router.route("My exam went great but I'm so anxious") == 'anxiety'
+    assert chat_router.classify("My exam went great but I'm so anxious") == [
+        ('anxiety', 2), ('positive', 4), ('academic', 5)]
+    assert chat_router.route("Nothing much happened") is None
+    assert chat_router.classify("") == []
+
+
+def test_keywords_match_whole_words_and_plurals():
+    assert chat_router.route("I made dinner") is None
+    assert chat_router.route("Reading about a crusade") is None
+    assert chat_router.route("Two exams tomorrow") == 'academic'
+    assert chat_router.route("MY PARENTS, again...") == 'family'
+    assert chat_router.route("I’m sad—really") == 'sadness'
+
+
+def test_phrases_match_across_whitespace():
+    assert chat_router.route("What   should\nI do?") == 'advice'
+    assert chat_router.route("how I can't sleep") is None
+    assert chat_router.route("whatever should happen") is None
+
+
+def test_inflections_match():
+    assert chat_router.route("so much sadness lately") == 'sadness'
+    assert chat_router.route("I keep worrying") == 'anxiety'
+    assert chat_router.route("my worries") == 'anxiety'
+    assert chat_router.route("studying all night") == 'academic'
+    assert chat_router.route("pure happiness") == 'positive'
+    assert chat_router.route("this is frustrating") == 'anger'
+    assert chat_router.forms('worried') == {'worry', 'worries', 'worried', 'worrying'}
+
+
+def test_words_end_at_any_separator():
+    assert chat_router.route("sad\u00a0today") == 'sadness'
+    assert chat_router.route("sadé") is None
+    assert chat_router.route("exam2") is None
+    assert chat_router.route("(sad)") == 'sadness'
+
+
+def test_route_many_matches_route():
+    messages = ["I feel sad", "exam stress!", "I feel sad", "hello", "What should I do, mom?", "sadness"]
+    assert chat_router.route_many(messages) == [chat_router.route(message) for message in messages]
+    assert chat_router.route_many([]) == []
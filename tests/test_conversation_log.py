@@ -0,0 +1,156 @@
+# MindfulBuddy - Conversation log tests
+import json
+import os
+
+import pytest
+
+import conversation_log
+import data_store
+
+
+def messages(count, start=0):
+    return [{'sender': 'user', 'message': f"message {n}", 'timestamp': f"t{n:04d}"}
+            for n in range(start, start + count)]
+
+
+@pytest.fixture
+def tiers(monkeypatch):
+    """Seal all but the latest 5 messages once 4 more arrive"""
+    monkeypatch.setattr(conversation_log, 'HOT_MESSAGES', 5)
+    monkeypatch.setattr(conversation_log, 'SEGMENT_MESSAGES', 4)
+    conversation_log._segment_lines.cache_clear()
+
+
+def texts(found):
+    return [message['message'] for message in found]
+
+
+def test_appends_are_read_back_in_order():
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    assert log.messages() == [] and log.count() == 0 and log.recent(5) == []
+    log.append(messages(3))
+    log.append(messages(2, start=3))
+    assert texts(log.messages()) == [f"message {n}" for n in range(5)]
+    assert texts(log.recent(2)) == ["message 3", "message 4"]
+    assert log.count() == 5
+    assert conversation_log.open_log('ultimate', 'alice', 'chat') is log
+    assert log.path == conversation_log.log_path('ultimate', 'alice', 'chat')
+
+
+def test_clear_hides_everything_before_the_tombstone(monkeypatch):
+    monkeypatch.setattr(conversation_log, 'COMPACT_BYTES', 10 ** 9)
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    log.append(messages(3))
+    log.clear()
+    assert log.messages() == [] and log.recent(10) == [] and log.count() == 0
+    log.append(messages(1, start=3))
+    assert texts(log.recent(10)) == ["message 3"] and log.count() == 1
+    assert len(open(log.path).readlines()) == 5
+
+
+def test_clear_compacts_once_enough_is_dead(monkeypatch):
+    monkeypatch.setattr(conversation_log, 'COMPACT_BYTES', 100)
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    log.append(messages(10))
+    reader = conversation_log.ConversationLog(log.path)
+    assert reader.count() == 10
+    inode = os.stat(log.path).st_ino
+    log.clear()
+    assert os.path.getsize(log.path) == 0 and os.stat(log.path).st_ino != inode
+    log.append(messages(1, start=10))
+    # A reader that scanned the old file notices the new one
+    assert reader.count() == 1 and texts(reader.messages()) == ["message 10"]
+
+
+def test_a_torn_last_line_is_not_a_message():
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    log.append(messages(2))
+    with open(log.path, 'ab') as file:
+        file.write(b'{"sender": "us')
+    assert log.count() == 2 and len(log.recent(5)) == 2
+    log.append(messages(1, start=2))
+    assert texts(log.messages()) == ["message 0", "message 1", "message 2"]
+
+
+def test_compact_all_rewrites_every_log():
+    for username in ('alice', 'bob'):
+        log = conversation_log.open_log('ultimate', username, 'chat')
+        log.append(messages(2))
+        log.clear()
+    conversation_log.open_log('ultimate', 'carol', 'chat').append(messages(1))
+    assert len(list(conversation_log.all_logs())) == 3
+    assert conversation_log.compact_all() == 2
+    assert conversation_log.main(['compact']) == 0
+
+
+def test_snapshot_messages_move_on_write_not_read():
+    data_store.save_store('ultimate_platform_data.json', {'users': {'alice': {
+        'mood_history': [], 'ai_conversations': messages(3)}}})
+    store = data_store.open_store('ultimate', {'users': {}})
+    assert store.message_count('alice') == 3
+    assert texts(store.messages('alice', limit=2)) == ["message 1", "message 2"]
+    assert not conversation_log.open_log('ultimate', 'alice', 'chat').exists()
+    store.add_messages('alice', messages(1, start=3))
+    assert store.message_count('alice') == 4
+    data_store.barrier()
+    data_store._cache.clear()
+    assert 'ai_conversations' not in data_store.load_store('ultimate_platform_data.json', {})['users']['alice']
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    assert [json.loads(line)['message'] for line in open(log.path)] == [f"message {n}" for n in range(4)]
+
+
+def test_migrate_moves_every_conversation():
+    data_store.save_store('ultimate_platform_data.json', {'users': {
+        username: {'mood_history': [], 'ai_conversations': messages(2)} for username in ('alice', 'bob')}})
+    assert conversation_log.migrate_all() == 2
+    assert conversation_log.migrate_all() == 0
+    assert conversation_log.main(['migrate']) == 0
+    assert data_store.JsonStore('ultimate').message_count('bob') == 2
+
+
+def test_deleting_a_user_removes_their_logs():
+    store = data_store.open_store('ultimate', {'users': {}})
+    store.create_user('alice', {})
+    store.add_messages('alice', messages(2))
+    store.add_messages('alice', messages(1), channel='voice')
+    store.delete_user('alice')
+    assert list(conversation_log.all_logs()) == []
+    store.create_user('alice', {})
+    assert store.messages('alice') == []
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'lzma'])
+def test_old_messages_are_sealed_into_segments(tiers, monkeypatch, codec):
+    monkeypatch.setattr(conversation_log, 'CODEC', codec)
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    for n in range(20):
+        log.append(messages(1, start=n))
+    entries = log._index()
+    assert [entry['count'] for entry in entries] == [4, 4, 4]
+    assert entries[0]['first'] == 't0000' and entries[-1]['last'] == 't0011'
+    assert all(entry['file'].endswith(conversation_log.CODECS[codec][0]) for entry in entries)
+    assert json.loads(open(log.path).readline()) == {'_sealed': 3}
+    assert log.count() == 20
+    assert texts(log.messages()) == [f"message {n}" for n in range(20)]
+    assert texts(conversation_log.ConversationLog(log.path).recent(3)) == ["message 17", "message 18", "message 19"]
+
+
+def test_paging_back_reads_only_the_segments_it_reaches(tiers, monkeypatch):
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    log.seed(messages(20))
+    conversation_log._segment_lines.cache_clear()
+    assert len(log.recent(5)) == 5
+    assert conversation_log._segment_lines.cache_info().currsize == 0
+    assert texts(log.recent(8)) == [f"message {n}" for n in range(12, 20)]
+    assert conversation_log._segment_lines.cache_info().currsize == 1
+    assert texts(log.recent(100)) == [f"message {n}" for n in range(20)]
+
+
+def test_clear_deletes_the_segments(tiers):
+    log = conversation_log.open_log('ultimate', 'alice', 'chat')
+    log.seed(messages(20))
+    directory = os.path.dirname(log.path)
+    assert len(os.listdir(directory)) > 2
+    log.clear()
+    assert log.count() == 0 and log.recent(5) == [] and not os.path.exists(log.index_path)
+    assert sorted(os.listdir(directory)) == sorted([os.path.basename(log.path), os.path.basename(log.path) + '.lock'])
@@ -0,0 +1,82 @@
+# MindfulBuddy - Conversation state tests
+from conversation_state import ConversationState
+
+
+def user(text):
+    return {'sender': 'user', 'message': text}
+
+
+def test_mentions_are_tracked_by_position():
+    state = ConversationState([user("I'm sad"), {'sender': 'ai', 'message': "I'm sorry"}])
+    assert state.mentioned('sadness')
+    assert state.mentioned('sadness', within=2)
+    assert not state.mentioned('sadness', within=1)
+    assert not state.mentioned('anger')
+    state.append({'type': 'ai', 'message': "That sounds hard, and you sound angry"})
+    assert not state.mentioned('anger')
+
+
+def test_only_user_messages_are_classified():
+    state = ConversationState()
+    state.append(user("my exams"))
+    state.append({'type': 'ai', 'message': "exams are stressful"})
+    assert state.topic_counts == {'academic': 1}
+    assert state.messages_from('user') == 1
+    assert state.messages_from('ai') == 1
+    assert len(state) == 2
+    assert [message['message'] for message in state] == ["my exams", "exams are stressful"]
+    assert state[-1]['type'] == 'ai'
+
+
+def test_tone_follows_recent_messages():
+    state = ConversationState()
+    assert state.tone() == 'neutral'
+    for _ in range(3):
+        state.append(user("I feel sad"))
+    assert state.tone() == 'low'
+    for _ in range(6):
+        state.append(user("I feel happy"))
+    assert state.tone() == 'positive'
+    state.clear()
+    assert len(state) == 0 and state.tone() == 'neutral' and not state.last_seen
+
+
+def test_only_the_tail_is_kept():
+    state = ConversationState([user(f"message {n}") for n in range(5)], total=12, hot=3)
+    assert len(state) == 3 and state.total == 12 and state.earlier == 9
+    assert [message['message'] for message in state] == ["message 2", "message 3", "message 4"]
+    state.append(user("my exams"))
+    assert len(state) == 3 and state.total == 13
+    assert state.mentioned('academic', within=1)
+
+
+def conversation(count, school_at):
+    return [{'sender': 'user', 'message': "my school exams stress me out"} if n == school_at
+            else {'sender': 'ai' if n % 2 else 'user', 'message': "hello"} for n in range(count)]
+
+
+def test_tail_is_numbered_like_the_whole_conversation():
+    messages = conversation(30, school_at=27)
+    full = ConversationState(messages, hot=10)
+    tail = ConversationState(messages[-10:], total=30, hot=10)
+    assert full.total == tail.total == 30
+    assert len(full) == len(tail) == 10
+    assert full.last_seen == tail.last_seen == {'anxiety': 27, 'academic': 27}
+    assert tail.mentioned('academic', within=3)
+    assert not tail.mentioned('academic', within=2)
+
+
+def test_appending_to_a_tail_keeps_counting():
+    tail = ConversationState(conversation(5, school_at=0), total=50, hot=4)
+    assert tail.total == 50 and len(tail) == 4 and tail.earlier == 46
+    tail.append({'sender': 'ai', 'message': "tell me more"})
+    assert tail.total == 51 and len(tail) == 4
+    # It was message 45 of 51
+    assert tail.mentioned('academic', within=6) and not tail.mentioned('academic', within=5)
+
+
+def test_counts_cover_the_messages_seen():
+    tail = ConversationState(conversation(10, school_at=-1)[-4:], total=10)
+    assert tail.messages_from('user') + tail.messages_from('ai') == 4
+    tail.clear()
+    assert tail.total == 0 and tail.messages_from('user') == 0
@@ -0,0 +1,310 @@
+# MindfulBuddy - Journaled store tests
+import copy
+import json
+import multiprocessing
+import os
+import shutil
+
+import data_store
+
+
+def store_path(tmp_path):
+    return str(tmp_path / 'test_data.json')
+
+
+def reload(path):
+    return data_store.load_store(path, {'users': {}})
+
+
+def test_records_replay_over_the_snapshot(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.set_record(path, data, ['users', 'alice'], {'mood': []})
+    data_store.append_record(path, data, ['users', 'alice', 'mood'], 3)
+    data_store.append_record(path, data, ['users', 'alice', 'mood'], 4)
+    data_store.increment_record(path, data, ['stats', 'checkins'], 2)
+    data_store.set_record(path, data, ['users', 'bob'], {})
+    data_store.delete_record(path, data, ['users', 'bob'])
+    loaded = reload(path)
+    assert loaded['users'] == {'alice': {'mood': [3, 4]}}
+    assert loaded['stats'] == {'checkins': 2}
+
+
+def test_append_keeps_the_last_items(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    for value in range(5):
+        data_store.append_record(path, data, ['log'], value, keep=3)
+    assert reload(path)['log'] == [2, 3, 4]
+
+
+def test_a_torn_final_record_is_skipped(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.set_record(path, data, ['users', 'alice'], 1)
+    data_store.barrier()
+    with open(path + data_store.JOURNAL_SUFFIX, 'a') as file:
+        file.write('{"op": "set", "keys": ["users", "bob"')
+    assert reload(path)['users'] == {'alice': 1}
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.set_record(path, data, ['users', 'alice'], {'mood': [1]})
+    data_store.barrier()
+    data_store.compact_store(path)
+    assert not os.path.exists(path + data_store.JOURNAL_SUFFIX)
+    with open(path) as file:
+        assert json.load(file)['users'] == {'alice': {'mood': [1]}}
+    assert reload(path)['users'] == {'alice': {'mood': [1]}}
+
+
+def test_crash_before_folding_replays_both_journals(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.append_record(path, data, ['log'], 1)
+    data_store.barrier()
+    # Compaction renamed the journal, then the process died
+    os.replace(path + data_store.JOURNAL_SUFFIX, path + data_store.COMPACTING_SUFFIX)
+    data_store.append_record(path, data, ['log'], 2)
+    data_store.barrier()
+    assert reload(path)['log'] == [1, 2]
+    # The leftover is folded first, the live journal on the next round
+    data_store.compact_store(path)
+    assert not os.path.exists(path + data_store.COMPACTING_SUFFIX)
+    data_store.compact_store(path)
+    assert reload(path)['log'] == [1, 2]
+
+
+def test_crash_after_the_snapshot_does_not_apply_records_twice(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.append_record(path, data, ['log'], 1)
+    data_store.barrier()
+    saved = str(tmp_path / 'journal.copy')
+    shutil.copy(path + data_store.JOURNAL_SUFFIX, saved)
+    data_store.compact_store(path)
+    # The snapshot was written but the folded file was never removed
+    os.replace(saved, path + data_store.COMPACTING_SUFFIX)
+    data = reload(path)
+    assert data['log'] == [1]
+    data_store.append_record(path, data, ['log'], 2)
+    data_store.barrier()
+    data_store.compact_store(path)
+    data_store.compact_store(path)
+    assert reload(path)['log'] == [1, 2]
+
+
+def test_plain_json_files_load_unchanged(tmp_path):
+    path = store_path(tmp_path)
+    with open(path, 'w') as file:
+        json.dump({'users': {'alice': {'mood': [5]}}}, file)
+    assert reload(path)['users'] == {'alice': {'mood': [5]}}
+
+
+def test_a_stale_copy_merges_newer_records_before_writing(tmp_path):
+    path = store_path(tmp_path)
+    first = reload(path)
+    second = copy.deepcopy(first)
+    data_store.append_record(path, first, ['log'], 1)
+    data_store.append_record(path, second, ['log'], 2)
+    data_store.barrier()
+    # The session sees its own write first; the journal keeps disk order
+    assert sorted(second['log']) == [1, 2]
+    assert not data_store.insert_record(path, first, ['log'], [])
+    data_store._cache.clear()
+    assert reload(path)['log'] == [1, 2]
+
+
+def write_checkins(args):
+    path, worker = args
+    data = reload(path)
+    created = data_store.insert_record(path, data, ['users', 'shared'], {'mood_history': []})
+    for index in range(40):
+        data_store.append_record(path, data, ['users', 'shared', 'mood_history'], [worker, index])
+        data_store.increment_record(path, data, ['stats', 'checkins'])
+        if index % 10 == 0:
+            data = reload(path)
+    # Pool workers leave without running atexit
+    data_store.barrier()
+    return created
+
+
+def test_processes_sharing_a_store_lose_no_writes(tmp_path, monkeypatch):
+    # Compactions run while the others write
+    monkeypatch.setattr(data_store, 'COMPACT_THRESHOLD', 20)
+    path = store_path(tmp_path)
+    reload(path)
+    with multiprocessing.get_context('fork').Pool(4) as pool:
+        created = pool.map(write_checkins, [(path, worker) for worker in range(4)])
+    data = reload(path)
+    assert created.count(True) == 1
+    assert sorted(map(tuple, data['users']['shared']['mood_history'])) == [
+        (worker, index) for worker in range(4) for index in range(40)]
+    assert data['stats'] == {'checkins': 160}
+
+
+def write_one(path, data, value):
+    data_store.append_record(path, data, ['log'], value)
+    data_store.barrier()
+
+
+def test_loads_share_one_copy_until_the_files_change(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.append_record(path, data, ['log'], 1)
+    assert reload(path) is data
+    data_store.barrier()
+    # Another process writes: the shared copy merges its record in place
+    process = multiprocessing.get_context('fork').Process(target=write_one, args=(path, copy.deepcopy(data), 2))
+    process.start()
+    process.join()
+    assert reload(path) is data
+    assert data['log'] == [1, 2]
+
+
+def test_store_reads_do_not_hand_out_the_shared_copy():
+    store = data_store.JsonStore('analytics', {'users': {}})
+    store.create_user('alice', {})
+    store.add_mood_entry('alice', {'date': '2026-01-01', 'mood': 5})
+    store.mood_history('alice').append({'date': '2026-01-02', 'mood': 1})
+    store.get_section('users')['bob'] = {}
+    assert store.mood_count('alice') == 1
+    assert store.list_users() == ['alice']
+
+
+SAMPLE = {
+    'users': {'alice': {'mood_history': [{'date': '2026-01-01', 'mood': 5}], 'name': 'Ålice'},
+              'bob': {'mood_history': []}},
+    'sessions': {},
+    'stats': {'checkins': 1},
+    'version': 2,
+}
+
+
+def test_snapshots_encode_like_json_dump():
+    text, _ = data_store.encode_snapshot(SAMPLE)
+    assert text == json.dumps(SAMPLE, indent=2)
+    text, _ = data_store.encode_snapshot(SAMPLE, compact=True)
+    assert text == json.dumps(SAMPLE, separators=(',', ':'))
+
+
+def test_only_dirty_fragments_are_encoded_again():
+    data = copy.deepcopy(SAMPLE)
+    _, fragments = data_store.encode_snapshot(data)
+    data['users']['alice']['mood_history'].append({'date': '2026-01-02', 'mood': 6})
+    data['users']['bob']['name'] = 'not marked dirty'
+    text, _ = data_store.encode_snapshot(data, fragments, {('users', 'alice')})
+    written = json.loads(text)
+    assert written['users']['alice'] == data['users']['alice']
+    assert written['users']['bob'] == {'mood_history': []}
+
+
+def test_compaction_writes_the_same_file_as_a_full_dump(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    for name in ('alice', 'bob', 'carol'):
+        data_store.set_record(path, data, ['users', name], {'mood_history': []})
+    data_store.barrier()
+    data_store.compact_store(path)
+    data_store.append_record(path, data, ['users', 'bob', 'mood_history'], {'mood': 4})
+    data_store.barrier()
+    data_store.compact_store(path)
+    with open(path) as file:
+        text = file.read()
+    assert text == json.dumps(json.loads(text), indent=2)
+    assert json.loads(text)['users']['bob'] == {'mood_history': [{'mood': 4}]}
+
+
+def test_writes_are_queued_until_a_barrier(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_store, 'COMMIT_WINDOW', 60)
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.append_record(path, data, ['log'], 1)
+    assert data['log'] == [1]
+    assert not os.path.exists(path + data_store.JOURNAL_SUFFIX)
+    data_store.barrier()
+    with open(path + data_store.JOURNAL_SUFFIX) as file:
+        assert [json.loads(line)['value'] for line in file] == [1]
+
+
+def test_inserts_and_a_zero_window_write_at_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_store, 'COMMIT_WINDOW', 60)
+    path = store_path(tmp_path)
+    data = reload(path)
+    assert data_store.insert_record(path, data, ['users', 'alice'], {})
+    assert os.path.exists(path + data_store.JOURNAL_SUFFIX)
+    monkeypatch.setattr(data_store, 'COMMIT_WINDOW', 0)
+    data_store.append_record(path, data, ['log'], 1)
+    data_store._cache.clear()
+    assert reload(path)['log'] == [1]
+
+
+def test_a_take_removes_a_value_once(tmp_path):
+    path = store_path(tmp_path)
+    data = reload(path)
+    data_store.set_record(path, data, ['users', 'alice'], {'code': 1})
+    stale = copy.deepcopy(data)
+    assert data_store.take_record(path, data, ['users', 'alice'])
+    # A copy that still holds it finds it gone on disk and creates nothing
+    assert not data_store.take_record(path, stale, ['users', 'alice'])
+    assert not data_store.take_record(path, stale, ['users', 'bob', 'code'])
+    data_store._cache.clear()
+    assert reload(path)['users'] == {}
+
+
+def indexed_store(tmp_path, users=300):
+    path = store_path(tmp_path)
+    data = reload(path)
+    for index in range(users):
+        data_store.set_record(path, data, ['users', f'user{index}'],
+                              {'mood_history': [{'date': '2026-01-01', 'mood': index % 10, 'notes': 'x' * 200}]})
+    data_store.set_record(path, data, ['stats'], {'checkins': users})
+    data_store.barrier()
+    data_store.compact_store(path)
+    data_store._cache.clear()
+    return path
+
+
+def test_partial_loads_read_one_user_through_the_offset_index(tmp_path):
+    path = indexed_store(tmp_path)
+    assert os.path.exists(path + data_store.OFFSETS_SUFFIX)
+    data = reload(path)
+    data_store.append_record(path, data, ['users', 'user7', 'mood_history'], {'date': '2026-01-02', 'mood': 1})
+    data_store.append_record(path, data, ['users', 'user8', 'mood_history'], {'date': '2026-01-02', 'mood': 2})
+    data_store.barrier()
+    partial = data_store.load_partial(path, [('users', 'user7'), ('stats',)])
+    assert list(partial['users']) == ['user7']
+    assert [entry['mood'] for entry in partial['users']['user7']['mood_history']] == [7, 1]
+    assert partial['stats'] == {'checkins': 300}
+
+
+def test_partial_loads_fall_back_when_the_index_is_stale(tmp_path):
+    path = indexed_store(tmp_path)
+    data = reload(path)
+    data_store.set_record(path, data, ['users'], {})
+    data_store.barrier()
+    # The journal replaced the section the entry comes from
+    assert data_store.load_partial(path, [('users', 'user7')]) is None
+    # A snapshot too small for an index removes the old one
+    data_store.save_store(path, data)
+    assert not os.path.exists(path + data_store.OFFSETS_SUFFIX)
+    assert data_store.load_partial(path, [('users', 'user7')]) is None
+
+
+def test_user_stores_read_other_entries_on_demand(tmp_path):
+    users = {f'user{index}': {'password_hash': 'x' * 300, 'mood_history': []} for index in range(300)}
+    with open('secure_app_data.json', 'w') as file:
+        json.dump({'users': users, 'sessions': {'token': {'username': 'user3'}}}, file)
+    # Rewritten with an offset index, as compaction does
+    data_store.save_store('secure_app_data.json', data_store.load_store('secure_app_data.json', None))
+    assert os.path.exists('secure_app_data.json' + data_store.OFFSETS_SUFFIX)
+    data_store._cache.clear()
+    store = data_store.open_user_store('secure', 'user1')
+    assert isinstance(store.data, data_store.PartialData)
+    assert list(store.data['users']) == ['user1']
+    store.add_mood_entry('user1', {'date': '2026-01-01', 'mood': 6})
+    assert store.mood_count('user1') == 1
+    assert store.user_exists('user2') and not store.user_exists('nobody')
+    assert store.get_session('token') == {'username': 'user3'}
@@ -0,0 +1,26 @@
+# MindfulBuddy - Family app tests
+from datetime import datetime
+
+import data_store
+
+
+def test_family_views_read_mood_columns():
+    # Runs the page in streamlit's bare mode; only its helpers are used
+    import family_mental_health_app as app
+    store = data_store.open_store('family', {'family_members': {}})
+    store.create_user('sam', {'role': 'Child/Teen', 'sharing_enabled': True})
+    store.create_user('alex', {'role': 'Parent'})
+    for day, mood in enumerate([5, 9, 2, 4], start=1):
+        store.add_mood_entry('sam', {'date': f'2026-01-{day:02d} 09:30', 'mood': mood})
+    members = app.load_family_members(store)
+    assert members['sam']['moods'].mood.tolist() == [5, 9, 2, 4]
+    assert len(members['alex']['moods']) == 0
+    assert app.week_checkins(members['sam']['moods'], now=datetime(2026, 1, 9, 12)) == 3
+    assert app.get_family_insights(members) == [
+        "🏠 Family average mood this week: 5.0/10",
+        "💚 Your family is managing well with some ups and downs.",
+        "👥 Active family members: 1",
+    ]
+    assert [alert['type'] for alert in app.check_family_alerts(members)] == ['crisis', 'inactive']
+    chart = app.create_family_overview_chart(members)
+    assert list(chart.data[0].x) == ['2026-01-01', '2026-01-02', '2026-01-03', '2026-01-04']
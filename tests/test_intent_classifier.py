@@ -0,0 +1,64 @@
+# MindfulBuddy - Intent model tests
+import json
+
+import numpy as np
+import pytest
+
+import chat_router
+import intent_classifier
+
+
+@pytest.fixture(scope='module')
+def examples():
+    return intent_classifier.read_corpus() + intent_classifier.lexicon_examples()
+
+
+@pytest.fixture(scope='module')
+def trained(examples):
+    return intent_classifier.train(examples)
+
+
+def test_probabilities_match_scikit_learn(examples, trained):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=intent_classifier.NGRAMS, sublinear_tf=True)
+    classifier = LogisticRegression(C=10.0, max_iter=2000)
+    classifier.fit(vectorizer.fit_transform([text for text, _ in examples]), [intent for _, intent in examples])
+    messages = ["I can't stop worrying about my exams", "my mom and dad keep fighting", "hello hello there"]
+    expected = classifier.predict_proba(vectorizer.transform(messages))
+    for message, row in zip(messages, expected):
+        found = trained.probabilities(message)
+        assert np.allclose([found[intent] for intent in classifier.classes_], row, atol=1e-9)
+    assert trained.probabilities("zz") == {}
+
+
+def test_the_model_fits_its_corpus(trained):
+    corpus = intent_classifier.read_corpus()
+    right = sum(trained.predict(text) == (None if intent == intent_classifier.GENERAL else intent)
+                for text, intent in corpus)
+    assert right / len(corpus) > 0.9
+
+
+def test_the_saved_model_is_reused_until_the_corpus_changes(tmp_path, monkeypatch, trained):
+    corpus_path = tmp_path / 'corpus.json'
+    corpus_path.write_text(json.dumps({'sadness': ['i feel sad'], 'general': ['hello there']}))
+    model_path = str(tmp_path / 'model.json')
+    first = intent_classifier.load(model_path, str(corpus_path))
+    monkeypatch.setattr(intent_classifier, 'train', lambda *args: pytest.fail("trained again"))
+    second = intent_classifier.load(model_path, str(corpus_path))
+    assert second.terms == first.terms
+    corpus_path.write_text(json.dumps({'sadness': ['i feel sad'], 'general': ['hi']}))
+    monkeypatch.setattr(intent_classifier, 'train', lambda *args: trained)
+    assert intent_classifier.load(model_path, str(corpus_path)) is trained
+
+
+def test_chat_router_can_route_through_the_model(monkeypatch, trained):
+    monkeypatch.setattr(intent_classifier, '_model', trained)
+    monkeypatch.setattr(chat_router, 'BACKEND', 'model')
+    message = "I can't stop worrying about my exams"
+    assert chat_router.route(message) == trained.predict(message)
+    assert chat_router.route_many([message, message]) == [trained.predict(message)] * 2
+    assert chat_router.intent(message, mood=2) == 'low_mood'
+    assert chat_router.intent(message, mood=9) == 'high_mood'
+    assert chat_router.intent(message, mood=5) == trained.predict(message)
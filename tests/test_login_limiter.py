@@ -0,0 +1,57 @@
+# MindfulBuddy - Login rate limiter tests
+import login_limiter
+
+
+def test_a_key_waits_once_its_attempts_are_used():
+    limiter = login_limiter.LoginLimiter(attempts=3, window=60)
+    key = login_limiter.user_key('alice')
+    for _ in range(3):
+        assert limiter.retry_after(key) == 0
+        limiter.record_failure(key)
+    assert 0 < limiter.retry_after(key) <= 20
+    assert limiter.retry_after(login_limiter.user_key('bob')) == 0
+    limiter.reset(key)
+    assert limiter.retry_after(key) == 0
+
+
+def test_the_emptiest_bucket_decides():
+    limiter = login_limiter.LoginLimiter(attempts=1, window=60)
+    user, client = login_limiter.user_key('alice'), login_limiter.client_key('10.0.0.1')
+    limiter.record_failure(client)
+    assert limiter.retry_after(user) == 0
+    assert limiter.retry_after(user, client) > 0
+    assert login_limiter.minutes(limiter.retry_after(user, client)) == 1
+
+
+def test_unknown_address_has_no_bucket():
+    assert login_limiter.client_keys(None) == ()
+    assert login_limiter.client_keys('10.0.0.1') == ('client:10.0.0.1',)
+    limiter = login_limiter.LoginLimiter(attempts=1, window=60)
+    limiter.record_failure(*login_limiter.client_keys(None))
+    assert limiter.retry_after(*login_limiter.client_keys(None)) == 0
+
+
+def test_lru_cap():
+    limiter = login_limiter.LoginLimiter(attempts=1, window=60, max_keys=2)
+    for name in ('a', 'b', 'c'):
+        limiter.record_failure(name)
+    assert len(limiter) == 2 and limiter.retry_after('a') == 0
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    path = str(tmp_path / 'limits.db')
+    first = login_limiter.SqliteLoginLimiter(path, attempts=2, window=60)
+    second = login_limiter.SqliteLoginLimiter(path, attempts=2, window=60)
+    first.record_failure('user:alice')
+    second.record_failure('user:alice')
+    assert first.retry_after('user:alice') > 0
+    assert second.retry_after('user:bob') == 0
+    assert second.retry_after() == 0
+    second.reset('user:alice')
+    assert first.retry_after('user:alice') == 0
+
+
+def test_shared_limiter_uses_sqlite_when_configured(tmp_path, monkeypatch):
+    monkeypatch.setattr(login_limiter, 'DB_PATH', str(tmp_path / 'limits.db'))
+    assert isinstance(login_limiter.shared(), login_limiter.SqliteLoginLimiter)
+    assert login_limiter.shared() is login_limiter.shared()
@@ -0,0 +1,59 @@
+# MindfulBuddy - Columnar mood history tests
+import os
+from datetime import datetime
+
+import data_store
+import mood_columns
+
+
+def checkins(*moods):
+    store = data_store.open_store('family', {'family_members': {}})
+    store.create_user('sam', {})
+    for day, mood in enumerate(moods, start=1):
+        store.add_mood_entry('sam', {'date': f'2026-01-{day:02d}T09:30:00', 'mood': mood, 'sleep': 7,
+                                     'notes': f'day {day}'})
+    return store
+
+
+def test_columns_mirror_the_history():
+    store = checkins(3, 5, 8)
+    columns = mood_columns.load(store, 'sam')
+    assert len(columns) == 3
+    assert columns.mood.tolist() == [3, 5, 8]
+    assert columns.sleep.tolist() == [7, 7, 7]
+    assert columns.energy.tolist() == [0, 0, 0]
+    assert str(columns.dates()[0]) == '2026-01-01T09:30:00'
+    assert columns.days_since_last(datetime(2026, 1, 10)) == 7
+    assert columns.side()[1] == {'notes': 'day 2'}
+
+
+def test_new_entries_are_appended():
+    store = checkins(3)
+    mood_columns.load(store, 'sam')
+    store.add_mood_entry('sam', {'date': '2026-01-02T10:00:00', 'mood': 9})
+    columns = mood_columns.load(store, 'sam')
+    assert columns.mood.tolist() == [3, 9]
+    assert columns.side() == {0: {'notes': 'day 1'}}
+
+
+def test_a_recreated_user_is_rebuilt():
+    store = checkins(3, 4)
+    mood_columns.load(store, 'sam')
+    store.delete_user('sam')
+    store.create_user('sam', {})
+    store.add_mood_entry('sam', {'date': '2026-02-01T08:00:00', 'mood': 6})
+    store.add_mood_entry('sam', {'date': '2026-02-02T08:00:00', 'mood': 2})
+    assert mood_columns.load(store, 'sam').mood.tolist() == [6, 2]
+
+
+def test_columns_left_uneven_by_a_crash_are_repaired():
+    store = checkins(3, 4)
+    directory = mood_columns.column_dir('family', 'sam')
+    mood_columns.load(store, 'sam')
+    # The process died after writing a score but before its timestamp
+    with open(os.path.join(directory, 'mood.u8'), 'ab') as file:
+        file.write(b'\x05')
+    store.add_mood_entry('sam', {'date': '2026-01-03T09:00:00', 'mood': 7})
+    columns = mood_columns.load(store, 'sam')
+    assert columns.mood.tolist() == [3, 4, 7]
+    assert os.path.getsize(os.path.join(directory, 'mood.u8')) == 3
@@ -0,0 +1,54 @@
+# MindfulBuddy - Password hashing tests
+import hashlib
+
+import password_hashing
+import sqlite_store
+
+
+class Users:
+    """The store interface check_password needs"""
+
+    def __init__(self, **users):
+        self.users = {name: {'password_hash': stored} for name, stored in users.items()}
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def update_user(self, username, **fields):
+        self.users[username].update(fields)
+
+
+def test_hash_and_verify():
+    stored = password_hashing.hash_password('correct horse')
+    assert stored.startswith(password_hashing.ALGORITHM + '$')
+    assert password_hashing.verify_password('correct horse', stored)
+    assert not password_hashing.verify_password('wrong', stored)
+    assert not password_hashing.verify_password('correct horse', None)
+    assert stored != password_hashing.hash_password('correct horse')  # salted
+
+
+def test_weaker_hashes_need_a_rehash():
+    weak = password_hashing.hash_password('pw', iterations=10)
+    assert password_hashing.needs_rehash(weak)
+    assert not password_hashing.needs_rehash(password_hashing.hash_password('pw'))
+    assert password_hashing.needs_rehash(hashlib.sha256(b'pw').hexdigest())
+
+
+def test_legacy_hash_is_upgraded_on_login():
+    legacy = hashlib.sha256(b'pw').hexdigest()
+    users = Users(alice=legacy)
+    assert not password_hashing.check_password(users, 'alice', 'wrong')
+    assert users.get_user('alice')['password_hash'] == legacy
+    assert password_hashing.check_password(users, 'alice', 'pw')
+    upgraded = users.get_user('alice')['password_hash']
+    assert upgraded != legacy and password_hashing.verify_password('pw', upgraded)
+
+
+def test_upgrade_is_saved_through_a_sqlite_store(tmp_path):
+    # SQLite connections belong to the thread that opened them
+    store = sqlite_store.SqliteStore('secure', str(tmp_path / 'test.db'))
+    store.create_user('alice', {'password_hash': password_hashing.hash_password('pw', iterations=10)})
+    assert password_hashing.check_password(store, 'alice', 'pw')
+    upgraded = store.get_user('alice')['password_hash']
+    assert not password_hashing.needs_rehash(upgraded)
+    assert password_hashing.verify_password('pw', upgraded)
@@ -0,0 +1,140 @@
+# MindfulBuddy - Security log tests
+import os
+
+import audit_query
+import data_store
+import security_log
+
+
+def event(n, username):
+    return {'timestamp': f'2026-01-01T00:00:{n % 60:02d}', 'event': f'login {n}', 'username': username}
+
+
+def names(events):
+    return [entry['event'] for entry in events]
+
+
+def test_recent_events_of_a_user():
+    log = security_log.SecurityLog('app')
+    for n in range(6):
+        log.append(event(n, 'alice' if n % 2 else 'bob'))
+    assert names(log.recent('alice', limit=2)) == ['login 3', 'login 5']
+    assert names(log.recent(limit=3)) == ['login 3', 'login 4', 'login 5']
+    assert log.recent('carol') == []
+
+
+def test_rotation_keeps_every_event():
+    log = security_log.SecurityLog('app', max_bytes=300)
+    for n in range(20):
+        log.append(event(n, 'alice'))
+    files = log.files()
+    assert len(files) > 2 and files[-1] == log.current
+    assert all(os.path.getsize(path) <= 300 for path in files)
+    assert names(log.tail(20)) == [f'login {n}' for n in range(20)]
+
+
+def test_other_writers_show_up_across_a_rotation():
+    writer = security_log.SecurityLog('app', max_bytes=300)
+    writer.append(event(0, 'alice'))
+    reader = security_log.SecurityLog('app', max_bytes=300)
+    for n in range(1, 10):
+        writer.append(event(n, 'alice'))
+    assert len(reader.files()) > 1
+    assert names(reader.recent('alice', limit=10)) == [f'login {n}' for n in range(10)]
+
+
+def test_a_reader_opened_before_any_event_sees_rotated_files():
+    reader = security_log.SecurityLog('app', max_bytes=300)
+    writer = security_log.SecurityLog('app', max_bytes=300)
+    for n in range(10):
+        writer.append(event(n, 'alice'))
+    assert len(reader.files()) > 2
+    assert names(reader.recent('alice', limit=10)) == [f'login {n}' for n in range(10)]
+
+
+def test_a_stores_old_events_move_into_the_log_once():
+    store = data_store.open_store('secure', {'users': {}})
+    older = [event(n, 'alice') for n in range(3)]
+    data_store.set_record(store.path, store.data, ['security_log'], older)
+    security_log.SecurityLog('secure').append(event(3, 'alice'))
+    data_store.barrier()
+    assert security_log.migrate_store('secure') == 3
+    assert security_log.migrate_store('secure') == 0
+    data_store._cache.clear()
+    assert 'security_log' not in data_store.load_store(store.path, None)
+    log = security_log.open_log('secure')
+    assert names(log.recent('alice', limit=10)) == [f'login {n}' for n in range(4)]
+    assert os.path.basename(log.files()[0]) == security_log.MIGRATED_FILE
+
+
+def test_events_older_than_the_ring_come_from_the_files():
+    log = security_log.SecurityLog('app', capacity=4)
+    log.append(event(0, 'alice'))
+    for n in range(1, 6):
+        log.append(event(n, 'bob'))
+    assert names(log.recent('alice')) == ['login 0']
+    assert names(log.recent('bob', limit=10)) == [f'login {n}' for n in range(1, 6)]
+    # A new process warms its ring from the newest events on disk
+    assert names(security_log.SecurityLog('app', capacity=4).recent('alice')) == ['login 0']
+
+
+def test_only_users_who_may_have_older_events_are_looked_up(monkeypatch):
+    log = security_log.SecurityLog('app', capacity=4)
+    log.append(event(0, 'alice'))
+    log.append(event(1, 'carol'))
+    for n in range(2, 6):
+        log.append(event(n, 'bob'))
+    lookups = []
+    user_events = log._user_events
+
+    def counted(username, limit):
+        lookups.append(username)
+        return user_events(username, limit)
+    monkeypatch.setattr(log, '_user_events', counted)
+    # Evicted from the ring: read from the files
+    assert names(log.recent('alice')) == ['login 0']
+    assert names(log.recent('alice')) == ['login 0']
+    # Never seen, or wholly in the ring: no lookup
+    assert log.recent('dave') == []
+    log.append(event(6, 'erin'))
+    assert names(log.recent('erin')) == ['login 6']
+    assert lookups == ['alice', 'alice']
+
+
+def test_a_fresh_ring_looks_up_a_user_once(monkeypatch):
+    writer = security_log.SecurityLog('app')
+    for n in range(8):
+        writer.append(event(n, 'bob' if n else 'alice'))
+    log = security_log.SecurityLog('app', capacity=4)
+    lookups = []
+    user_events = log._user_events
+
+    def counted(username, limit):
+        lookups.append(username)
+        return user_events(username, limit)
+    monkeypatch.setattr(log, '_user_events', counted)
+    assert log.recent('carol') == [] and log.recent('carol') == []
+    assert names(log.recent('alice')) == ['login 0']
+    assert lookups == ['carol', 'alice']
+
+
+def test_lookups_use_the_apps_audit_index(tmp_path):
+    log = security_log.SecurityLog('app', capacity=2)
+    for n in range(4):
+        log.append(event(n, 'bob' if n else 'alice'))
+    assert names(log.recent('alice')) == ['login 0']
+    assert log._index is audit_query.open_index('app')
+    elsewhere = security_log.SecurityLog('app', directory=str(tmp_path / 'elsewhere'), capacity=2)
+    for n in range(4):
+        elsewhere.append(event(n, 'bob' if n else 'alice'))
+    assert names(elsewhere.recent('alice')) == ['login 0']
+    assert elsewhere._index is not audit_query.open_index('app')
+
+
+def test_a_torn_last_line_is_not_an_event():
+    log = security_log.SecurityLog('app')
+    log.append(event(0, 'alice'))
+    with open(log.current, 'a') as file:
+        file.write('{"timestamp": "2026')
+    assert names(security_log.SecurityLog('app').recent('alice')) == ['login 0']
+    assert security_log.open_log('app') is security_log.open_log('app')
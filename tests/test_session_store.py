@@ -0,0 +1,113 @@
+# MindfulBuddy - Login session tests
+import multiprocessing
+import os
+import stat
+import time
+
+import data_store
+import session_store
+
+
+def test_create_validate_delete():
+    sessions = session_store.SessionStore('app')
+    session = sessions.create('token', 'alice', device='phone')
+    assert session['expires'] > time.time()
+    assert sessions.validate('token') == session
+    assert sessions.validate('token', 'bob') is None
+    sessions.delete('token')
+    assert sessions.validate('token') is None
+
+
+def test_expired_sessions_do_not_validate():
+    sessions = session_store.SessionStore('app', ttl=-1)
+    sessions.create('token', 'alice')
+    assert sessions.validate('token') is None
+
+
+def test_expired_sessions_are_swept():
+    sessions = session_store.SessionStore('app', ttl=60)
+    sessions.create('first', 'alice')
+    sessions.create('second', 'bob')
+    assert sessions.sweep(now=time.time() + 30) == 0
+    assert len(sessions) == 2
+    assert sessions.sweep(now=time.time() + 61) == 2
+    assert len(sessions) == 0
+
+
+def test_sessions_written_elsewhere_are_swept_too():
+    sessions = session_store.SessionStore('app', ttl=60)
+    data = data_store.load_store(sessions.path, None)
+    data_store.set_record(sessions.path, data, ['sessions', 'other'],
+                          {'username': 'carol', 'expires': time.time() + 10})
+    assert sessions.sweep(now=time.time() + 11) == 1
+    assert sessions.validate('other') is None
+
+
+def test_start_issues_a_random_token():
+    sessions = session_store.SessionStore('app', mode='store')
+    first, second = sessions.start('alice'), sessions.start('alice')
+    assert first != second
+    assert sessions.validate(first)['username'] == 'alice'
+
+
+def test_signed_tokens_verify_without_a_table(monkeypatch):
+    monkeypatch.setenv('MINDFUL_SESSION_KEY', 'test-key')
+    sessions = session_store.SessionStore('app', mode='signed')
+    token = sessions.start('alice')
+    assert sessions.validate(token)['username'] == 'alice'
+    assert sessions.validate(token, 'bob') is None
+    assert sessions.validate(token[:-2] + 'xx') is None
+    assert not os.path.exists(sessions.path)
+    key = b'test-key'
+    assert session_store.verify_token(key, session_store.sign_token(key, 'a', 60), now=time.time() + 61) is None
+    assert session_store.verify_token(b'other-key', token) is None
+
+
+def test_signed_logout_revokes_until_expiry(monkeypatch):
+    monkeypatch.setenv('MINDFUL_SESSION_KEY', 'test-key')
+    sessions = session_store.SessionStore('app', ttl=60, mode='signed')
+    token = sessions.start('alice')
+    sessions.delete(token)
+    assert sessions.validate(token) is None
+    assert sessions.sweep(now=time.time() + 30) == 0
+    assert sessions.sweep(now=time.time() + 61) == 1
+
+
+def test_workers_share_a_generated_key(monkeypatch):
+    monkeypatch.delenv('MINDFUL_SESSION_KEY', raising=False)
+    key = session_store.server_key()
+    assert session_store.server_key() == key
+    assert stat.S_IMODE(os.stat(session_store.KEY_FILE).st_mode) == 0o600
+
+
+def test_open_sessions_shares_one_store_per_app():
+    assert session_store.open_sessions('secure') is session_store.open_sessions('secure')
+    assert session_store.open_sessions('secure').path == 'secure_sessions.json'
+
+
+def test_take_hands_a_session_out_once():
+    codes = session_store.SessionStore('codes', mode='store')
+    code = codes.start('alice', session='token')
+    assert codes.take(code)['session'] == 'token'
+    assert codes.take(code) is None
+    assert codes.validate(code) is None
+
+
+def take_all(codes):
+    store = session_store.SessionStore('codes', mode='store')
+    taken = [code for code in codes if store.take(code) is not None]
+    # Pool workers leave without running atexit
+    data_store.barrier()
+    return taken
+
+
+def test_two_processes_never_take_the_same_code():
+    store = session_store.SessionStore('codes', mode='store')
+    codes = [store.start('alice', session=f"token{n}") for n in range(100)]
+    data_store.barrier()
+    with multiprocessing.get_context('fork').Pool(2) as pool:
+        first, second = pool.map(take_all, [codes, codes])
+    assert sorted(first + second) == sorted(codes)
+    data_store._cache.clear()
+    # No stub of a taken session is left behind
+    assert store._sessions() == {}
@@ -0,0 +1,53 @@
+# MindfulBuddy - Sharded backend tests
+import os
+
+import data_store
+import shard_store
+
+
+def single_file_store():
+    store = data_store.open_store('secure', {'users': {}})
+    for username in ('alice', 'bob'):
+        store.create_user(username, {'password_hash': username})
+        store.add_mood_entry(username, {'date': '2026-01-01', 'mood': len(username)})
+    store.create_session('token', {'username': 'alice'})
+    store.increment('stats', 'logins', 2)
+    return store
+
+
+def test_migration_splits_users_into_shards(monkeypatch):
+    single_file_store()
+    monkeypatch.setattr(data_store, 'BACKEND', 'sharded')
+    store = data_store.open_store('secure')
+    assert isinstance(store, shard_store.ShardStore)
+    assert shard_store.is_migrated('secure')
+    assert store.list_users() == ['alice', 'bob']
+    assert store.get_user('bob') == {'password_hash': 'bob'}
+    assert store.mood_history('alice') == [{'date': '2026-01-01', 'mood': 5}]
+    assert store.get_session('token') == {'username': 'alice'}
+    assert store.get_section('stats') == {'logins': 2}
+    assert os.path.exists(shard_store.shard_path(store.directory, 'alice'))
+
+
+def test_writes_go_to_one_shard():
+    shard_store.migrate('secure', {'users': {}})
+    store = shard_store.ShardStore('secure')
+    assert store.create_user('carol', {'password_hash': 'x', 'mood_history': [1]})
+    assert not store.create_user('carol', {})
+    store.add_mood_entry('carol', {'date': '2026-01-02', 'mood': 4})
+    store.add_messages('carol', [{'role': 'user', 'content': 'hi'}])
+    path = shard_store.shard_path(store.directory, 'carol')
+    assert data_store.load_store(path, None)['mood_history'] == [{'date': '2026-01-02', 'mood': 4}]
+    assert 'mood_history' not in store.get_user('carol')
+    assert store.messages('carol') == [{'role': 'user', 'content': 'hi'}]
+    store.delete_user('carol')
+    assert not store.user_exists('carol')
+    assert not os.path.exists(path)
+
+
+def test_migrate_command_skips_migrated_stores(capsys):
+    single_file_store()
+    assert shard_store.main(['migrate', 'secure']) == 0
+    assert shard_store.main(['migrate']) == 0
+    output = capsys.readouterr().out.splitlines()
+    assert output == ['secure: 2 users -> secure_app_data/', 'secure: already migrated to secure_app_data/']
@@ -0,0 +1,72 @@
+# MindfulBuddy - SQLite backend tests
+import multiprocessing
+
+import data_store
+import sqlite_store
+
+
+def fill(store):
+    store.create_user('alice', {'password_hash': 'h', 'created_date': '2026-01-01', 'email': 'a@x'})
+    for day, mood in (('2026-01-01', 3), ('2026-01-02', 5), ('2026-01-03', 7)):
+        store.add_mood_entry('alice', {'date': day, 'mood': mood, 'energy': 4, 'note': day})
+    store.increment('stats', 'checkins', 3)
+
+
+def test_queries_match_the_json_store(tmp_path):
+    json_store = data_store.JsonStore('analytics', {'users': {}})
+    sqlite = sqlite_store.SqliteStore('analytics', str(tmp_path / 'test.db'))
+    for store in (json_store, sqlite):
+        fill(store)
+    for store in (json_store, sqlite):
+        assert store.user_exists('alice') and not store.create_user('alice', {})
+        assert store.get_user('alice') == {'password_hash': 'h', 'created_date': '2026-01-01', 'email': 'a@x'}
+        assert [entry['mood'] for entry in store.mood_history('alice', '2026-01-02', '2026-01-03')] == [5]
+        assert store.latest_mood('alice') == {'date': '2026-01-03', 'mood': 7, 'energy': 4, 'note': '2026-01-03'}
+        assert store.mood_count('alice') == 3
+        assert store.get_section('stats') == {'checkins': 3}
+
+
+def test_apps_share_the_database_but_not_rows(tmp_path):
+    path = str(tmp_path / 'test.db')
+    secure = sqlite_store.SqliteStore('secure', path)
+    analytics = sqlite_store.SqliteStore('analytics', path)
+    secure.create_user('alice', {})
+    secure.add_messages('alice', [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'hello'}])
+    assert not analytics.user_exists('alice')
+    assert analytics.messages('alice') == []
+    assert secure.messages('alice', limit=1) == [{'role': 'assistant', 'content': 'hello'}]
+
+
+def test_first_open_imports_the_json_file(monkeypatch):
+    json_store = data_store.open_store('analytics', {'users': {}})
+    fill(json_store)
+    monkeypatch.setattr(data_store, 'BACKEND', 'sqlite')
+    store = data_store.open_store('analytics')
+    assert isinstance(store, sqlite_store.SqliteStore)
+    assert store.mood_count('alice') == 3
+    assert not store.needs_import()
+    # Later opens do not import again
+    assert data_store.open_store('analytics').mood_count('alice') == 3
+
+
+def write_many(args):
+    path, worker = args
+    store = sqlite_store.SqliteStore('analytics', path)
+    created = store.create_user('shared', {})
+    for index in range(50):
+        store.add_mood_entry('shared', {'date': f'2026-01-{worker + 1:02d}', 'mood': index % 10})
+        store.increment('stats', 'checkins')
+        store.update_user('shared', **{f'worker{worker}': index})
+    return created
+
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    path = str(tmp_path / 'test.db')
+    sqlite_store.SqliteStore('analytics', path)  # create the schema once
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        created = pool.map(write_many, [(path, worker) for worker in range(4)])
+    store = sqlite_store.SqliteStore('analytics', path)
+    assert created.count(True) == 1
+    assert store.mood_count('shared') == 200
+    assert store.get_section('stats') == {'checkins': 200}
+    assert {f'worker{worker}': 49 for worker in range(4)}.items() <= store.get_user('shared').items()
@@ -0,0 +1,199 @@
+# MindfulBuddy - Single sign-on tests
+import json
+import socket
+import threading
+
+import pytest
+
+import data_store
+import password_hashing
+import sso_service
+
+
+def app_store(name, **users):
+    """An app's json store holding pre-service accounts (username=password)"""
+    store = data_store.open_store(name, {'users': {}})
+    for username, password in users.items():
+        store.create_user(username, {'password_hash': password_hashing.hash_password(password)})
+    return store
+
+
+@pytest.fixture
+def server(tmp_path):
+    servers = []
+
+    def start(address=None):
+        server = sso_service.make_server(address or str(tmp_path / 'sso.sock'))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_restore_does_not_attach_to_another_apps_account():
+    secure = app_store('secure', alice='alice-secret')
+    analytics = app_store('analytics')
+    token = sso_service.sign_up(analytics, 'alice', 'not-alice', {})
+    assert token
+    assert sso_service.restore(secure, token, dict) is None
+    assert 'sso_id' not in secure.get_user('alice')
+
+
+def test_pre_service_account_keeps_its_own_login_when_the_name_is_taken():
+    secure = app_store('secure', alice='alice-secret')
+    sso_service.sign_up(app_store('analytics'), 'alice', 'not-alice', {})
+    assert sso_service.sign_in(secure, 'alice', 'alice-secret') == {'token': None}
+    assert sso_service.sign_in(secure, 'alice', 'not-alice') is None
+
+
+def test_sign_up_refuses_a_username_the_app_or_service_has():
+    secure = app_store('secure', bob='bob-secret')
+    mobile = app_store('ultimate')
+    assert sso_service.sign_up(secure, 'bob', 'other', {}) is None
+    token = sso_service.sign_up(mobile, 'bob', 'other', {})
+    assert token and sso_service.restore(secure, token, dict) is None
+    assert sso_service.sign_up(app_store('analytics'), 'bob', 'third', {}) is None
+
+
+def test_pre_service_account_moves_over_only_with_its_own_password():
+    ultimate = app_store('ultimate', carol='carol-secret')
+    assert sso_service.sign_in(ultimate, 'carol', 'guess') is None
+    assert not sso_service.client().has_user('carol')
+    token = sso_service.sign_in(ultimate, 'carol', 'carol-secret')['token']
+    analytics = app_store('analytics')
+    assert sso_service.restore(analytics, token, dict) == 'carol'
+    assert sso_service.restore(ultimate, token, dict) == 'carol'
+    assert analytics.get_user('carol')['sso_id'] == ultimate.get_user('carol')['sso_id']
+
+
+def test_codes_are_single_use():
+    identity = sso_service.client()
+    token = sso_service.sign_up(app_store('analytics'), 'dana', 'dana-secret', {})
+    code = identity.issue_code(token)
+    assert code != token
+    assert identity.redeem(code) == token
+    assert identity.redeem(code) is None
+    identity.logout(token)
+    assert identity.issue_code(token) is None
+
+
+def test_resume_swaps_the_url_code_for_the_token():
+    analytics = app_store('analytics')
+    token = sso_service.sign_up(analytics, 'erin', 'erin-secret', {})
+    first, params = {}, {}
+    sso_service.keep(first, params, token)
+    assert params['sso'] != token
+    second, link = {}, dict(params)
+    assert sso_service.resume(analytics, second, link, dict) == 'erin'
+    assert second['sso_token'] == token and link['sso'] != params['sso']
+    # The code the first page put in its URL is used up
+    assert sso_service.resume(analytics, {}, dict(params), dict) is None
+    sso_service.sign_out(second, link)
+    assert 'sso' not in link
+    assert sso_service.restore(analytics, token, dict) is None
+
+
+def test_login_is_rate_limited():
+    sso_service.sign_up(app_store('analytics'), 'frank', 'frank-secret', {})
+    identity = sso_service.client()
+    for _ in range(5):
+        assert identity.login('frank', 'wrong') == {'error': 'invalid'}
+    assert identity.login('frank', 'frank-secret') == {'error': 'throttled'}
+
+
+def test_remote_clients_cannot_adopt_or_register_a_hash(server):
+    remote = sso_service.ServiceClient(server().server_address)
+    with pytest.raises(ValueError):
+        remote.call('adopt', username='mallory', password_hash='x')
+    with pytest.raises(ValueError):
+        remote.call('register', username='mallory', password='p', password_hash='x')
+    assert not remote.has_user('mallory')
+    assert not hasattr(remote, 'adopt')
+
+
+def test_tcp_needs_the_service_key(server, monkeypatch):
+    monkeypatch.setenv('MINDFUL_SSO_KEY', 'test-key')
+    address = server(('127.0.0.1', 0)).server_address
+    assert sso_service.ServiceClient(address).call('ping') is True
+    with pytest.raises(ConnectionError):
+        sso_service.ServiceClient(address, key=b'wrong').call('ping')
+    with socket.create_connection(address) as sock, sock.makefile('rb') as reader:
+        reader.readline()  # the challenge, unanswered
+        sock.sendall(b'{"op": "has_user", "username": "x"}\n')
+        assert 'error' in json.loads(reader.readline())
+        assert reader.readline() == b''
+
+
+def test_apps_use_a_running_service(server):
+    remote = sso_service.ServiceClient(server().server_address)
+    assert remote.call('ping') is True
+    assert remote.register('gina', 'gina-secret')
+    token = remote.login('gina', 'gina-secret')['token']
+    assert remote.validate(token)['username'] == 'gina'
+    assert remote.login('gina', 'wrong') == {'error': 'invalid'}
+    with pytest.raises(ValueError):
+        remote.call('shutdown')
+    # Pooled connections are reused
+    assert remote._idle.qsize() == 1
+
+
+def test_a_failing_request_is_an_error_reply(server):
+    running = server()
+    remote = sso_service.ServiceClient(running.server_address)
+
+    def broken(token):
+        raise KeyError(token)
+    running.service.validate = broken
+    with pytest.raises(RuntimeError):
+        remote.validate('token')
+    # The same connection goes on serving
+    assert remote._idle.qsize() == 1
+    assert remote.call('ping') is True
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_a_login_is_not_sent_twice(server):
+    running = server()
+    remote = sso_service.ServiceClient(running.server_address)
+    calls = []
+
+    def dies(username, password):
+        calls.append(username)
+        raise SystemExit  # the connection drops after the login ran
+    running.service.login = dies
+    with pytest.raises(ConnectionError):
+        remote.login('hana', 'hana-secret')
+    assert calls == ['hana']
+
+
+def test_idle_connections_the_server_closed_are_not_used(server):
+    remote = sso_service.ServiceClient(server().server_address)
+    assert remote.register('hana', 'hana-secret')
+    dead, peer = socket.socketpair()
+    peer.close()
+    remote._idle.put((dead, dead.makefile('rb')))
+    assert 'token' in remote.login('hana', 'hana-secret')
+
+
+def test_requests_run_in_process_while_the_service_is_down(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(sso_service, 'RECONNECT_SECONDS', 0)
+    address = str(tmp_path / 'sso.sock')
+    remote = sso_service.ServiceClient(address, fallback=sso_service.IdentityService)
+    assert remote.register('ivan', 'ivan-secret')
+    assert remote._idle.qsize() == 0
+    with pytest.raises(sso_service.ServiceDown):
+        sso_service.ServiceClient(address).call('ping')
+    # Back up: the first call RECONNECT_SECONDS later goes to it
+    server(address)
+    assert 'token' in remote.login('ivan', 'ivan-secret')
+    assert remote._idle.qsize() == 1
+
+
+def test_without_a_service_apps_share_the_files():
+    identity = sso_service.client()
+    assert identity is sso_service.client()
+    assert identity.register('jo', 'jo-secret')
+    assert sso_service.IdentityService().has_user('jo')
@@ -0,0 +1,25 @@
+# MindfulBuddy - Storage benchmark tests
+import json
+
+import storage_benchmark
+
+
+def test_suite_reports_every_operation_for_each_store_and_backend(tmp_path, capsys):
+    output = tmp_path / 'results.json'
+    assert storage_benchmark.main(['suite', '--users', '20', '--entries', '2', '--messages', '2',
+                                   '--samples', '3', '--backends', 'json', 'sqlite',
+                                   '--output', str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert report['benchmark'] == 'suite'
+    assert report['settings']['backends'] == ['json', 'sqlite']
+    operations = {(result['store'], result['backend'], result['operation']) for result in report['results']}
+    assert len(operations) == len(report['results']) == len(storage_benchmark.SUITE_STORES) * 2 * 6
+    assert all(result['p50_ms'] <= result['p99_ms'] for result in report['results'])
+    assert 'load_cold' in capsys.readouterr().out
+
+
+def test_percentiles():
+    values = list(range(1, 101))
+    assert storage_benchmark.percentile(values, 50) == 50
+    assert storage_benchmark.percentile(values, 99) == 99
+    assert storage_benchmark.percentile([7], 99) == 7
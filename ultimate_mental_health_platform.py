@@ -1,7 +1,5 @@
 # MindfulBuddy - ULTIMATE PROFESSIONAL PLATFORM v4.0
 import streamlit as st
-import json
-import hashlib
 import secrets
 import pandas as pd
 import numpy as np
@@ -10,6 +8,8 @@ import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
 import calendar
+import data_store
+import sso_service
 
 # Ultimate platform config
 st.set_page_config(
@@ -118,35 +118,30 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Security functions
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(password, hashed):
-    return hash_password(password) == hashed
+def default_ultimate_data():
+    return {
+        'users': {},
+        'platform_stats': {
+            'total_users': 0,
+            'total_checkins': 0,
+            'success_stories': 47,
+            'platform_rating': 4.9
+        },
+        'app_metadata': {
+            'version': '4.0.0',
+            'platform_level': 'ultimate'
+        }
+    }
 
 def load_ultimate_data():
-    try:
-        with open('ultimate_platform_data.json', 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {
-            'users': {},
-            'platform_stats': {
-                'total_users': 0,
-                'total_checkins': 0,
-                'success_stories': 47,
-                'platform_rating': 4.9
-            },
-            'app_metadata': {
-                'version': '4.0.0',
-                'platform_level': 'ultimate'
-            }
-        }
+    return data_store.open_store('ultimate', default_ultimate_data)
 
-def save_ultimate_data(data):
-    with open('ultimate_platform_data.json', 'w') as file:
-        json.dump(data, file, indent=2)
+def new_ultimate_user():
+    """This app's record for a user signed in through another app"""
+    return {
+        'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'account_type': 'ultimate_professional'
+    }
 
 # Ultimate header
 st.markdown("""
@@ -164,17 +159,21 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load data
-app_data = load_ultimate_data()
+store = load_ultimate_data()
 
 # Initialize session
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 
+# Signed in through the shared identity service; a one-time ?sso=<code> carries the login between apps
+if 'sso' in st.query_params or st.session_state.get('sso_token'):
+    st.session_state.current_user = sso_service.resume(store, st.session_state, st.query_params, new_ultimate_user)
+
 # Sidebar
 with st.sidebar:
     st.markdown("### 🌟 Platform Overview")
     
-    stats = app_data.get('platform_stats', {})
+    stats = store.get_section('platform_stats')
     st.metric("👥 Users Helped", f"{stats.get('total_users', 0):,}")
     st.metric("📊 Check-ins Completed", f"{stats.get('total_checkins', 0):,}")
     st.metric("⭐ Platform Rating", f"{stats.get('platform_rating', 4.9)}/5.0")
@@ -268,7 +267,9 @@ if st.session_state.current_user is None:
         
         if st.button("🌟 Access Platform", type="primary", use_container_width=True):
             if login_name and login_password:
-                if login_name in app_data['users'] and verify_password(login_password, app_data['users'][login_name]['password_hash']):
+                signed_in = sso_service.sign_in(store, login_name, login_password, new_ultimate_user)
+                if signed_in:
+                    sso_service.keep(st.session_state, st.query_params, signed_in['token'])
                     st.session_state.current_user = login_name
                     st.success(f"🌟 Welcome, {login_name}!")
                     st.rerun()
@@ -283,18 +284,13 @@ if st.session_state.current_user is None:
         age_group = st.selectbox("Age Group:", ["13-17", "18-24", "25-34", "35+"])
         
         if st.button("🌟 Create Account", type="primary", use_container_width=True):
-            if signup_name and signup_password and signup_name not in app_data['users']:
-                app_data['users'][signup_name] = {
-                    'password_hash': hash_password(signup_password),
-                    'age_group': age_group,
-                    'mood_history': [],
-                    'created_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'account_type': 'ultimate_professional'
-                }
-                
-                app_data['platform_stats']['total_users'] += 1
-                save_ultimate_data(app_data)
+            token = sso_service.sign_up(store, signup_name, signup_password,
+                                        {**new_ultimate_user(), 'age_group': age_group}) \
+                if signup_name and signup_password else None
+            if token:
+                store.increment('platform_stats', 'total_users')
                 
+                sso_service.keep(st.session_state, st.query_params, token)
                 st.session_state.current_user = signup_name
                 st.success(f"🌟 Account created! Welcome, {signup_name}!")
                 st.rerun()
@@ -303,7 +299,7 @@ if st.session_state.current_user is None:
 
 else:
     # Dashboard for logged-in users
-    user_data = app_data['users'][st.session_state.current_user]
+    user_data = store.get_user(st.session_state.current_user)
     
     st.markdown(f"""
     <div class="ultimate-card">
@@ -323,8 +319,9 @@ else:
     )
     
     if nav_choice == "🏠 Dashboard":
-        if user_data.get('mood_history'):
-            moods = [entry['mood'] for entry in user_data['mood_history']]
+        mood_history = store.mood_history(st.session_state.current_user)
+        if mood_history:
+            moods = [entry['mood'] for entry in mood_history]
             
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -337,7 +334,7 @@ else:
             
             # Simple chart
             if len(moods) >= 2:
-                df = pd.DataFrame(user_data['mood_history'])
+                df = pd.DataFrame(mood_history)
                 df['date'] = pd.to_datetime(df['date'])
                 
                 fig = go.Figure()
@@ -378,12 +375,8 @@ else:
             if note:
                 entry['note'] = note
             
-            if 'mood_history' not in user_data:
-                user_data['mood_history'] = []
-            
-            user_data['mood_history'].append(entry)
-            app_data['platform_stats']['total_checkins'] += 1
-            save_ultimate_data(app_data)
+            store.add_mood_entry(st.session_state.current_user, entry)
+            store.increment('platform_stats', 'total_checkins')
             
             st.success("✅ Check-in completed!")
             st.balloons()
@@ -393,9 +386,11 @@ else:
         
         st.write(f"**Username:** {st.session_state.current_user}")
         st.write(f"**Account:** {user_data.get('account_type', 'Ultimate')}")
-        st.write(f"**Data Points:** {len(user_data.get('mood_history', []))}")
+        st.write(f"**Data Points:** {store.mood_count(st.session_state.current_user)}")
         
         if st.button("🚪 Logout", use_container_width=True):
+            sso_service.sign_out(st.session_state, st.query_params)
+            st.query_params.clear()
             st.session_state.current_user = None
             st.rerun()
 